@@ -3,6 +3,7 @@ from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django import forms
 from django.contrib.auth.hashers import make_password
 from .models import CustomUser, PendingUser, Category, Property, Photo, Video, Review, Contact, ContactMessage
+from . import search
 
 # Formulaire Admin personnalisé pour CustomUser
 class CustomUserAdminForm(forms.ModelForm):
@@ -66,6 +67,15 @@ class CustomUserAdmin(BaseUserAdmin):
     date_hierarchy = 'created_at'
     ordering = ('-created_at',)
 
+# Les managers par défaut masquent les éléments supprimés ; l'admin voit tout
+class AllObjectsAdminMixin:
+    def get_queryset(self, request):
+        qs = self.model.all_objects.get_queryset()
+        ordering = self.get_ordering(request)
+        if ordering:
+            qs = qs.order_by(*ordering)
+        return qs
+
 # Inline pour Photo et Video
 class PhotoInline(admin.TabularInline):
     model = Photo
@@ -104,10 +114,10 @@ class PhotoAdmin(admin.ModelAdmin):
 
 @admin.register(Video)
 class VideoAdmin(admin.ModelAdmin):
-    list_display = ('property', 'video_file', 'order', 'created_at', 'deleted_at')
-    list_filter = ('property', 'created_at', 'deleted_at')
+    list_display = ('property', 'video_file', 'order', 'processing_status', 'created_at', 'deleted_at')
+    list_filter = ('processing_status', 'property', 'created_at', 'deleted_at')
     search_fields = ('property__location',)
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = ('created_at', 'updated_at', 'processing_status', 'duration', 'poster')
     ordering = ('order',)
     def get_queryset(self, request):
         # Filtrer les vidéos non supprimées dans la liste
@@ -135,7 +145,7 @@ class CategoryAdmin(admin.ModelAdmin):
     ordering = ('name',)
 
 @admin.register(Property)
-class PropertyAdmin(admin.ModelAdmin):
+class PropertyAdmin(AllObjectsAdminMixin, admin.ModelAdmin):
     list_display = ('category', 'owner', 'location', 'price_per_month', 'is_available', 'created_at')
     list_filter = ('category', 'is_available', 'created_at')
     search_fields = ('location', 'description')
@@ -144,8 +154,14 @@ class PropertyAdmin(admin.ModelAdmin):
     ordering = ('-created_at',)
     inlines = [PhotoInline, VideoInline]
 
+    def get_search_results(self, request, queryset, search_term):
+        # Utiliser l'index plein texte plutôt que des icontains sur location/description
+        if not search_term:
+            return queryset, False
+        return search.search_properties(queryset, search_term), False
+
 @admin.register(Review)
-class ReviewAdmin(admin.ModelAdmin):
+class ReviewAdmin(AllObjectsAdminMixin, admin.ModelAdmin):
     list_display = ('property', 'tenant', 'date_posted')
     list_filter = ('date_posted',)
     search_fields = ('message', 'tenant__username')
@@ -0,0 +1,8 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('properties/', views.properties, name='api_properties'),
+    path('properties/<uuid:property_id>/photos/', views.property_photos, name='api_property_photos'),
+    path('reviews/', views.reviews, name='api_reviews'),
+]
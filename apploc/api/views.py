@@ -0,0 +1,169 @@
+"""
+API JSON en lecture seule pour le client mobile : propriétés, photos et avis.
+
+Les filtres et le tri des propriétés sont ceux de la recherche HTML
+(``apploc.facets``). Les lignes sont lues avec ``.values()`` réduit aux
+colonnes des champs demandés (``?fields=id,location``), sans instancier de
+modèles, et paginées par curseur (``apploc.pagination``). ``?format=ndjson``
+renvoie tous les résultats en flux, un objet JSON par ligne, lus par lots
+avec ``.iterator()`` : la mémoire reste constante quelle que soit la taille
+de l'export.
+"""
+import json
+import uuid
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.translation import gettext as _
+
+from .. import facets
+from ..conditional import conditional
+from ..models import Photo, Property, Review
+from ..pagination import CURSOR_PARAM, KeysetPaginator
+
+API_PAGE_SIZE = getattr(settings, 'API_PAGE_SIZE', 20)
+API_MAX_PAGE_SIZE = getattr(settings, 'API_MAX_PAGE_SIZE', 100)
+API_STREAM_CHUNK_SIZE = getattr(settings, 'API_STREAM_CHUNK_SIZE', 2000)
+
+
+def _image_url(name):
+    return Photo._meta.get_field('image').storage.url(name) if name else None
+
+
+# Champs exposés : nom -> (colonne ``.values()``, conversion éventuelle)
+PROPERTY_FIELDS = {
+    'id': ('id', None),
+    'location': ('location', None),
+    'category': ('category__name', None),
+    'price_per_month': ('price_per_month', None),
+    'description': ('description', None),
+    'is_available': ('is_available', None),
+    'cover_photo': ('cover_photo__image', _image_url),
+    'review_count': ('review_count', None),
+    'rating_avg': ('rating_avg', None),
+    'latitude': ('latitude', None),
+    'longitude': ('longitude', None),
+    'created_at': ('created_at', None),
+    'updated_at': ('updated_at', None),
+}
+PHOTO_FIELDS = {
+    'id': ('id', None),
+    'property': ('property_id', None),
+    'image': ('image', _image_url),
+    'order': ('order', None),
+    'created_at': ('created_at', None),
+}
+REVIEW_FIELDS = {
+    'id': ('id', None),
+    'property': ('property_id', None),
+    'tenant': ('tenant__username', None),
+    'rating': ('rating', None),
+    'message': ('message', None),
+    'date_posted': ('date_posted', None),
+}
+DEFAULT_PROPERTY_FIELDS = ('id', 'location', 'category', 'price_per_month', 'cover_photo', 'review_count', 'rating_avg')
+
+
+def _requested_fields(request, available, default):
+    requested = request.GET.get('fields', '').split(',')
+    names = list(dict.fromkeys(name.strip() for name in requested if name.strip()))
+    if not names:
+        return list(default)
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ValueError(_('Unknown fields: %(fields)s.') % {'fields': ', '.join(unknown)})
+    return names
+
+
+def _page_size(request):
+    try:
+        size = int(request.GET.get('limit', API_PAGE_SIZE))
+    except ValueError:
+        raise ValueError(_('Invalid limit.'))
+    return min(max(size, 1), API_MAX_PAGE_SIZE)
+
+
+def _serialize(row, names, available):
+    data = {}
+    for name in names:
+        column, convert = available[name]
+        data[name] = convert(row[column]) if convert else row[column]
+    return data
+
+
+def _stream(queryset, names, available):
+    def line(row):
+        return json.dumps(_serialize(row, names, available), cls=DjangoJSONEncoder) + '\n'
+
+    # Sous ASGI, un itérateur synchrone serait lu en entier avant l'envoi
+    if settings.ASYNC_VIEWS:
+        async def lines():
+            async for row in queryset.aiterator(chunk_size=API_STREAM_CHUNK_SIZE):
+                yield line(row)
+        content = lines()
+    else:
+        content = (line(row) for row in queryset.iterator(chunk_size=API_STREAM_CHUNK_SIZE))
+    return StreamingHttpResponse(content, content_type='application/x-ndjson')
+
+
+def _list(request, queryset, available, ordering, default=None):
+    """
+    Réponse JSON (page et liens de pagination) ou flux NDJSON pour
+    ``queryset`` ; seules les colonnes des champs demandés et du tri sont lues.
+    """
+    try:
+        names = _requested_fields(request, available, default or available)
+        per_page = _page_size(request)
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    columns = dict.fromkeys([available[name][0] for name in names] + [field.lstrip('-') for field in ordering])
+    queryset = queryset.values(*columns)
+
+    if request.GET.get('format') == 'ndjson':
+        return _stream(queryset.order_by(*ordering), names, available)
+    paginator = KeysetPaginator(queryset, ordering=ordering, per_page=per_page)
+    page = paginator.page(request.GET.get(CURSOR_PARAM), query_params=request.GET)
+    return JsonResponse({
+        'results': [_serialize(row, names, available) for row in page],
+        'next': request.build_absolute_uri(page.next_url) if page.has_next() else None,
+        'previous': request.build_absolute_uri(page.previous_url) if page.has_previous() else None,
+    })
+
+
+def _uuid_param(request, name):
+    value = request.GET.get(name)
+    if not value:
+        return None
+    try:
+        return uuid.UUID(value)
+    except ValueError:
+        raise ValueError(_('Invalid identifier for %(name)s.') % {'name': name})
+
+
+@conditional('properties', forms=False, personal=False)
+def properties(request):
+    filters = facets.normalize_filters(request.GET)
+    queryset = facets.filter_properties(Property.objects.all(), filters)
+    return _list(
+        request, queryset, PROPERTY_FIELDS, facets.search_ordering(filters, request.GET.get('sort', '')),
+        default=DEFAULT_PROPERTY_FIELDS,
+    )
+
+
+@conditional('properties', forms=False, personal=False)
+def property_photos(request, property_id):
+    queryset = Photo.objects.filter(property_id=property_id, property__deleted_at__isnull=True)
+    return _list(request, queryset, PHOTO_FIELDS, ('order', 'id'))
+
+
+@conditional('reviews', 'properties', forms=False, personal=False)
+def reviews(request):
+    try:
+        property_id = _uuid_param(request, 'property')
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    queryset = Review.objects.all()
+    if property_id:
+        queryset = queryset.filter(property_id=property_id)
+    return _list(request, queryset, REVIEW_FIELDS, ('-date_posted', '-id'))
@@ -0,0 +1,26 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+UserModel = get_user_model()
+
+
+class EmailBackend(ModelBackend):
+    """
+    Authentification par email en une requête, ou sans requête quand la vue
+    a déjà chargé l'utilisateur (``authenticate(request, user=..., password=...)``).
+    ``check_password`` réécrit au passage un hash produit avec un autre
+    algorithme ou un autre coût que ``PASSWORD_HASHERS[0]``.
+    """
+
+    def authenticate(self, request, email=None, password=None, user=None, **kwargs):
+        if password is None or (user is None and email is None):
+            return None  # connexion par username : ModelBackend
+        if user is None:
+            user = UserModel._default_manager.filter(email=email.lower().strip()).first()
+        if user is None:
+            # Même coût qu'un mot de passe erroné : pas d'énumération des comptes par le temps de réponse
+            UserModel().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
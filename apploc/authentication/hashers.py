@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, ScryptPasswordHasher
+
+
+class TunablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    Format ``pbkdf2_sha256`` standard ; le nombre d'itérations vient de
+    ``PASSWORD_PBKDF2_ITERATIONS``. Un hash d'un autre coût est réécrit à la
+    connexion suivante (``must_update``).
+    """
+
+    @property
+    def iterations(self):
+        return getattr(settings, 'PASSWORD_PBKDF2_ITERATIONS', PBKDF2PasswordHasher.iterations)
+
+
+class TunableScryptPasswordHasher(ScryptPasswordHasher):
+    """
+    Format ``scrypt`` standard ; coût réglé par ``PASSWORD_SCRYPT_WORK_FACTOR``.
+    """
+
+    @property
+    def work_factor(self):
+        return getattr(settings, 'PASSWORD_SCRYPT_WORK_FACTOR', ScryptPasswordHasher.work_factor)
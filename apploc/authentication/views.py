@@ -2,20 +2,21 @@ from datetime import timedelta
 from django.db import IntegrityError
 from django.utils import timezone
 import logging
-import random
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth import authenticate, login as auth_login, logout as auth_logout
 from django.utils.translation import gettext_lazy as _
-from apploc.tasks import send_reset_password_email, send_verification_email
 from .forms import PasswordResetForm, PasswordResetRequestForm, SignupForm, LoginForm, VerificationCodeForm
-from ..models import CustomUser, PendingUser, Property
+from .. import otp
+from ..ratelimit import ratelimit
+from ..models import CustomUser, PendingUser, Property, allocate_username, username_base
 from django.contrib.auth import login as auth_login
 
 
 logger = logging.getLogger(__name__)
 
+@ratelimit('signup')
 def signup(request):
     if request.method == 'POST':
         form = SignupForm(request.POST)
@@ -38,18 +39,13 @@ def signup(request):
                     messages.error(request, _("Vous devez attendre 3 minutes avant de demander un nouveau code."))
                     logger.warning(f"Délai de 3 minutes non écoulé pour : {email}")
                     return render(request, 'authentication/signup.html', {'form': form})
-                pending_user.verification_code = str(random.randint(1000, 9999))
+                pending_user.verification_code = otp.new_code(pending_user.verification_code)
                 pending_user.expires_at = timezone.now() + timedelta(minutes=10)
                 pending_user.save()
                 messages.info(request, _("Un nouveau code de vérification a été envoyé à votre email."))
             else:
                 # Générer un username unique
-                base_username = email.split('@')[0].replace('.', '').replace('_', '')[:30]
-                username = base_username
-                counter = 1
-                while CustomUser.objects.filter(username=username).exists() or PendingUser.objects.filter(username=username).exists():
-                    username = f"{base_username}{counter}"
-                    counter += 1
+                username = allocate_username(username_base(email))
 
                 # Vérifier user_type
                 if user_type not in ['tenant', 'owner']:
@@ -58,7 +54,7 @@ def signup(request):
                     return render(request, 'authentication/signup.html', {'form': form})
 
                 # Créer un nouveau pending user
-                verification_code = str(random.randint(1000, 9999))
+                verification_code = otp.new_code()
                 expires_at = timezone.now() + timedelta(minutes=10)
                 pending_user = PendingUser.objects.create(
                     username=username,
@@ -71,21 +67,13 @@ def signup(request):
                 )
                 messages.success(request, _("Un code de vérification a été envoyé à votre email."))
 
-            # Envoyer l'email de vérification
-            try:
-                send_verification_email.delay(email, verification_code)  # Utilisation de Celery
-                logger.info(f"Code OTP envoyé pour : {email}")
-            except Exception as e:
-                pending_user.delete()
-                messages.error(request, _("Erreur lors de l'envoi de l'email. Veuillez réessayer."))
-                logger.error(f"Erreur envoi email pour {email} : {str(e)}")
-                return render(request, 'authentication/signup.html', {'form': form})
-
+            # L'email est envoyé une seule fois par le signal post_save (apploc.otp)
             return redirect('verify_email', email=email)
     else:
         form = SignupForm()
     return render(request, 'authentication/signup.html', {'form': form})
 
+@ratelimit('verify_email')
 def verify_email(request, email):
     email = email.lower().strip()  # Normaliser l'email
     try:
@@ -177,6 +165,7 @@ def verify_email(request, email):
 
     return render(request, 'authentication/verify_email.html', {'form': form, 'email': email})
 
+@ratelimit('login')
 def login(request):
     if request.method == 'POST':
         form = LoginForm(request.POST)
@@ -186,12 +175,13 @@ def login(request):
 
             # Authenticate using CustomUser
             try:
-                user = CustomUser.objects.get(email=email)
+                user = CustomUser.objects.get(email=email.lower().strip())
                 if not user.is_active:
                     messages.error(request, _('Account is disabled.'))
                     logger.warning(f"Login attempt with disabled account: {email}")
                     return render(request, 'authentication/login.html', {'form': form})
-                authenticated_user = authenticate(request, username=user.username, password=password)
+                # Utilisateur déjà chargé : EmailBackend ne refait pas la requête
+                authenticated_user = authenticate(request, user=user, password=password)
                 if authenticated_user is not None:
                     auth_login(request, authenticated_user)
                     if authenticated_user.role == 'admin':
@@ -214,6 +204,7 @@ def login(request):
                     messages.error(request, _('Invalid email or password.'))
                     logger.warning(f"Invalid password for: {email}")
             except CustomUser.DoesNotExist:
+                CustomUser().set_password(password)  # même coût qu'un mot de passe erroné
                 messages.error(request, _('Invalid email or password.'))
                 logger.warning(f"Login attempt with non-existent email: {email}")
     else:
@@ -231,7 +222,7 @@ def owner_dashboard(request):
         messages.error(request, _('Please log in as an approved owner to access the dashboard.'))
         logger.warning("Unauthorized owner dashboard access attempt")
         return redirect('login')
-    properties = Property.objects.filter(owner=request.user, deleted_at__isnull=True)
+    properties = Property.objects.select_related('category', 'cover_photo').filter(owner=request.user)
     return render(request, 'owner_dashboard.html', {'user': request.user, 'properties': properties})
 
 def tenant_dashboard(request):
@@ -239,7 +230,7 @@ def tenant_dashboard(request):
         messages.error(request, _('Please log in as a tenant.'))
         logger.warning("Unauthorized tenant dashboard access attempt")
         return redirect('login')
-    properties = Property.objects.filter(is_available=True, deleted_at__isnull=True)
+    properties = Property.objects.select_related('category', 'cover_photo').filter(is_available=True)
     return render(request, 'tenant_dashboard.html', {'user': request.user, 'properties': properties})
 
 def dashboard_redirect(request):
@@ -265,6 +256,7 @@ def dashboard_redirect(request):
     logger.warning("Unauthorized dashboard access attempt")
     return redirect('login')
 
+@ratelimit('password_reset_request')
 def password_reset_request(request):
     if request.method == 'POST':
         form = PasswordResetRequestForm(request.POST)
@@ -282,14 +274,14 @@ def password_reset_request(request):
                         return render(request, 'authentication/password_reset_request.html', {'form': form})
 
                     # Mettre à jour le code et l'expiration
-                    pending_user.verification_code = str(random.randint(1000, 9999))
+                    pending_user.verification_code = otp.new_code(pending_user.verification_code)
                     pending_user.expires_at = timezone.now() + timedelta(minutes=10)
                     pending_user.user_type = 'reset_password'
                     pending_user.save()
                     messages.info(request, _('A new reset code has been sent to your email.'))
                 else:
                     # Créer un nouveau pending user
-                    verification_code = str(random.randint(1000, 9999))
+                    verification_code = otp.new_code()
                     expires_at = timezone.now() + timedelta(minutes=10)
 
                     pending_user = PendingUser.objects.create(
@@ -312,6 +304,7 @@ def password_reset_request(request):
         form = PasswordResetRequestForm()
     return render(request, 'authentication/password_reset_request.html', {'form': form})
 
+@ratelimit('password_reset_verify')
 def password_reset_verify(request, email):
     try:
         pending_user = PendingUser.objects.get(email=email)
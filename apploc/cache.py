@@ -0,0 +1,204 @@
+"""
+Cache applicatif invalidé par générations.
+
+Chaque groupe de données (``properties``, ``reviews``...) a un compteur de
+génération incrémenté par les signaux des modèles. Une entrée est valide
+tant que les générations qu'elle a enregistrées sont les générations
+courantes. Un compteur absent (cache vidé, clé évincée) repart d'une valeur
+qui ne se répète pas (horloge en nanosecondes) et non de 0 : une entrée
+ancienne ne peut pas retrouver une génération « courante ». Les entrées
+ont en plus une durée de vie bornée (``APP_CACHE_TIMEOUT``). Lors d'une
+reconstruction, un seul worker prend le verrou ; les autres servent la
+version précédente.
+"""
+import asyncio
+import math
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .middleware import record_cache
+
+KEY_PREFIX = 'apploc'
+LOCK_TIMEOUT = 30  # secondes
+LOCK_WAIT = 2.0  # attente max. sans version précédente à servir
+LOCK_POLL = 0.05
+APP_CACHE_TIMEOUT = getattr(settings, 'APP_CACHE_TIMEOUT', 3600)  # secondes
+
+
+def _generation_key(group):
+    return f'{KEY_PREFIX}:gen:{group}'
+
+
+def _bumped_at_key(group):
+    return f'{KEY_PREFIX}:gen-at:{group}'
+
+
+def _entry_key(name, vary):
+    return ':'.join([KEY_PREFIX, name, *[str(part) for part in vary]])
+
+
+def _seed():
+    return time.time_ns()
+
+
+def generations(groups):
+    keys = [_generation_key(group) for group in groups]
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        for key in missing:
+            cache.add(key, _seed(), timeout=None)
+        found.update(cache.get_many(missing))
+    return tuple(found.get(key) for key in keys)
+
+
+async def agenerations(groups):
+    keys = [_generation_key(group) for group in groups]
+    found = await cache.aget_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        for key in missing:
+            await cache.aadd(key, _seed(), timeout=None)
+        found.update(await cache.aget_many(missing))
+    return tuple(found.get(key) for key in keys)
+
+
+def bump(*groups):
+    """
+    Invalide toutes les entrées dépendant de ``groups``, après le commit de
+    la transaction en cours pour ne pas recacher des données non visibles.
+    """
+    def _bump():
+        for group in groups:
+            key = _generation_key(group)
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.add(key, _seed(), timeout=None) or cache.incr(key)
+        # Arrondi à la seconde supérieure : Last-Modified n'a pas de fraction
+        bumped_at = math.ceil(time.time())
+        cache.set_many({_bumped_at_key(group): bumped_at for group in groups}, timeout=None)
+    transaction.on_commit(_bump)
+
+
+def _validator_keys(groups):
+    return [_generation_key(group) for group in groups] + [_bumped_at_key(group) for group in groups]
+
+
+def _missing_validators(groups, found):
+    # Compteur et date absents : valeurs de départ qui ne se répètent pas
+    seeds = {}
+    for group in groups:
+        if _generation_key(group) not in found:
+            seeds[_generation_key(group)] = _seed()
+        if _bumped_at_key(group) not in found:
+            seeds[_bumped_at_key(group)] = math.ceil(time.time())
+    return seeds
+
+
+def _current_validators(groups, found):
+    return (
+        tuple(found[_generation_key(group)] for group in groups),
+        max(found[_bumped_at_key(group)] for group in groups),
+    )
+
+
+def validators(groups):
+    """
+    Générations de ``groups`` et date (timestamp) de la dernière
+    invalidation, en une lecture du cache : de quoi construire ETag et
+    Last-Modified sans requête SQL. Un groupe jamais invalidé (cache vidé)
+    prend la date courante, conservée pour les requêtes suivantes.
+    """
+    found = cache.get_many(_validator_keys(groups))
+    seeds = _missing_validators(groups, found)
+    if seeds:
+        for key, value in seeds.items():
+            cache.add(key, value, timeout=None)
+        found.update(cache.get_many(list(seeds)))
+    return _current_validators(groups, found)
+
+
+async def avalidators(groups):
+    found = await cache.aget_many(_validator_keys(groups))
+    seeds = _missing_validators(groups, found)
+    if seeds:
+        for key, value in seeds.items():
+            await cache.aadd(key, value, timeout=None)
+        found.update(await cache.aget_many(list(seeds)))
+    return _current_validators(groups, found)
+
+
+def get_or_build(name, builder, groups, vary=(), timeout=APP_CACHE_TIMEOUT):
+    """
+    Renvoie la valeur en cache pour ``name``/``vary`` ou la reconstruit avec
+    ``builder()`` si l'une des générations de ``groups`` a changé.
+    """
+    key = _entry_key(name, vary)
+    current = generations(groups)
+    entry = cache.get(key)
+    if entry is not None and entry[0] == current:
+        record_cache(hit=True)
+        return entry[1]
+    record_cache(hit=False)
+
+    lock_key = f'{key}:lock'
+    token = uuid.uuid4().hex
+    if not cache.add(lock_key, token, timeout=LOCK_TIMEOUT):
+        # Un autre worker reconstruit : servir la version précédente si possible
+        if entry is not None:
+            return entry[1]
+        deadline = time.monotonic() + LOCK_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL)
+            entry = cache.get(key)
+            if entry is not None and entry[0] == current:
+                return entry[1]
+        return builder()
+
+    try:
+        value = builder()
+        cache.set(key, (current, value), timeout=timeout)
+        return value
+    finally:
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
+
+
+async def aget_or_build(name, builder, groups, vary=(), timeout=APP_CACHE_TIMEOUT):
+    """
+    Version async de ``get_or_build`` : ``builder`` est une coroutine et
+    l'attente du verrou ne bloque pas la boucle d'événements.
+    """
+    key = _entry_key(name, vary)
+    current = await agenerations(groups)
+    entry = await cache.aget(key)
+    if entry is not None and entry[0] == current:
+        record_cache(hit=True)
+        return entry[1]
+    record_cache(hit=False)
+
+    lock_key = f'{key}:lock'
+    token = uuid.uuid4().hex
+    if not await cache.aadd(lock_key, token, timeout=LOCK_TIMEOUT):
+        if entry is not None:
+            return entry[1]
+        deadline = time.monotonic() + LOCK_WAIT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(LOCK_POLL)
+            entry = await cache.aget(key)
+            if entry is not None and entry[0] == current:
+                return entry[1]
+        return await builder()
+
+    try:
+        value = await builder()
+        await cache.aset(key, (current, value), timeout=timeout)
+        return value
+    finally:
+        if await cache.aget(lock_key) == token:
+            await cache.adelete(lock_key)
@@ -0,0 +1,110 @@
+"""
+GET conditionnels (ETag / Last-Modified) pour les pages publiques en lecture.
+
+Les validateurs viennent des compteurs de génération du cache applicatif
+(``apploc.cache``) et de la date de leur dernière invalidation : une seule
+lecture ``get_many``, ni requête SQL ni rendu de template. Si le client a
+déjà la version courante, la vue n'est pas appelée et la réponse est un 304.
+
+L'ETag couvre l'URL, la langue, l'utilisateur connecté, le secret CSRF du
+client pour les pages qui rendent un formulaire (``{% csrf_token %}``) et
+les générations des groupes dont dépend la page ; ces générations ne se
+répètent pas après une perte du cache (``apploc.cache``). Pour ces pages,
+comme ``ensure_csrf_cookie``, le cookie CSRF est posé même sur un 304 ; les
+réponses sans formulaire ni contenu propre au visiteur (API JSON) ne lisent
+ni le cookie CSRF ni la session, et n'ont donc ni ``Set-Cookie`` ni
+``Vary: Cookie``. Last-Modified n'est envoyé qu'aux visiteurs
+anonymes : pour un utilisateur connecté, la page dépend aussi de son compte.
+"""
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.contrib.messages.storage.session import SessionStorage
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.utils.translation import get_language
+
+from . import cache
+
+
+def _has_messages(request):
+    # Un message flash en attente rend la page unique : pas de 304
+    return CookieStorage.cookie_name in request.COOKIES or SessionStorage.session_key in request.session
+
+
+def _etag(request, user, current, forms):
+    account = f'{user.pk}:{user.updated_at.timestamp()}' if user.is_authenticated else ''
+    csrf_secret = ''
+    if forms:
+        # Le jeton d'un formulaire en cache n'est valable qu'avec ce secret ; get_token() pose le cookie
+        get_token(request)
+        csrf_secret = request.META.get('CSRF_COOKIE', '')
+    payload = '|'.join([request.get_full_path(), get_language() or '', account, csrf_secret, repr(current)])
+    return f'W/"{hashlib.sha1(payload.encode()).hexdigest()}"'
+
+
+def _precondition(request, user, current, bumped_at, forms):
+    """
+    Validateurs de la page, et la réponse 304/412 si le client est à jour.
+    """
+    etag = _etag(request, user, current, forms)
+    last_modified = None if user.is_authenticated else bumped_at
+    return etag, last_modified, get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def _finish(response, user, etag, last_modified):
+    if response.status_code in (200, 304):
+        response.headers.setdefault('ETag', etag)
+        if last_modified:
+            response.headers.setdefault('Last-Modified', http_date(last_modified))
+        # Revalidation à chaque affichage ; pas de cache partagé pour les pages personnelles
+        if user.is_authenticated:
+            patch_cache_control(response, no_cache=True, private=True)
+        else:
+            patch_cache_control(response, no_cache=True)
+    return response
+
+
+def conditional(*groups, forms=True, personal=True):
+    """
+    Répond 304 (ou 412) sans appeler la vue si la page n'a pas changé depuis
+    la version du client ; ``groups`` sont les groupes de cache dont elle
+    dépend. ``forms=False`` pour les vues qui ne rendent aucun formulaire :
+    ni secret CSRF dans l'ETag, ni cookie CSRF. ``personal=False`` pour
+    celles dont le contenu ne dépend ni de l'utilisateur ni des messages
+    flash : la session n'est pas lue. S'applique aux vues sync et async.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return await view(request, *args, **kwargs)
+                user = AnonymousUser()
+                if personal:
+                    request.user = user = await request.auser()
+                    if _has_messages(request):
+                        return await view(request, *args, **kwargs)
+                current, bumped_at = await cache.avalidators(groups)
+                etag, last_modified, response = _precondition(request, user, current, bumped_at, forms)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                return _finish(response, user, etag, last_modified)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or (personal and _has_messages(request)):
+                return view(request, *args, **kwargs)
+            user = request.user if personal else AnonymousUser()
+            current, bumped_at = cache.validators(groups)
+            etag, last_modified, response = _precondition(request, user, current, bumped_at, forms)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            return _finish(response, user, etag, last_modified)
+        return wrapper
+    return decorator
@@ -0,0 +1,73 @@
+"""
+Mise en file des tâches Celery avec repli local.
+
+``enqueue(task, ...)`` publie la tâche sur sa file (``otp``, ``mail``,
+``media``, voir ``CELERY_TASK_ROUTES``). Si le broker est injoignable, la
+tâche s'exécute dans un pool de threads local propre à la file, pour que la
+requête n'attende ni le broker ni le serveur SMTP ; le broker n'est alors
+plus sollicité pendant ``TASK_BROKER_RETRY_AFTER`` secondes.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from celery import current_app
+from django.conf import settings
+from django.db import close_old_connections
+from kombu.exceptions import OperationalError
+
+logger = logging.getLogger(__name__)
+
+TASK_BROKER_RETRY_AFTER = getattr(settings, 'TASK_BROKER_RETRY_AFTER', 30)  # secondes
+# Threads du repli local, par file
+TASK_LOCAL_WORKERS = getattr(settings, 'TASK_LOCAL_WORKERS', {'otp': 4, 'mail': 2, 'media': 1})
+
+_executors = {}
+_executors_lock = threading.Lock()
+_broker_down_until = 0.0
+
+
+def queue_for(task):
+    route = current_app.amqp.router.route({}, task.name)
+    queue = route.get('queue')
+    return getattr(queue, 'name', queue) or current_app.conf.task_default_queue
+
+
+def _executor(queue):
+    with _executors_lock:
+        executor = _executors.get(queue)
+        if executor is None:
+            executor = _executors[queue] = ThreadPoolExecutor(
+                max_workers=TASK_LOCAL_WORKERS.get(queue, 1), thread_name_prefix=f'apploc-task-{queue}',
+            )
+        return executor
+
+
+def _run_locally(task, args, kwargs):
+    close_old_connections()
+    try:
+        result = task.apply(args=args, kwargs=kwargs)
+        if result.failed():
+            logger.error(f"Local task {task.name} failed: {result.result!r}")
+    finally:
+        close_old_connections()
+
+
+def enqueue(task, *args, **kwargs):
+    """
+    Équivalent de ``task.delay(*args, **kwargs)`` qui ne bloque pas la
+    requête quand le broker est indisponible.
+    """
+    global _broker_down_until
+    if current_app.conf.task_always_eager:
+        return task.delay(*args, **kwargs)
+
+    queue = queue_for(task)
+    if time.monotonic() >= _broker_down_until:
+        try:
+            return task.apply_async(args, kwargs, retry=False)
+        except OperationalError as e:
+            _broker_down_until = time.monotonic() + TASK_BROKER_RETRY_AFTER
+            logger.warning(f"Broker unreachable, running tasks locally for {TASK_BROKER_RETRY_AFTER}s: {str(e)}")
+    return _executor(queue).submit(_run_locally, task, args, kwargs)
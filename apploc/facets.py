@@ -0,0 +1,214 @@
+"""
+Filtres et comptes par facette de la recherche de propriétés.
+
+Les comptes de toutes les catégories et tranches de prix sont calculés en
+une seule requête par agrégation conditionnelle (``COUNT(*) FILTER (WHERE
+...)``) : le compte d'une catégorie applique les autres filtres mais pas
+celui de catégorie, et inversement pour les tranches de prix, pour que
+chaque option affiche le nombre de résultats qu'elle donnerait. Le résultat
+est mis en cache (groupe ``properties``) par signature normalisée des
+filtres : « Yaoundé » et « yaounde » partagent la même entrée.
+
+La recherche par rayon (``lat``/``lng`` ou ``near``, et ``radius`` en km)
+s'applique à la liste comme aux comptes ; le point est arrondi à ~100 m pour
+que les visiteurs voisins partagent les comptes en cache.
+
+Les signatures venant du client, les filtres sont bornés (nombre de termes,
+longueur) et les entrées ont une durée de vie courte
+(``FACETS_CACHE_TIMEOUT``) : le cache ne grossit pas sans limite. La liste
+des catégories est en cache à part : un défaut de cache des comptes ne
+coûte que la requête d'agrégation.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.db.models import Count, Q
+from django.utils.translation import gettext_lazy as _
+
+from . import geo, search
+from .cache import aget_or_build, get_or_build
+from .models import Category, Property
+
+# Tranches de prix : (clé du paramètre ``price_range``, libellé, condition)
+PRICE_RANGES = (
+    ('under_100k', _('Under  100,000 Fcfa'), Q(price_per_month__lt=100000)),
+    ('100k_200k', _(' 100,000 - 200,000 Fcfa'), Q(price_per_month__gte=100000, price_per_month__lte=200000)),
+    ('200k_500k', _(' 200,000 - 500,000 Fcfa'), Q(price_per_month__gte=200000, price_per_month__lte=500000)),
+    ('over_500k', _('Over 500,000 Fcfa'), Q(price_per_month__gt=500000)),
+)
+PRICE_CONDITIONS = {key: condition for key, _label, condition in PRICE_RANGES}
+MIN_RATINGS = ('1', '2', '3', '4', '5')
+RADIUS_CHOICES = ('1', '2', '5', '10', '25', '50')  # km
+DEFAULT_RADIUS = '10'
+MAX_LOCATION_TERMS = 8
+MAX_PROPERTY_TYPE_LENGTH = 50  # Category.name
+FACETS_CACHE_TIMEOUT = getattr(settings, 'FACETS_CACHE_TIMEOUT', 300)
+
+
+def _point(params):
+    """
+    Centre de la recherche par rayon : position du visiteur (``lat``/``lng``)
+    ou lieu ``near`` géocodé hors ligne ; ``None`` si absent ou invalide.
+    """
+    try:
+        point = (float(params.get('lat', '')), float(params.get('lng', '')))
+    except ValueError:
+        near = params.get('near', '').strip()
+        point = geo.geocode(near) if near else None
+    if point is None or not (-90 <= point[0] <= 90 and -180 <= point[1] <= 180):
+        return None
+    return round(point[0], 3), round(point[1], 3)
+
+
+def normalize_filters(params):
+    """
+    Filtres de recherche de ``params`` (``request.GET``), normalisés ; les
+    valeurs inconnues sont ignorées.
+    """
+    price_range = params.get('price_range', '')
+    min_rating = params.get('min_rating', '')
+    radius = params.get('radius', '')
+    point = _point(params)
+    return {
+        'location': ' '.join(search.tokenize(params.get('location', ''))[:MAX_LOCATION_TERMS]),
+        'property_type': params.get('property_type', '').strip().lower()[:MAX_PROPERTY_TYPE_LENGTH],
+        'price_range': price_range if price_range in PRICE_CONDITIONS else '',
+        'min_rating': min_rating if min_rating in MIN_RATINGS else '',
+        'latitude': point[0] if point else None,
+        'longitude': point[1] if point else None,
+        'radius': int(radius if radius in RADIUS_CHOICES else DEFAULT_RADIUS) if point else None,
+    }
+
+
+def signature(filters):
+    payload = json.dumps(filters, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+def _category_condition(filters):
+    return Q(category__name__iexact=filters['property_type']) if filters['property_type'] else None
+
+
+def _price_condition(filters):
+    return PRICE_CONDITIONS[filters['price_range']] if filters['price_range'] else None
+
+
+def _both(*conditions):
+    conditions = [condition for condition in conditions if condition is not None]
+    if not conditions:
+        return None
+    combined = conditions[0]
+    for condition in conditions[1:]:
+        combined &= condition
+    return combined
+
+
+def filter_properties(queryset, filters, facets=True):
+    """
+    Applique ``filters`` à ``queryset`` ; sans ``facets``, les filtres de
+    catégorie et de prix (calculés par facette) ne sont pas appliqués.
+    """
+    if filters['location']:
+        queryset = search.search_properties(queryset, filters['location'])
+    if filters['min_rating']:
+        queryset = queryset.filter(rating_avg__gte=int(filters['min_rating']))
+    if filters['latitude'] is not None:
+        queryset = geo.within_radius(queryset, filters['latitude'], filters['longitude'], filters['radius'])
+    if facets:
+        condition = _both(_category_condition(filters), _price_condition(filters))
+        if condition is not None:
+            queryset = queryset.filter(condition)
+    return queryset
+
+
+def search_ordering(filters, sort=''):
+    """
+    Tri des résultats : note moyenne si ``sort == 'rating'``, distance si
+    ``sort == 'distance'`` avec une recherche par rayon, pertinence si
+    ``location`` est renseigné, sinon les plus récents ; toujours terminé
+    par ``id`` pour la pagination par curseur.
+    """
+    if sort == 'rating':
+        # Colonne dénormalisée + index property_alive_rating_idx : pas d'agrégat sur les avis
+        return ('-rating_avg', '-created_at', '-id')
+    if sort == 'distance' and filters['latitude'] is not None:
+        return ('distance_km', 'id')
+    if filters['location']:
+        return ('-search_rank', '-created_at', '-id')
+    return ('-created_at', '-id')
+
+
+def _categories():
+    return Category.objects.filter(deleted_at__isnull=True).values_list('pk', 'name')
+
+
+def _aggregates(filters, categories):
+    category_q, price_q = _category_condition(filters), _price_condition(filters)
+    aggregates = {'total': Count('pk', filter=_both(category_q, price_q))}
+    for i, (pk, _name) in enumerate(categories):
+        aggregates[f'category_{i}'] = Count('pk', filter=_both(Q(category_id=pk), price_q))
+    for key, _label, condition in PRICE_RANGES:
+        aggregates[f'price_{key}'] = Count('pk', filter=_both(condition, category_q))
+    return filter_properties(Property.objects.order_by(), filters, facets=False), aggregates
+
+
+def _counts(counts, categories):
+    return {
+        'total': counts['total'],
+        'categories': [(name, counts[f'category_{i}']) for i, (_pk, name) in enumerate(categories)],
+        'price_ranges': {key: counts[f'price_{key}'] for key, _label, _condition in PRICE_RANGES},
+    }
+
+
+def _category_list():
+    return get_or_build('property_categories', lambda: list(_categories()), groups=('properties',))
+
+
+async def _acategory_list():
+    async def build():
+        return [category async for category in _categories()]
+    return await aget_or_build('property_categories', build, groups=('properties',))
+
+
+def _count_facets(filters):
+    categories = _category_list()
+    queryset, aggregates = _aggregates(filters, categories)
+    return _counts(queryset.aggregate(**aggregates), categories)
+
+
+async def _acount_facets(filters):
+    categories = await _acategory_list()
+    queryset, aggregates = _aggregates(filters, categories)
+    return _counts(await queryset.aaggregate(**aggregates), categories)
+
+
+def _labelled(counts):
+    return {
+        'total': counts['total'],
+        'categories': [
+            {'value': name.lower(), 'name': name, 'count': count} for name, count in counts['categories']
+        ],
+        'price_ranges': [
+            {'value': key, 'label': label, 'count': counts['price_ranges'].get(key, 0)}
+            for key, label, _condition in PRICE_RANGES
+        ],
+    }
+
+
+def facet_counts(filters):
+    """
+    Nombre total de résultats et comptes par catégorie et par tranche de
+    prix pour ``filters`` (voir ``normalize_filters``), en cache.
+    """
+    return _labelled(get_or_build(
+        'property_facets', lambda: _count_facets(filters), groups=('properties',), vary=(signature(filters),),
+        timeout=FACETS_CACHE_TIMEOUT,
+    ))
+
+
+async def afacet_counts(filters):
+    return _labelled(await aget_or_build(
+        'property_facets', lambda: _acount_facets(filters), groups=('properties',), vary=(signature(filters),),
+        timeout=FACETS_CACHE_TIMEOUT,
+    ))
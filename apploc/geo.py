@@ -0,0 +1,145 @@
+"""
+Géocodage hors ligne et recherche par rayon des propriétés.
+
+``Property.location`` est un texte libre : ``geocode`` y cherche le plus long
+nom de lieu connu d'un gazetteer local (``GEOCODER_GAZETTEER``), sans accès
+réseau. Le fichier est un CSV ``name,latitude,longitude,population,
+alternate_names`` (noms alternatifs séparés par ``|``) ou un export GeoNames
+(``.txt``, séparé par des tabulations). Le fichier fourni couvre les
+principales villes du Cameroun et quelques quartiers de Yaoundé et Douala,
+en coordonnées approximatives.
+
+La recherche par rayon filtre d'abord sur la boîte englobante (index
+``property_alive_geo_idx`` sur latitude/longitude), puis calcule la distance
+haversine en SQL, disponible pour le filtre et le tri.
+"""
+import csv
+import math
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt
+
+from .search import tokenize
+
+GEOCODER_GAZETTEER = getattr(settings, 'GEOCODER_GAZETTEER', Path(__file__).resolve().parent / 'data' / 'gazetteer.csv')
+EARTH_RADIUS_KM = 6371.0088
+MAX_NAME_WORDS = 4
+
+
+def _rows(fh, geonames):
+    if geonames:
+        # Colonnes GeoNames : 1 nom, 3 noms alternatifs, 4 latitude, 5 longitude, 14 population
+        for row in csv.reader(fh, delimiter='\t', quoting=csv.QUOTE_NONE):
+            yield row[1], row[4], row[5], row[14], row[3].split(',')
+    else:
+        for row in csv.DictReader(fh):
+            yield row['name'], row['latitude'], row['longitude'], row.get('population'), (row.get('alternate_names') or '').split('|')
+
+
+def load_gazetteer(path):
+    """
+    Index nom normalisé -> (latitude, longitude) ; pour un nom partagé, le
+    lieu le plus peuplé.
+    """
+    path = Path(path)
+    entries = {}
+    with path.open(encoding='utf-8', newline='') as fh:
+        for name, latitude, longitude, population, aliases in _rows(fh, path.suffix == '.txt'):
+            population = int(population or 0)
+            for alias in (name, *aliases):
+                key = ' '.join(tokenize(alias))
+                if key and (key not in entries or entries[key][2] < population):
+                    entries[key] = (float(latitude), float(longitude), population)
+    return {key: (latitude, longitude) for key, (latitude, longitude, _population) in entries.items()}
+
+
+@lru_cache(maxsize=None)
+def gazetteer(path=None):
+    return load_gazetteer(path or GEOCODER_GAZETTEER)
+
+
+def geocode(text, entries=None):
+    """
+    Coordonnées du plus long nom de lieu connu de ``text`` (à longueur égale,
+    le premier : « Bastos, Yaoundé » donne Bastos), ou ``None``.
+    """
+    entries = gazetteer() if entries is None else entries
+    tokens = tokenize(text)
+    for size in range(min(MAX_NAME_WORDS, len(tokens)), 0, -1):
+        for start in range(len(tokens) - size + 1):
+            point = entries.get(' '.join(tokens[start:start + size]))
+            if point:
+                return point
+    return None
+
+
+def geocode_properties(queryset, entries=None, batch_size=500):
+    """
+    Géocode les propriétés de ``queryset`` par lots (``bulk_update``, sans
+    signaux) ; renvoie le nombre de propriétés localisées.
+    """
+    from .models import Property
+
+    located, batch = 0, []
+    for prop in queryset.only('pk', 'location', 'latitude', 'longitude').iterator(chunk_size=batch_size):
+        latitude, longitude = geocode(prop.location, entries) or (None, None)
+        located += latitude is not None
+        if (prop.latitude, prop.longitude) != (latitude, longitude):
+            prop.latitude, prop.longitude = latitude, longitude
+            batch.append(prop)
+        if len(batch) >= batch_size:
+            Property.all_objects.bulk_update(batch, ['latitude', 'longitude'])
+            batch = []
+    if batch:
+        Property.all_objects.bulk_update(batch, ['latitude', 'longitude'])
+    return located
+
+
+# --- Distances -----------------------------------------------------------
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    dlat = math.radians(lat2 - lat1)
+    dlng = math.radians(lng2 - lng1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """
+    (lat. min, lat. max, long. min, long. max) du cercle ; pas de borne de
+    longitude près des pôles ou si la boîte traverse l'antiméridien.
+    """
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat, max_lat = max(-90.0, latitude - dlat), min(90.0, latitude + dlat)
+    if min_lat == -90.0 or max_lat == 90.0:
+        return min_lat, max_lat, None, None
+    dlng = math.degrees(radius_km / (EARTH_RADIUS_KM * math.cos(math.radians(latitude))))
+    if longitude - dlng < -180.0 or longitude + dlng > 180.0:
+        return min_lat, max_lat, None, None
+    return min_lat, max_lat, longitude - dlng, longitude + dlng
+
+
+def distance_km(latitude, longitude):
+    """
+    Distance haversine en SQL (fonctions mathématiques de Django, PostgreSQL
+    et SQLite) entre chaque propriété et le point donné.
+    """
+    half_dlat = Radians(F('latitude') - Value(latitude)) / 2
+    half_dlng = Radians(F('longitude') - Value(longitude)) / 2
+    a = Power(Sin(half_dlat), 2) + Value(math.cos(math.radians(latitude))) * Cos(Radians(F('latitude'))) * Power(Sin(half_dlng), 2)
+    return Value(2 * EARTH_RADIUS_KM) * ASin(Least(Sqrt(a), Value(1.0)), output_field=FloatField())
+
+
+def within_radius(queryset, latitude, longitude, radius_km):
+    """
+    Propriétés de ``queryset`` à moins de ``radius_km`` du point, annotées
+    avec ``distance_km``.
+    """
+    min_lat, max_lat, min_lng, max_lng = bounding_box(latitude, longitude, radius_km)
+    queryset = queryset.filter(latitude__range=(min_lat, max_lat))
+    if min_lng is not None:
+        queryset = queryset.filter(longitude__range=(min_lng, max_lng))
+    return queryset.annotate(distance_km=distance_km(latitude, longitude)).filter(distance_km__lte=radius_km)
@@ -0,0 +1,287 @@
+"""
+Envoi d'emails par lots sur une connexion SMTP persistante.
+
+Les messages sont mis en file dans le processus (worker Celery, ou serveur
+web en mode eager) et envoyés par un thread de fond, par lots de
+``MAIL_BATCH_SIZE``, sur une connexion ouverte une fois par processus et
+rouverte si le serveur la coupe. Chaque destinataire est un envoi distinct :
+une erreur temporaire n'est réessayée, avec un délai exponentiel, que pour
+lui ; une erreur définitive (5xx) ne l'est pas. Un refus de destinataire ne
+ferme pas la connexion : seules les erreurs réseau la font rouvrir.
+
+Dans une tâche exécutée par un worker Celery, ``send(message, task=self)``
+envoie tout de suite, dans le thread de la tâche, donc avant son
+acquittement (``CELERY_TASK_ACKS_LATE``) : un crash du worker fait relivrer
+la tâche, et un échec temporaire lève ``MailDeferred`` pour que Celery la
+réessaie. Seul le repli local (tâche eager, broker injoignable) passe par la
+file en mémoire : les messages en attente y sont perdus si le processus
+meurt avant l'envoi (au plus ``MAIL_FLUSH_INTERVAL`` plus les délais de
+nouvelle tentative).
+"""
+import atexit
+import copy
+import logging
+import smtplib
+import threading
+import time
+from collections import deque
+
+from celery.signals import worker_process_shutdown
+from django.conf import settings
+from django.core.mail import get_connection
+
+logger = logging.getLogger(__name__)
+
+MAIL_BATCH_SIZE = getattr(settings, 'MAIL_BATCH_SIZE', 20)
+MAIL_FLUSH_INTERVAL = getattr(settings, 'MAIL_FLUSH_INTERVAL', 0.5)  # secondes
+MAIL_MAX_ATTEMPTS = getattr(settings, 'MAIL_MAX_ATTEMPTS', 5)
+MAIL_BACKOFF_BASE = getattr(settings, 'MAIL_BACKOFF_BASE', 2.0)  # secondes, doublé à chaque échec
+MAIL_BACKOFF_MAX = getattr(settings, 'MAIL_BACKOFF_MAX', 300)
+MAIL_IDLE_TIMEOUT = getattr(settings, 'MAIL_IDLE_TIMEOUT', 30)  # fermeture de la connexion inactive
+
+
+class OutgoingMail:
+    __slots__ = ('message', 'attempts', 'not_before')
+
+    def __init__(self, message):
+        self.message = message
+        self.attempts = 0
+        self.not_before = 0.0
+
+    @property
+    def recipient(self):
+        return self.message.recipients()[0]
+
+
+class MailDeferred(Exception):
+    """
+    Destinataires refusés temporairement par ``MailDispatcher.deliver``.
+    """
+
+
+def connection_lost(error):
+    # Les exceptions SMTP héritent d'OSError : un refus 4xx/5xx garde la connexion
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+def is_permanent(error):
+    """
+    Les réponses SMTP 5xx sont définitives ; les 4xx et les erreurs réseau
+    valent d'être réessayées.
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _msg in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code >= 500
+    return False
+
+
+class MailDispatcher:
+    def __init__(self, backend=None, batch_size=MAIL_BATCH_SIZE, flush_interval=MAIL_FLUSH_INTERVAL,
+                 max_attempts=MAIL_MAX_ATTEMPTS, backoff_base=MAIL_BACKOFF_BASE, backoff_max=MAIL_BACKOFF_MAX,
+                 idle_timeout=MAIL_IDLE_TIMEOUT, clock=time.monotonic):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+        self.dead_letters = deque(maxlen=100)
+        self._queue = deque()
+        self._queue_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._connection = None
+        self._last_used = 0.0
+
+    # --- file ----------------------------------------------------------------
+
+    def send(self, message, background=True):
+        """
+        Met ``message`` en file, un envoi par destinataire. Sans thread de
+        fond (``background=False``), c'est à l'appelant d'appeler ``flush()``.
+        """
+        items = self._split(message)
+        with self._queue_lock:
+            self._queue.extend(items)
+            full = len(self._queue) >= self.batch_size
+        if background:
+            self._ensure_thread()
+            if full:
+                self._wakeup.set()
+
+    def deliver(self, message):
+        """
+        Envoie ``message`` tout de suite, dans le thread appelant, sans passer
+        par la file ; renvoie les destinataires refusés temporairement.
+        """
+        deferred = []
+        with self._send_lock:
+            for item in self._split(message):
+                item.attempts += 1
+                try:
+                    self._send_now(item.message)
+                except Exception as e:
+                    if is_permanent(e):
+                        self._drop(item, e)
+                    else:
+                        logger.warning(f"Mail to {item.recipient} deferred: {str(e)}")
+                        deferred.append(item.recipient)
+            self._last_used = self.clock()
+        self._ensure_thread()  # ferme la connexion après MAIL_IDLE_TIMEOUT
+        return deferred
+
+    def _split(self, message):
+        recipients = message.recipients()
+        if len(recipients) == 1:
+            return [OutgoingMail(message)]
+        items = []
+        for recipient in recipients:
+            single = copy.copy(message)
+            single.to, single.cc, single.bcc = [recipient], [], []
+            items.append(OutgoingMail(single))
+        return items
+
+    def pending(self):
+        with self._queue_lock:
+            return len(self._queue)
+
+    def _take_due(self, force):
+        now = self.clock()
+        due, later = [], deque()
+        with self._queue_lock:
+            while self._queue:
+                item = self._queue.popleft()
+                (due if force or item.not_before <= now else later).append(item)
+            self._queue = later
+        return due
+
+    # --- envoi ----------------------------------------------------------------
+
+    def flush(self, force=False):
+        """
+        Envoie les messages dont le délai de nouvelle tentative est écoulé
+        (tous avec ``force``) et renvoie le nombre de messages envoyés.
+        """
+        with self._send_lock:
+            due = self._take_due(force)
+            sent = 0
+            for start in range(0, len(due), self.batch_size):
+                sent += self._send_batch(due[start:start + self.batch_size])
+            return sent
+
+    def _open(self):
+        if self._connection is None:
+            self._connection = get_connection(self.backend, fail_silently=False)
+            self._connection.open()
+        return self._connection
+
+    def _send_now(self, message):
+        for attempt in (1, 2):
+            reused = self._connection is not None
+            try:
+                return self._open().send_messages([message])
+            except Exception as e:
+                if not connection_lost(e):
+                    raise
+                self.close()
+                # Connexion réutilisée coupée par le serveur : une seule réouverture immédiate
+                if not reused or attempt == 2:
+                    raise
+
+    def _send_batch(self, batch):
+        sent = 0
+        for item in batch:
+            item.attempts += 1
+            try:
+                self._send_now(item.message)
+                sent += 1
+            except Exception as e:
+                self._retry_or_drop(item, e)
+        self._last_used = self.clock()
+        logger.info(f"Mail batch flushed: {sent}/{len(batch)} sent")
+        return sent
+
+    def _drop(self, item, error):
+        logger.error(f"Mail to {item.recipient} dropped after {item.attempts} attempt(s): {str(error)}")
+        self.dead_letters.append((item.recipient, item.message.subject, str(error)))
+
+    def _retry_or_drop(self, item, error):
+        if is_permanent(error) or item.attempts >= self.max_attempts:
+            self._drop(item, error)
+            return
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (item.attempts - 1))
+        item.not_before = self.clock() + delay
+        logger.warning(f"Mail to {item.recipient} failed (attempt {item.attempts}), retry in {delay:.0f}s: {str(error)}")
+        with self._queue_lock:
+            self._queue.append(item)
+
+    def close(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+            self._connection = None
+
+    # --- thread de fond -------------------------------------------------------
+
+    def _ensure_thread(self):
+        with self._queue_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='apploc-mail', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Mail flush failed: {str(e)}")
+            with self._queue_lock:
+                idle = not self._queue and self.clock() - self._last_used >= self.idle_timeout
+                if idle:
+                    self._thread = None
+            if idle:
+                with self._send_lock:
+                    self.close()
+                return
+
+    def shutdown(self):
+        """
+        Vide la file (sans attendre les délais) et ferme la connexion, à
+        l'arrêt du processus.
+        """
+        self.flush(force=True)
+        with self._send_lock:
+            self.close()
+
+
+dispatcher = MailDispatcher()
+atexit.register(dispatcher.shutdown)
+
+
+@worker_process_shutdown.connect
+def _shutdown_worker_dispatcher(**kwargs):
+    # Les processus enfants de Celery ne passent pas toujours par atexit
+    dispatcher.shutdown()
+
+
+def send(message, task=None):
+    """
+    Envoie ``message`` avant l'acquittement de ``task`` si elle tourne sur un
+    worker (``MailDeferred`` en cas d'échec temporaire), sinon le met en file.
+    """
+    if task is not None and not task.request.is_eager:
+        deferred = dispatcher.deliver(message)
+        if deferred:
+            raise MailDeferred(deferred)
+        return
+    dispatcher.send(message)
@@ -0,0 +1,162 @@
+"""
+Benchmark de charge des vues publiques en lecture : WSGI et vues sync contre
+ASGI et vues async, à budget mémoire fixé.
+
+Chaque mode tourne dans son propre processus (``ASYNC_VIEWS`` est lu au
+démarrage), qui joue ``--requests`` requêtes avec ``--concurrency`` requêtes
+en vol : pool de threads sur le handler WSGI (comme un worker gthread) ou
+tâches asyncio sur le handler ASGI (comme un worker uvicorn). On mesure le
+débit et le pic de mémoire (RSS) du processus ; le débit à budget fixé est
+celui d'un worker multiplié par le nombre de workers qui tiennent dans
+``--memory-budget``. Les requêtes passent par toute la pile de middlewares,
+sans réseau ni serveur HTTP.
+
+    python manage.py bench_async_views --requests 2000 --concurrency 32 --memory-budget 512
+"""
+import asyncio
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+from django.utils import translation
+
+from apploc.models import Property
+
+MODES = {'sync': False, 'async': True}  # mode -> ASYNC_VIEWS
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Octets sous macOS, kilo-octets sous Linux
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+class Command(BaseCommand):
+    help = "Compare le débit des vues publiques sous WSGI (sync) et ASGI (async) à budget mémoire fixé"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=['both', *MODES], default='both')
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--memory-budget', type=int, default=512, help='Mo disponibles pour les workers web')
+        parser.add_argument('--json', action='store_true', help='Résultat brut en JSON')
+
+    def handle(self, *args, **options):
+        if options['mode'] == 'both':
+            results = [self.spawn(mode, options) for mode in MODES]
+        else:
+            results = [self.run(options['mode'], options)]
+        for result in results:
+            workers = max(1, int(options['memory_budget'] // result['peak_rss_mb']))
+            result['workers_in_budget'] = workers
+            result['budget_rps'] = round(workers * result['rps'], 1)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results))
+            return
+        self.stdout.write(
+            f"{'mode':<6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'erreurs':>8} {'RSS Mo':>8} "
+            f"{'workers':>8} {'req/s @ ' + str(options['memory_budget']) + ' Mo':>16}"
+        )
+        for r in results:
+            self.stdout.write(
+                f"{r['mode']:<6} {r['rps']:>8.1f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['errors']:>8} "
+                f"{r['peak_rss_mb']:>8.1f} {r['workers_in_budget']:>8} {r['budget_rps']:>16.1f}"
+            )
+
+    def spawn(self, mode, options):
+        command = [
+            sys.executable, '-m', 'django', 'bench_async_views', '--mode', mode, '--json',
+            '--requests', str(options['requests']), '--concurrency', str(options['concurrency']),
+            '--memory-budget', str(options['memory_budget']),
+        ]
+        env = dict(os.environ, ASYNC_VIEWS=str(MODES[mode]), DJANGO_SETTINGS_MODULE=os.environ['DJANGO_SETTINGS_MODULE'])
+        process = subprocess.run(command, env=env, cwd=settings.BASE_DIR, capture_output=True, text=True)
+        if process.returncode:
+            raise CommandError(f'Mode {mode} en échec :\n{process.stderr}')
+        return json.loads(process.stdout)[0]
+
+    # --- Mesure dans le processus courant -----------------------------------
+
+    def urls(self):
+        with translation.override(settings.LANGUAGES[0][0]):
+            urls = [reverse('home'), reverse('all_properties'), reverse('all_reviews')]
+            property_id = Property.objects.values_list('pk', flat=True).first()
+            if property_id:
+                urls.append(reverse('property_detail', kwargs={'property_id': property_id}))
+        return urls
+
+    def run(self, mode, options):
+        if settings.ASYNC_VIEWS != MODES[mode]:
+            self.stderr.write(f'ASYNC_VIEWS={settings.ASYNC_VIEWS} : les vues ne correspondent pas au mode {mode}')
+        urls = self.urls()
+        plan = [urls[i % len(urls)] for i in range(options['requests'])]
+        measure = self.measure_async if mode == 'async' else self.measure_sync
+
+        # Nom d'hôte des clients de test, comme sous setup_test_environment()
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            measure(urls, options['concurrency'])  # échauffement (caches, templates)
+            start = time.perf_counter()
+            latencies, errors = measure(plan, options['concurrency'])
+            elapsed = time.perf_counter() - start
+        latencies.sort()
+        return {
+            'mode': mode,
+            'requests': len(plan),
+            'concurrency': options['concurrency'],
+            'rps': round(len(plan) / elapsed, 1),
+            'p50_ms': round(statistics.median(latencies), 2),
+            'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 2),
+            'errors': errors,
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+        }
+
+    def measure_sync(self, plan, concurrency):
+        local = threading.local()
+        lock = threading.Lock()
+        latencies, errors = [], [0]
+
+        def fetch(url):
+            client = getattr(local, 'client', None)
+            if client is None:
+                client = local.client = Client()
+            start = time.perf_counter()
+            status = client.get(url).status_code
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+                errors[0] += status >= 400
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(fetch, plan))
+        return latencies, errors[0]
+
+    def measure_async(self, plan, concurrency):
+        latencies, errors = [], [0]
+
+        async def worker(queue):
+            client = AsyncClient()
+            while not queue.empty():
+                url = queue.get_nowait()
+                start = time.perf_counter()
+                status = (await client.get(url)).status_code
+                latencies.append((time.perf_counter() - start) * 1000)
+                errors[0] += status >= 400
+
+        async def main():
+            queue = asyncio.Queue()
+            for url in plan:
+                queue.put_nowait(url)
+            await asyncio.gather(*[worker(queue) for _ in range(concurrency)])
+
+        asyncio.run(main())
+        return latencies, errors[0]
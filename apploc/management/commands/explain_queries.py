@@ -0,0 +1,101 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.http import QueryDict
+from apploc import facets, search
+from apploc.models import CustomUser, Property, Review
+from apploc.pagination import KeysetPaginator
+from apploc.property.views import _detail_queryset
+from apploc.views import _featured_properties, _latest_reviews
+
+class Command(BaseCommand):
+    help = "Affiche le plan d'exécution (EXPLAIN) des requêtes de chaque vue"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--analyze', action='store_true', help="EXPLAIN ANALYZE (PostgreSQL)")
+
+    def view_queries(self):
+        """
+        (libellé, fonction) : chaque fonction exécute les helpers de la vue
+        (filtres, recherche, pagination, prefetch) ; toutes les requêtes SQL
+        qu'elle émet sont expliquées, telles que le trafic réel les envoie.
+        """
+        # Valeurs d'exemple : premières lignes existantes
+        owner = CustomUser.objects.filter(role='owner').first()
+        tenant = CustomUser.objects.filter(role='tenant').first()
+        prop = Property.objects.select_related('category').first()
+        word = (search.tokenize(prop.location if prop else '') or ['yaounde'])[0]
+        category = prop.category.name if prop else 'apartment'
+        # Paramètres GET d'exemple de all_properties : tri par défaut, texte, rayon, facettes
+        searches = {
+            'all_properties': QueryDict(''),
+            'all_properties: location': QueryDict(f'location={word}'),
+            'all_properties: near': QueryDict('lat=3.848&lng=11.502&radius=10&sort=distance'),
+            'all_properties: facets': QueryDict(f'property_type={category}&price_range=100k_200k&sort=rating'),
+        }
+
+        def first_page(queryset, ordering):
+            # Même requête que paginate() pour la première page
+            return lambda: list(KeysetPaginator(queryset, ordering=ordering)._queryset(None)[0])
+
+        queries = [
+            ('home: properties', lambda: list(_featured_properties())),
+            ('home: reviews', lambda: list(_latest_reviews())),
+        ]
+        for label, params in searches.items():
+            filters = facets.normalize_filters(params)
+            properties = facets.filter_properties(
+                Property.objects.select_related('category', 'owner', 'cover_photo'), filters,
+            )
+            queries.append((label, first_page(properties, facets.search_ordering(filters, params.get('sort', '')))))
+            queries.append((f'{label} (comptes)', lambda filters=filters: facets._count_facets(filters)))
+        queries += [
+            ('all_properties: categories', lambda: list(facets._categories())),
+            ('property_detail', lambda: _detail_queryset().filter(pk=prop.pk if prop else None).first()),
+            ('owner_dashboard', lambda: list(Property.objects.select_related('category', 'cover_photo').filter(owner=owner))),
+            ('tenant_dashboard', lambda: list(Property.objects.select_related('category', 'cover_photo').filter(is_available=True))),
+            ('all_reviews', first_page(Review.objects.select_related('tenant', 'property', 'property__category'), ('-date_posted', '-id'))),
+            ('review_list', lambda: list(Review.objects.select_related('property__category').filter(tenant=tenant))),
+        ]
+        return queries
+
+    def capture(self, run):
+        statements = []
+
+        def record(execute, sql, params, many, context):
+            statements.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            run()
+        return statements
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        explain_options = {'analyze': True} if options['analyze'] and vendor == 'postgresql' else {}
+        prefix = connection.ops.explain_query_prefix(**explain_options)
+        full_scans = 0
+
+        for label, run in self.view_queries():
+            for i, (sql, params) in enumerate(self.capture(run), 1):
+                with connection.cursor() as cursor:
+                    cursor.execute(f'{prefix} {sql}', params)
+                    rows = cursor.fetchall()
+                self.stdout.write(self.style.MIGRATE_HEADING(f'{label} [{i}]'))
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'  {sql}')
+                for row in rows:
+                    line = ' '.join(str(value) for value in row)
+                    # PostgreSQL : "Seq Scan" ; SQLite : "SCAN table" sans index
+                    is_full_scan = 'Seq Scan' in line or (
+                        vendor == 'sqlite' and 'SCAN ' in line and 'INDEX' not in line
+                    )
+                    if is_full_scan:
+                        full_scans += 1
+                        self.stdout.write(self.style.WARNING(f'    {line}'))
+                    else:
+                        self.stdout.write(f'    {line}')
+
+        if full_scans:
+            self.stdout.write(self.style.WARNING(f'{full_scans} parcours séquentiel(s) détecté(s)'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Toutes les requêtes utilisent un index'))
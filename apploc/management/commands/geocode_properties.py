@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from apploc import cache, geo
+from apploc.models import Property
+
+class Command(BaseCommand):
+    help = "Géocode hors ligne l'emplacement des propriétés à partir d'un gazetteer local"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--gazetteer', help='CSV ou export GeoNames (.txt) ; par défaut GEOCODER_GAZETTEER')
+        parser.add_argument('--missing', action='store_true', help='Seulement les propriétés sans coordonnées')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        try:
+            entries = geo.gazetteer(options['gazetteer'])
+        except (OSError, KeyError, IndexError, ValueError) as error:
+            raise CommandError(f'Gazetteer illisible : {error}')
+        properties = Property.all_objects.all()
+        if options['missing']:
+            properties = properties.filter(latitude__isnull=True)
+        total = properties.count()
+        located = geo.geocode_properties(properties, entries, batch_size=options['batch_size'])
+        cache.bump('properties')
+        self.stdout.write(self.style.SUCCESS(f'{located}/{total} propriété(s) localisée(s) ({len(entries)} lieux)'))
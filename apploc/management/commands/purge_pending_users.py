@@ -0,0 +1,19 @@
+import time
+from django.core.management.base import BaseCommand
+from apploc.models import PendingUser
+
+class Command(BaseCommand):
+    help = 'Supprime par lots les inscriptions en attente expirées'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0.0, help="Pause (secondes) entre deux lots")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        deleted = PendingUser.purge_expired(batch_size=options['batch_size'], pause=options['pause'])
+        elapsed = time.perf_counter() - start
+        rate = deleted / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'{deleted} inscription(s) expirée(s) supprimée(s) en {elapsed:.2f}s ({rate:.0f} lignes/s)'
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import connections, DEFAULT_DB_ALIAS
+from apploc import search
+
+class Command(BaseCommand):
+    help = "Reconstruit l'index de recherche plein texte des propriétés"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        count = search.rebuild(connection=connection, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{count} propriété(s) indexée(s) ({connection.vendor})'))
@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from apploc.models import Property
+
+class Command(BaseCommand):
+    help = 'Recalcule la photo de couverture de toutes les propriétés'
+
+    def handle(self, *args, **kwargs):
+        count = Property.refresh_cover_photos(Property.all_objects.values('pk'))
+        self.stdout.write(self.style.SUCCESS(f'{count} propriété(s) mise(s) à jour'))
@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from apploc.models import Property
+
+class Command(BaseCommand):
+    help = "Recalcule le nombre d'avis et la note moyenne de toutes les propriétés"
+
+    def handle(self, *args, **kwargs):
+        count = Property.refresh_review_stats(Property.all_objects.values('pk'))
+        self.stdout.write(self.style.SUCCESS(f'{count} propriété(s) mise(s) à jour'))
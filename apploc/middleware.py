@@ -0,0 +1,253 @@
+"""
+Instrumentation des requêtes : temps SQL, rendu des templates, cache et vue.
+
+``PerformanceMiddleware`` émet un en-tête ``Server-Timing``, une ligne de log
+structurée (logger ``apploc.perf``) et alimente un histogramme glissant par
+nom d'URL exposé par la vue admin ``perf_stats``.
+
+Les middlewares de ce module acceptent les deux modes (WSGI et ASGI) : sous
+ASGI, la pile reste asynchrone jusqu'aux vues ``async``.
+"""
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template import base as template_base
+from whitenoise.middleware import WhiteNoiseMiddleware as BaseWhiteNoiseMiddleware
+
+logger = logging.getLogger('apploc.perf')
+
+_current = ContextVar('apploc_perf_stats', default=None)
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_time', 'render_time', 'render_depth', 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.render_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+def current_stats():
+    return _current.get()
+
+
+def record_cache(hit):
+    """
+    À appeler par les couches de cache de l'application pour chaque lecture.
+    """
+    stats = _current.get()
+    if stats is not None:
+        if hit:
+            stats.cache_hits += 1
+        else:
+            stats.cache_misses += 1
+
+
+# --- Requêtes SQL --------------------------------------------------------
+
+def _count_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_time += time.perf_counter() - start
+
+
+def _instrument(connection):
+    # Installé sur chaque connexion, quel que soit son thread : l'ORM async
+    # s'exécute dans un thread de sync_to_async qui a sa propre connexion ;
+    # le contexte (contextvars) suit, la connexion non
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    _instrument(connection)
+
+
+connection_created.connect(_on_connection_created, dispatch_uid='apploc_perf_count_queries')
+for _connection in connections.all(initialized_only=True):
+    _instrument(_connection)
+
+
+# --- Rendu des templates -------------------------------------------------
+
+_original_render = template_base.Template.render
+
+
+def _timed_render(self, context):
+    stats = _current.get()
+    if stats is None:
+        return _original_render(self, context)
+    # Seul le template le plus externe compte ({% include %} est imbriqué)
+    stats.render_depth += 1
+    start = time.perf_counter()
+    try:
+        return _original_render(self, context)
+    finally:
+        stats.render_depth -= 1
+        if stats.render_depth == 0:
+            stats.render_time += time.perf_counter() - start
+
+
+template_base.Template.render = _timed_render
+
+
+# --- Histogrammes --------------------------------------------------------
+
+class RollingHistogram:
+    """
+    Dernières durées (ms) par nom d'URL, bornées à ``size`` échantillons.
+    """
+
+    def __init__(self, size=500):
+        self.size = size
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, duration_ms, queries):
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.size)
+            samples.append((duration_ms, queries))
+
+    def snapshot(self):
+        with self._lock:
+            data = {name: list(samples) for name, samples in self._samples.items()}
+        result = {}
+        for name, samples in sorted(data.items()):
+            durations = sorted(d for d, _q in samples)
+            result[name] = {
+                'count': len(durations),
+                'p50_ms': round(_percentile(durations, 50), 2),
+                'p95_ms': round(_percentile(durations, 95), 2),
+                'p99_ms': round(_percentile(durations, 99), 2),
+                'max_ms': round(durations[-1], 2),
+                'avg_queries': round(sum(q for _d, q in samples) / len(samples), 2),
+            }
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+
+def _percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+histogram = RollingHistogram(getattr(settings, 'PERF_HISTOGRAM_SIZE', 500))
+
+
+# --- Middleware ----------------------------------------------------------
+
+class PerformanceMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, stats, start)
+
+    async def __acall__(self, request):
+        # Les requêtes de l'ORM async héritent du contexte (contextvars) : les
+        # statistiques courantes sont retrouvées par _count_query dans leur thread
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, stats, start)
+
+    def _finish(self, request, response, stats, start):
+        total_ms = (time.perf_counter() - start) * 1000
+        db_ms = stats.db_time * 1000
+        render_ms = stats.render_time * 1000
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={db_ms:.1f};desc="{stats.queries} queries"',
+            f'tpl;dur={render_ms:.1f}',
+            f'cache;desc="hit={stats.cache_hits} miss={stats.cache_misses}"',
+            f'total;dur={total_ms:.1f}',
+        ])
+
+        match = getattr(request, 'resolver_match', None)
+        url_name = (match.view_name if match else None) or 'unresolved'
+        histogram.add(url_name, total_ms, stats.queries)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'view': url_name,
+                'status': response.status_code,
+                'total_ms': round(total_ms, 2),
+                'db_ms': round(db_ms, 2),
+                'queries': stats.queries,
+                'render_ms': round(render_ms, 2),
+                'cache_hits': stats.cache_hits,
+                'cache_misses': stats.cache_misses,
+            }))
+        return response
+
+
+class WhiteNoiseMiddleware(BaseWhiteNoiseMiddleware):
+    """
+    ``WhiteNoiseMiddleware`` utilisable en mode async : le middleware
+    d'origine est synchrone et forcerait Django à exécuter toute la suite de
+    la pile (et les vues async) dans un thread.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file, thread_sensitive=False)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve, thread_sensitive=False)(static_file, request)
+        return await self.get_response(request)
@@ -1,7 +1,14 @@
 from datetime import timedelta
+import os
 import random
+import re
+import shutil
+import tempfile
+import time
 import string
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.dispatch import Signal
 import uuid
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
@@ -9,6 +16,54 @@ from django.utils.text import slugify
 from django.contrib.auth.models import AbstractUser
 import unicodedata
 from django.core.exceptions import ValidationError
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db.models.functions import Cast, Coalesce, NullIf
+from django.contrib.postgres.search import SearchVectorField
+
+# Envoyé après un soft delete en masse (aucun post_save n'est émis) avec
+# ``pks`` (liste des clés supprimées) et ``using``.
+post_soft_delete = Signal()
+
+
+class SoftDeleteQuerySet(models.QuerySet):
+    def alive(self):
+        return self.filter(deleted_at__isnull=True)
+
+    def deleted(self):
+        return self.filter(deleted_at__isnull=False)
+
+    def soft_delete(self, now=None):
+        """
+        Soft delete en un seul UPDATE, propagé aux relations listées dans
+        ``Model.soft_delete_cascade`` dans la même transaction.
+        """
+        now = now or timezone.now()
+        alive = self.alive()
+        with transaction.atomic(using=self.db, savepoint=False):
+            # Les enfants d'abord : la sous-requête ne voit plus les parents une fois mis à jour
+            for name in getattr(self.model, 'soft_delete_cascade', ()):
+                relation = self.model._meta.get_field(name)
+                related = SoftDeleteQuerySet(model=relation.related_model, using=self.db)
+                related.filter(**{f'{relation.field.name}__in': alive.values('pk')}).soft_delete(now)
+
+            pks = None
+            if post_soft_delete.has_listeners(self.model):
+                pks = list(alive.values_list('pk', flat=True))
+            count = alive.update(deleted_at=now, updated_at=now)
+            if pks:
+                post_soft_delete.send(sender=self.model, pks=pks, using=self.db)
+        return count
+
+
+class AliveManager(models.Manager.from_queryset(SoftDeleteQuerySet)):
+    """
+    Manager par défaut : exclut les lignes supprimées (soft delete).
+    ``Model.all_objects`` reste disponible pour l'admin.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
 
 class BaseModel(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -20,8 +75,62 @@ class BaseModel(models.Model):
         abstract = True
 
     def soft_delete(self):
-        self.deleted_at = timezone.now()
-        self.save()
+        now = timezone.now()
+        SoftDeleteQuerySet(model=type(self)).filter(pk=self.pk).soft_delete(now)
+        self.deleted_at = self.updated_at = now
+
+class TrackedFieldsMixin:
+    """
+    Garde les valeurs lues en base pour détecter les changements sans relire
+    la ligne. Pendant ``post_save``, ``saved_changes`` contient les champs
+    modifiés (``None`` : état précédent inconnu, ex. création) et
+    ``loaded_value()`` renvoie encore l'ancienne valeur.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def loaded_value(self, attname, default=None):
+        return (getattr(self, '_loaded_values', None) or {}).get(attname, default)
+
+    def changed_fields(self):
+        """
+        Champs modifiés depuis le chargement (ou la dernière sauvegarde), ou
+        ``None`` pour une instance qui n'a pas été lue en base.
+        """
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return None
+        return {name for name, value in loaded.items() if getattr(self, name) != value}
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        saved = None
+        if update_fields is not None:
+            saved = {self._meta.get_field(name).attname for name in update_fields}
+        changes = self.changed_fields()
+        self.saved_changes = changes & saved if changes is not None and saved is not None else changes
+        super().save(*args, **kwargs)
+        deferred = self.get_deferred_fields()
+        values = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields
+            if field.attname not in deferred and (saved is None or field.attname in saved)
+        }
+        if saved is None or getattr(self, '_loaded_values', None) is None:
+            self._loaded_values = values
+        else:
+            # Les champs non sauvegardés gardent leur valeur en base
+            self._loaded_values.update(values)
+
+    def soft_delete(self):
+        super().soft_delete()
+        if getattr(self, '_loaded_values', None) is not None:
+            self._loaded_values.update(deleted_at=self.deleted_at, updated_at=self.updated_at)
+
 
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 
@@ -50,7 +159,7 @@ class CustomUserManager(BaseUserManager):
         return self.create_user(username, email, password, role='admin', **extra_fields)
 
 
-class CustomUser(AbstractUser, BaseModel):
+class CustomUser(TrackedFieldsMixin, AbstractUser, BaseModel):
     ROLE_CHOICES = (
         ('admin', 'Administrateur'),
         ('owner', 'Propriétaire'),
@@ -69,27 +178,10 @@ class CustomUser(AbstractUser, BaseModel):
     def save(self, *args, **kwargs):
         # Normaliser l'email
         self.email = self.email.lower().strip()
-        # Générer username si vide
-        if not self.username:
-            base_username = self.email.split('@')[0].replace('.', '').replace('_', '')[:30]
-            self.username = base_username
-            counter = 1
-            while CustomUser.objects.filter(username=self.username).exclude(id=self.id).exists():
-                self.username = f"{base_username}{counter}"
-                counter += 1
-        # Vérifier si l'email a changé pour un utilisateur existant
-        if self.pk:
-            try:
-                existing_user = CustomUser.objects.get(pk=self.pk)
-                if self.email != existing_user.email:
-                    base_username = self.email.split('@')[0].replace('.', '').replace('_', '')[:30]
-                    self.username = base_username
-                    counter = 1
-                    while CustomUser.objects.filter(username=self.username).exclude(id=self.id).exists():
-                        self.username = f"{base_username}{counter}"
-                        counter += 1
-            except CustomUser.DoesNotExist:
-                pass  # Ignorer si l'utilisateur n'existe pas encore
+        changed = self.changed_fields()
+        # Générer username si vide, ou le régénérer si l'email a changé
+        if not self.username or (changed is not None and 'email' in changed):
+            self.username = allocate_username(username_base(self.email), exclude_pk=self.pk)
         try:
             super().save(*args, **kwargs)
         except Exception as e:
@@ -112,9 +204,57 @@ class PendingUser(BaseModel):
     def __str__(self):
         return f"Pending {self.username} ({self.email})"
 
+    @classmethod
+    def purge_expired(cls, batch_size=1000, pause=0.0, now=None):
+        """
+        Supprime les inscriptions expirées par lots de ``batch_size`` (un
+        DELETE court par lot, en autocommit, via l'index sur ``expires_at``)
+        et renvoie le nombre de lignes supprimées.
+        """
+        now = now or timezone.now()
+        deleted = 0
+        while True:
+            pks = list(cls.objects.filter(expires_at__lt=now).order_by('expires_at').values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                return deleted
+            # expires_at re-vérifié : un renvoi de code a pu prolonger la ligne entre-temps
+            count, _details = cls.objects.filter(pk__in=pks, expires_at__lt=now).delete()
+            deleted += count
+            if len(pks) < batch_size:
+                return deleted
+            if pause:
+                time.sleep(pause)  # laisser passer les écritures concurrentes
+
     class Meta:
         verbose_name = _("Pending User")
         verbose_name_plural = _("Pending Users")
+        indexes = [
+            models.Index(fields=['expires_at'], name='pendinguser_expires_idx'),
+        ]
+
+def username_base(email):
+    return email.split('@')[0].replace('.', '').replace('_', '')[:30]
+
+
+def allocate_username(base, exclude_pk=None):
+    """
+    Premier nom libre parmi ``base``, ``base1``, ``base2``... en une seule
+    requête : parcours par préfixe (index de ``username``) des utilisateurs
+    et des inscriptions en attente.
+    """
+    pattern = rf'^{re.escape(base)}[0-9]*$'
+    users = CustomUser.objects.filter(username__startswith=base, username__regex=pattern)
+    if exclude_pk is not None:
+        users = users.exclude(pk=exclude_pk)
+    pending = PendingUser.objects.filter(username__startswith=base, username__regex=pattern)
+    taken = set(users.values_list('username', flat=True).union(pending.values_list('username', flat=True)))
+    if base not in taken:
+        return base
+    suffixes = {int(name[len(base):]) for name in taken if name != base}
+    counter = 1
+    while counter in suffixes:
+        counter += 1
+    return f"{base}{counter}"
 
 class Category(BaseModel):
     name = models.CharField(_("Name"), max_length=50, unique=True)
@@ -130,10 +270,74 @@ class Property(BaseModel):
     description = models.TextField(_("Description"))
     contact_phone = models.CharField(_("Contact Phone"), max_length=15)
     is_available = models.BooleanField(_("Is Available"), default=True)
+    # Maintenu par apploc.search (PostgreSQL uniquement)
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Première photo active (par ordre), maintenue par les signaux de Photo
+    cover_photo = models.ForeignKey('Photo', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='+', verbose_name=_("Cover Photo"))
+    # Statistiques des avis actifs, maintenues par les signaux de Review (F-expressions)
+    review_count = models.PositiveIntegerField(_("Review Count"), default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(_("Rating Sum"), default=0, editable=False)
+    rating_avg = models.FloatField(_("Average Rating"), default=0, editable=False)
+    # Géocodées hors ligne depuis ``location`` (apploc.geo), à chaque sauvegarde
+    latitude = models.FloatField(_("Latitude"), null=True, blank=True, editable=False)
+    longitude = models.FloatField(_("Longitude"), null=True, blank=True, editable=False)
+
+    objects = AliveManager()
+    all_objects = SoftDeleteQuerySet.as_manager()
+    soft_delete_cascade = ('photos', 'videos', 'reviews')
 
     def __str__(self):
         return _("{category} - {location}").format(category=self.category.name if self.category else "No Category", location=self.location)
 
+    @classmethod
+    def refresh_cover_photos(cls, property_ids):
+        """
+        Recalcule ``cover_photo`` pour les propriétés données en un seul UPDATE.
+        """
+        first_photo = Photo.objects.filter(property=models.OuterRef('pk')).order_by('order', 'created_at').values('pk')[:1]
+        return cls.all_objects.filter(pk__in=property_ids).update(cover_photo=models.Subquery(first_photo))
+
+    @classmethod
+    def apply_review_delta(cls, property_id, count, rating_sum):
+        """
+        Ajoute ``count`` avis et ``rating_sum`` points en un UPDATE atomique
+        (pas de lecture-modification-écriture concurrente).
+        """
+        if not count and not rating_sum:
+            return 0
+        new_count = models.F('review_count') + count
+        new_sum = models.F('rating_sum') + rating_sum
+        return cls.all_objects.filter(pk=property_id).update(
+            review_count=new_count, rating_sum=new_sum, rating_avg=_average(new_sum, new_count),
+        )
+
+    @classmethod
+    def refresh_review_stats(cls, property_ids):
+        """
+        Recalcule les statistiques d'avis des propriétés données en un seul UPDATE.
+        """
+        reviews = Review.objects.filter(property=models.OuterRef('pk')).order_by().values('property')
+        count = Coalesce(models.Subquery(reviews.annotate(n=models.Count('pk')).values('n')[:1]), 0)
+        total = Coalesce(models.Subquery(reviews.annotate(s=models.Sum('rating')).values('s')[:1]), 0)
+        return cls.all_objects.filter(pk__in=property_ids).update(
+            review_count=count, rating_sum=total, rating_avg=_average(total, count),
+        )
+
+    class Meta:
+        # Index partiels : toutes les lectures excluent les lignes supprimées (soft delete)
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='property_alive_created_idx', condition=models.Q(deleted_at__isnull=True)),
+            models.Index(fields=['is_available', '-created_at'], name='property_alive_avail_idx', condition=models.Q(deleted_at__isnull=True)),
+            models.Index(fields=['owner', '-created_at'], name='property_alive_owner_idx', condition=models.Q(deleted_at__isnull=True)),
+            models.Index(fields=['category', '-created_at'], name='property_alive_category_idx', condition=models.Q(deleted_at__isnull=True)),
+            models.Index(fields=['-rating_avg', '-created_at', '-id'], name='property_alive_rating_idx', condition=models.Q(deleted_at__isnull=True)),
+            # Boîte englobante de la recherche par rayon
+            models.Index(fields=['latitude', 'longitude'], name='property_alive_geo_idx', condition=models.Q(deleted_at__isnull=True)),
+        ]
+
+def _average(total, count):
+    return Coalesce(Cast(total, models.FloatField()) / NullIf(count, models.Value(0)), models.Value(0.0))
+
 def photo_upload_path(instance, filename):
     ext = filename.split('.')[-1]
     return f'property_photos/{instance.property.id}_{uuid.uuid4()}.{ext}'
@@ -142,35 +346,193 @@ class Photo(BaseModel):
     property = models.ForeignKey(Property, on_delete=models.CASCADE, related_name='photos', verbose_name=_("Property"))
     image = models.ImageField(upload_to=photo_upload_path, verbose_name=_('Image'))
     order = models.PositiveIntegerField(_("Order"), default=0)
+    # {'source': nom de l'original, 'webp': {'320': nom, ...}, 'avif': {...}}, rempli par tasks.generate_photo_renditions
+    renditions = models.JSONField(_("Renditions"), default=dict, blank=True, editable=False)
+
+    objects = AliveManager()
+    all_objects = SoftDeleteQuerySet.as_manager()
 
     def __str__(self):
         return _("Photo for {property} (Order: {order})").format(property=self.property, order=self.order)
 
+    # Pas de @property ici : le champ ``property`` masque le builtin dans le corps de classe
+    def renditions_stale(self):
+        return bool(self.image) and self.renditions.get('source') != self.image.name
+
+    def srcset(self, fmt):
+        if self.renditions_stale():
+            return ''
+        entries = sorted(self.renditions.get(fmt, {}).items(), key=lambda item: int(item[0]))
+        return ', '.join(f'{self.image.storage.url(name)} {width}w' for width, name in entries)
+
+    def webp_srcset(self):
+        return self.srcset('webp')
+
+    def avif_srcset(self):
+        return self.srcset('avif')
+
     class Meta:
         ordering = ['order']
+        indexes = [
+            models.Index(fields=['property', 'order'], name='photo_alive_property_idx', condition=models.Q(deleted_at__isnull=True)),
+        ]
 
 class Video(BaseModel):
+    class ProcessingStatus(models.TextChoices):
+        PENDING = 'pending', _('Pending')
+        PROCESSING = 'processing', _('Processing')
+        READY = 'ready', _('Ready')
+        SKIPPED = 'skipped', _('Skipped')  # ffmpeg absent : fichier servi tel quel
+        FAILED = 'failed', _('Failed')
+
     property = models.ForeignKey(Property, on_delete=models.CASCADE, related_name='videos', verbose_name=_("Property"))
     video_file = models.FileField(_("Video File"), upload_to='property_videos/')
     order = models.PositiveIntegerField(_("Order"), default=0)
+    # Remplis par tasks.transcode_video
+    poster = models.ImageField(_("Poster"), upload_to='property_videos/posters/', blank=True, editable=False)
+    duration = models.FloatField(_("Duration"), null=True, blank=True, editable=False)
+    processing_status = models.CharField(
+        _("Processing Status"), max_length=10, choices=ProcessingStatus.choices,
+        default=ProcessingStatus.PENDING, editable=False,
+    )
+
+    objects = AliveManager()
+    all_objects = SoftDeleteQuerySet.as_manager()
 
     def __str__(self):
         return _("Video for {property} (Order: {order})").format(property=self.property, order=self.order)
 
     class Meta:
         ordering = ['order']
+        indexes = [
+            models.Index(fields=['property', 'order'], name='video_alive_property_idx', condition=models.Q(deleted_at__isnull=True)),
+        ]
     def __str__(self):
         return _("Video for {property}").format(property=self.property)
 
-class Review(BaseModel):
+class VideoUpload(BaseModel):
+    """
+    Envoi d'une vidéo par morceaux, reprenable : chaque morceau est un
+    fichier de ``VIDEO_UPLOAD_TEMP_DIR`` nommé d'après sa position, puis la
+    tâche ``assemble_video_upload`` les réunit en une ``Video`` sans jamais
+    charger le fichier en mémoire.
+
+    Le répertoire doit être partagé (volume commun) entre les instances web
+    et le worker ``media`` s'ils ne tournent pas sur la même machine ; le
+    répertoire temporaire par défaut suppose une seule instance.
+    """
+    property = models.ForeignKey(Property, on_delete=models.CASCADE, related_name='video_uploads', verbose_name=_("Property"))
+    owner = models.ForeignKey('CustomUser', on_delete=models.CASCADE, related_name='video_uploads', verbose_name=_("Owner"))
+    filename = models.CharField(_("Filename"), max_length=255)
+    content_type = models.CharField(_("Content Type"), max_length=100)
+    total_size = models.PositiveBigIntegerField(_("Total Size"))
+    received = models.PositiveBigIntegerField(_("Received"), default=0)
+    video = models.OneToOneField(Video, on_delete=models.SET_NULL, null=True, blank=True, related_name='upload', verbose_name=_("Video"))
+
+    objects = AliveManager()
+    all_objects = SoftDeleteQuerySet.as_manager()
+
+    def __str__(self):
+        return _("Upload of {filename} ({received}/{total})").format(filename=self.filename, received=self.received, total=self.total_size)
+
+    # Pas de @property : le champ ``property`` masque le builtin dans le corps de classe
+    def upload_dir(self):
+        directory = getattr(settings, 'VIDEO_UPLOAD_TEMP_DIR', None) or os.path.join(tempfile.gettempdir(), 'apploc_video_uploads')
+        path = os.path.join(directory, self.pk.hex)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def chunk_path(self, offset):
+        return os.path.join(self.upload_dir(), f'{offset:012d}.part')
+
+    def is_complete(self):
+        return self.received >= self.total_size
+
+    def chunk_paths(self):
+        """
+        Morceaux contigus présents sur disque depuis le début, dans l'ordre,
+        jusqu'à ``received`` : (position, chemin, taille).
+        """
+        offset = 0
+        while offset < self.received:
+            path = self.chunk_path(offset)
+            try:
+                size = os.path.getsize(path)
+            except FileNotFoundError:
+                return
+            if not size:
+                return
+            yield offset, path, size
+            offset += size
+
+    def current_offset(self):
+        """
+        Octets reçus et réellement présents sur disque (un morceau a pu être
+        purgé entre deux envois).
+        """
+        end = 0
+        for offset, _path, size in self.chunk_paths():
+            end = offset + size
+        return min(self.received, end)
+
+    def receive(self, stream, length, buffer_size=64 * 1024):
+        """
+        Écrit ``length`` octets lus depuis ``stream``, par blocs de
+        ``buffer_size``, dans un fichier temporaire du répertoire de l'envoi ;
+        renvoie son chemin et le nombre d'octets écrits. ``accept()`` en
+        fait ensuite le morceau suivant.
+        """
+        written = 0
+        fd, path = tempfile.mkstemp(suffix='.tmp', dir=self.upload_dir())
+        with os.fdopen(fd, 'wb') as fh:
+            while written < length:
+                data = stream.read(min(buffer_size, length - written))
+                if not data:
+                    break
+                fh.write(data)
+                written += len(data)
+        return path, written
+
+    def accept(self, path, written):
+        # Renommage atomique : l'appelant tient le verrou de la ligne
+        os.replace(path, self.chunk_path(self.received))
+        self.received += written
+
+    def assemble(self, fh):
+        """
+        Copie les morceaux dans ``fh`` ; renvoie le nombre d'octets copiés.
+        """
+        copied = 0
+        for _offset, path, size in self.chunk_paths():
+            with open(path, 'rb') as chunk:
+                shutil.copyfileobj(chunk, fh, 1024 * 1024)
+            copied += size
+        return copied
+
+    def discard(self):
+        shutil.rmtree(self.upload_dir(), ignore_errors=True)
+
+
+class Review(TrackedFieldsMixin, BaseModel):
     property = models.ForeignKey(Property, on_delete=models.CASCADE, related_name='reviews', verbose_name=_("Property"))
     tenant = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='reviews', limit_choices_to={'role': 'tenant'}, verbose_name=_("Tenant"))
+    rating = models.PositiveSmallIntegerField(_("Rating"), default=5, validators=[MinValueValidator(1), MaxValueValidator(5)])
     message = models.TextField(_("Message"))
     date_posted = models.DateTimeField(_("Date Posted"), default=timezone.now)
 
+    objects = AliveManager()
+    all_objects = SoftDeleteQuerySet.as_manager()
+
     def __str__(self):
         return _("Review by {tenant} for {property}").format(tenant=self.tenant.username, property=self.property)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-date_posted', '-id'], name='review_alive_posted_idx', condition=models.Q(deleted_at__isnull=True)),
+            models.Index(fields=['property', '-date_posted'], name='review_alive_property_idx', condition=models.Q(deleted_at__isnull=True)),
+            models.Index(fields=['tenant', '-date_posted'], name='review_alive_tenant_idx', condition=models.Q(deleted_at__isnull=True)),
+        ]
+
 class Contact(BaseModel):
     name = models.CharField(_("Name"), max_length=100)
     email = models.EmailField(_("Email"))
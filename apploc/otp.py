@@ -0,0 +1,63 @@
+"""
+Envoi idempotent des codes de vérification (OTP).
+
+``send_code(pending_user)`` est le seul point d'envoi, appelé par le signal
+``post_save`` de ``PendingUser`` : une clé de cache par (email, code),
+posée avec ``cache.add``, garantit un seul email par code, même si
+l'enregistrement est sauvegardé plusieurs fois ou par deux requêtes
+concurrentes. Un renvoi change le code, donc la clé.
+"""
+import hashlib
+import logging
+import random
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from .dispatch import enqueue
+from .tasks import send_reset_password_email, send_verification_email
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'apploc:otp'
+
+
+def _sent_key(email, code):
+    digest = hashlib.sha256(f'{email.lower()}:{code}'.encode()).hexdigest()
+    return f'{KEY_PREFIX}:{digest}'
+
+
+def new_code(previous=None):
+    """
+    Code à 4 chiffres, différent de ``previous`` : un renvoi avec le même
+    code serait ignoré comme doublon.
+    """
+    while True:
+        code = str(random.randint(1000, 9999))
+        if code != previous:
+            return code
+
+
+def send_code(pending_user):
+    """
+    Envoie le code de ``pending_user`` après le commit, sauf s'il a déjà été
+    envoyé. Renvoie ``True`` si un envoi a été programmé.
+    """
+    email, code = pending_user.email, pending_user.verification_code
+    ttl = max(1, int((pending_user.expires_at - timezone.now()).total_seconds()))
+    if not cache.add(_sent_key(email, code), 1, timeout=ttl):
+        logger.info(f"OTP already sent to {email}, skipping")
+        return False
+
+    if pending_user.user_type == 'reset_password':
+        task = send_reset_password_email
+        message = _('Votre code de réinitialisation est : {code}\nCe code expire dans 10 minutes.')
+    else:
+        task = send_verification_email
+        message = _('Votre code de vérification est : {code}\nCe code expire dans 10 minutes.')
+    message = message.format(code=code)
+    transaction.on_commit(lambda: enqueue(task, email, message))
+    logger.info(f"OTP queued for {email}")
+    return True
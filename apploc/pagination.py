@@ -0,0 +1,178 @@
+"""
+Pagination par curseur (keyset) sans ``COUNT(*)``.
+
+La page suivante est obtenue par un filtre sur la dernière clé de tri vue
+(``(created_at, id) < (x, y)``) au lieu d'un ``OFFSET`` : le coût d'une page
+profonde est le même que celui de la première. Les curseurs sont signés et
+opaques pour le client.
+"""
+from collections.abc import Sequence
+from datetime import date, datetime
+from decimal import Decimal
+from uuid import UUID
+
+from django.core import signing
+from django.db.models import Q
+from django.http import QueryDict
+
+CURSOR_PARAM = 'cursor'
+CURSOR_SALT = 'apploc.pagination'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def _dump_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (UUID, Decimal)):
+        return str(value)
+    return value
+
+
+def _field_value(obj, field):
+    # Instances de modèle ou lignes ``.values()``
+    return obj[field] if isinstance(obj, dict) else getattr(obj, field)
+
+
+class KeysetPage(Sequence):
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None, query_params=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self._query_params = query_params if query_params is not None else QueryDict()
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def _url(self, cursor):
+        params = self._query_params.copy()
+        params[CURSOR_PARAM] = cursor
+        return '?' + params.urlencode()
+
+    @property
+    def next_url(self):
+        return self._url(self.next_cursor) if self.next_cursor else None
+
+    @property
+    def previous_url(self):
+        return self._url(self.previous_cursor) if self.previous_cursor else None
+
+
+class KeysetPaginator:
+    """
+    ``ordering`` doit se terminer par une clé unique (``id``) et tous les
+    champs doivent avoir le même sens de tri.
+    """
+
+    def __init__(self, queryset, ordering=('-created_at', '-id'), per_page=12):
+        descending = {field.startswith('-') for field in ordering}
+        if len(descending) != 1:
+            raise ValueError("Tous les champs de tri doivent avoir le même sens.")
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.fields = tuple(field.lstrip('-') for field in ordering)
+        self.descending = descending.pop()
+        self.per_page = per_page
+
+    # --- curseurs --------------------------------------------------------
+
+    def encode_cursor(self, obj, direction):
+        values = [_dump_value(_field_value(obj, field)) for field in self.fields]
+        return signing.dumps({'d': direction, 'v': values}, salt=CURSOR_SALT, compress=True)
+
+    def decode_cursor(self, cursor):
+        try:
+            payload = signing.loads(cursor, salt=CURSOR_SALT)
+        except signing.BadSignature:
+            raise InvalidCursor(cursor)
+        values = payload.get('v')
+        if payload.get('d') not in ('n', 'p') or not isinstance(values, list) or len(values) != len(self.fields):
+            raise InvalidCursor(cursor)
+        return payload['d'], values
+
+    # --- requêtes --------------------------------------------------------
+
+    def _seek(self, values, forward):
+        # (a, b, c) < (x, y, z)  ==  a < x OR (a = x AND b < y) OR (a = x AND b = y AND c < z)
+        lookup = 'lt' if self.descending == forward else 'gt'
+        condition = Q()
+        for i, field in enumerate(self.fields):
+            term = Q(**{f'{field}__{lookup}': values[i]})
+            for prev_field, prev_value in zip(self.fields[:i], values[:i]):
+                term &= Q(**{prev_field: prev_value})
+            condition |= term
+        return condition
+
+    def _queryset(self, cursor):
+        direction, values = 'n', None
+        if cursor:
+            try:
+                direction, values = self.decode_cursor(cursor)
+            except InvalidCursor:
+                direction, values = 'n', None
+
+        forward = direction == 'n'
+        queryset = self.queryset
+        if values is not None:
+            queryset = queryset.filter(self._seek(values, forward))
+        if forward:
+            queryset = queryset.order_by(*self.ordering)
+        else:
+            queryset = queryset.order_by(*[
+                field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering
+            ])
+
+        # Une ligne de plus pour savoir s'il existe une page au-delà
+        return queryset[:self.per_page + 1], values, forward
+
+    def _page(self, rows, values, forward, query_params):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+
+        next_cursor = previous_cursor = None
+        if rows:
+            if has_more or not forward:
+                next_cursor = self.encode_cursor(rows[-1], 'n')
+            if values is not None and (forward or has_more):
+                previous_cursor = self.encode_cursor(rows[0], 'p')
+        if query_params is not None:
+            query_params = query_params.copy()
+            query_params.pop(CURSOR_PARAM, None)
+        return KeysetPage(rows, next_cursor, previous_cursor, query_params)
+
+    def page(self, cursor=None, query_params=None):
+        queryset, values, forward = self._queryset(cursor)
+        return self._page(list(queryset), values, forward, query_params)
+
+    async def apage(self, cursor=None, query_params=None):
+        queryset, values, forward = self._queryset(cursor)
+        return self._page([obj async for obj in queryset], values, forward, query_params)
+
+
+def paginate(request, queryset, ordering=('-created_at', '-id'), per_page=12):
+    paginator = KeysetPaginator(queryset, ordering=ordering, per_page=per_page)
+    return paginator.page(request.GET.get(CURSOR_PARAM), query_params=request.GET)
+
+
+async def apaginate(request, queryset, ordering=('-created_at', '-id'), per_page=12):
+    paginator = KeysetPaginator(queryset, ordering=ordering, per_page=per_page)
+    return await paginator.apage(request.GET.get(CURSOR_PARAM), query_params=request.GET)
@@ -57,6 +57,10 @@ class PhotoForm(forms.ModelForm):
         return image
 
 
+VIDEO_CONTENT_TYPES = ['video/mp4', 'video/webm', 'video/ogg']
+MAX_VIDEOS_PER_PROPERTY = 2
+
+
 class VideoForm(forms.ModelForm):
     class Meta:
         model = Video
@@ -70,8 +74,7 @@ class VideoForm(forms.ModelForm):
         video = self.cleaned_data.get('video_file')
         if video:
             if hasattr(video, 'content_type'):
-                valid_formats = ['video/mp4', 'video/webm', 'video/ogg']
-                if video.content_type not in valid_formats:
+                if video.content_type not in VIDEO_CONTENT_TYPES:
                     raise forms.ValidationError(_("Format de vidéo non valide. Utilisez MP4, WEBM ou OGG."))
                 if video.size > 50 * 1024 * 1024:
                     raise forms.ValidationError(_("La vidéo ne doit pas dépasser 50 Mo."))
@@ -1,11 +1,14 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 urlpatterns = [
-    path('properties/all/', views.all_properties, name='all_properties'),
-    path('properties/<uuid:property_id>/', views.property_detail, name='property_detail'),
+    path('properties/all/', views.aall_properties if settings.ASYNC_VIEWS else views.all_properties, name='all_properties'),
+    path('properties/<uuid:property_id>/', views.aproperty_detail if settings.ASYNC_VIEWS else views.property_detail, name='property_detail'),
     path('properties/create/', views.property_create, name='property_create'),
     path('properties/<uuid:property_id>/update/', views.property_update, name='property_update'),
     path('properties/<uuid:property_id>/delete/', views.property_delete, name='property_delete'),
+    path('properties/<uuid:property_id>/videos/upload/', views.video_upload_start, name='video_upload_start'),
+    path('properties/videos/uploads/<uuid:upload_id>/', views.video_upload_chunk, name='video_upload_chunk'),
     
 ]
\ No newline at end of file
@@ -1,54 +1,134 @@
-from django.shortcuts import render, redirect, get_object_or_404
+import json
+import os
+from django.shortcuts import aget_object_or_404, render, redirect, get_object_or_404
+from django.conf import settings
 from django.contrib import messages
-from django.utils.translation import gettext_lazy as _
+from django.db import transaction
+from django.db.models import Prefetch
+from django.http import JsonResponse
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.translation import get_language, gettext_lazy as _
 from django.contrib.auth.decorators import login_required
-from .forms import PhotoFormSet, VideoFormSet, PropertyForm
-from ..models import Category, Property, Photo, Video , Review
+from django.views.decorators.http import require_http_methods, require_POST
+from .forms import MAX_VIDEOS_PER_PROPERTY, VIDEO_CONTENT_TYPES, PhotoFormSet, VideoFormSet, PropertyForm
+from ..models import Property, Photo, Video, VideoUpload, Review
+from .. import facets
+from ..cache import aget_or_build, get_or_build
+from ..conditional import conditional
+from ..dispatch import enqueue
+from ..pagination import apaginate, paginate
+from ..tasks import assemble_video_upload
 
-def all_properties(request):
+def _search(request):
     location = request.GET.get('location', '').strip()
-    property_type = request.GET.get('property_type', '')
-    price_range = request.GET.get('price_range', '')
-
-    properties = Property.objects.select_related('category', 'owner').prefetch_related('photos').filter(deleted_at__isnull=True)
-
-    if location:
-        properties = properties.filter(location__icontains=location)
-    if property_type:
-        properties = properties.filter(category__name__iexact=property_type)
-    if price_range:
-        if price_range == 'under_100k':
-            properties = properties.filter(price_per_month__lt=100000)
-        elif price_range == '100k_200k':
-            properties = properties.filter(price_per_month__gte=100000, price_per_month__lte=200000)
-        elif price_range == '200k_500k':
-            properties = properties.filter(price_per_month__gte=200000, price_per_month__lte=500000)
-        elif price_range == 'over_500k':
-            properties = properties.filter(price_per_month__gt=500000)
+    sort = request.GET.get('sort', '')
+    filters = facets.normalize_filters(request.GET)
+
+    properties = facets.filter_properties(
+        Property.objects.select_related('category', 'owner', 'cover_photo'), filters,
+    )
+
+    ordering = facets.search_ordering(filters, sort)
 
     context = {
-        'properties': properties,
         'location': location,
-        'property_type': property_type,
-        'price_range': price_range,
-        'categories': Category.objects.filter(deleted_at__isnull=True)
+        'property_type': filters['property_type'],
+        'price_range': filters['price_range'],
+        'sort': sort,
+        'min_rating': filters['min_rating'],
+        'near': request.GET.get('near', '').strip(),
+        'lat': request.GET.get('lat', ''),
+        'lng': request.GET.get('lng', ''),
+        'radius': str(filters['radius'] or facets.DEFAULT_RADIUS),
+        'radius_choices': facets.RADIUS_CHOICES,
+        'distance_search': filters['latitude'] is not None,
     }
+    return filters, properties, ordering, context
+
+
+@conditional('properties')
+def all_properties(request):
+    filters, properties, ordering, context = _search(request)
+    context['properties'] = paginate(request, properties, ordering=ordering)
+    # Comptes et liste des catégories en cache : pas de requête de plus que la page
+    context['facets'] = facets.facet_counts(filters)
     return render(request, 'property/all_properties.html', context)
 
 
-def property_detail(request, property_id):
-    property = get_object_or_404(Property, id=property_id, deleted_at__isnull=True)
-    photos = Photo.objects.filter(property=property, deleted_at__isnull=True).order_by('order')
-    videos = Video.objects.filter(property=property, deleted_at__isnull=True).order_by('order')
-    reviews = Review.objects.filter(property=property, deleted_at__isnull=True)
-    context = {
-        'property': property,
-        'photos': photos,
-        'videos': videos,
-        'reviews': reviews,
-        'show_sensitive_info': request.user.is_authenticated
+@conditional('properties')
+async def aall_properties(request):
+    request.user = await request.auser()
+    filters, properties, ordering, context = _search(request)
+    context['properties'] = await apaginate(request, properties, ordering=ordering)
+    context['facets'] = await facets.afacet_counts(filters)
+    return render(request, 'property/all_properties.html', context)
+
+
+# Fragment anonyme : invalidé par les signaux, borné dans le temps pour les dates relatives (timesince)
+PROPERTY_DETAIL_CACHE_TIMEOUT = getattr(settings, 'PROPERTY_DETAIL_CACHE_TIMEOUT', 300)
+
+
+def _detail_queryset():
+    """
+    La propriété avec sa catégorie et son propriétaire en une requête, puis
+    une requête par relation : photos et vidéos actives, avis actifs avec
+    leur locataire. Quatre requêtes quel que soit le nombre de médias et d'avis.
+    """
+    return Property.objects.select_related('category', 'owner').prefetch_related(
+        Prefetch('photos', queryset=Photo.objects.order_by('order'), to_attr='alive_photos'),
+        Prefetch('videos', queryset=Video.objects.order_by('order'), to_attr='alive_videos'),
+        Prefetch(
+            'reviews', queryset=Review.objects.select_related('tenant').order_by('-date_posted', '-id'),
+            to_attr='alive_reviews',
+        ),
+    )
+
+
+def _render_detail(request, property):
+    return {
+        'location': property.location,
+        'content_html': render_to_string('partials/property_detail.html', {
+            'property': property,
+            'photos': property.alive_photos,
+            'videos': property.alive_videos,
+            'reviews': property.alive_reviews,
+            'show_sensitive_info': request.user.is_authenticated,
+        }, request),
     }
-    return render(request, 'property/property_detail.html', context)
+
+
+@conditional('properties', 'reviews')
+def property_detail(request, property_id):
+    def build():
+        return _render_detail(request, get_object_or_404(_detail_queryset(), id=property_id))
+
+    if request.user.is_authenticated:
+        page = build()
+    else:
+        # Même page pour tous les visiteurs anonymes : aucune requête en cas de succès
+        page = get_or_build(
+            'property_detail', build, groups=('properties', 'reviews'),
+            vary=(property_id, get_language()), timeout=PROPERTY_DETAIL_CACHE_TIMEOUT,
+        )
+    return render(request, 'property/property_detail.html', page)
+
+
+@conditional('properties', 'reviews')
+async def aproperty_detail(request, property_id):
+    request.user = await request.auser()
+
+    async def build():
+        return _render_detail(request, await aget_object_or_404(_detail_queryset(), id=property_id))
+
+    if request.user.is_authenticated:
+        page = await build()
+    else:
+        page = await aget_or_build(
+            'property_detail', build, groups=('properties', 'reviews'),
+            vary=(property_id, get_language()), timeout=PROPERTY_DETAIL_CACHE_TIMEOUT,
+        )
+    return render(request, 'property/property_detail.html', page)
 
 @login_required
 def property_create(request):
@@ -116,7 +196,7 @@ def property_update(request, property_id):
         messages.error(request, _('Only approved owners can update properties.'))
         return redirect('login')
 
-    prop = get_object_or_404(Property, id=property_id, owner=request.user, deleted_at__isnull=True)
+    prop = get_object_or_404(Property, id=property_id, owner=request.user)
 
     if request.method == 'POST':
         property_form = PropertyForm(request.POST, request.FILES, instance=prop)
@@ -124,20 +204,20 @@ def property_update(request, property_id):
             request.POST, 
             request.FILES, 
             prefix='photos',
-            queryset=Photo.objects.filter(property=prop, deleted_at__isnull=True)
+            queryset=Photo.objects.filter(property=prop)
         )
         video_formset = VideoFormSet(
             request.POST, 
             request.FILES, 
             prefix='videos',
-            queryset=Video.objects.filter(property=prop, deleted_at__isnull=True)
+            queryset=Video.objects.filter(property=prop)
         )
 
         if property_form.is_valid() and photo_formset.is_valid() and video_formset.is_valid():
             property_form.save()
 
             # --- Photos ---
-            existing_photos_count = Photo.objects.filter(property=prop, deleted_at__isnull=True).count()
+            existing_photos_count = Photo.objects.filter(property=prop).count()
             for form in photo_formset:
                 if form.cleaned_data:
                     if form.cleaned_data.get('DELETE') and form.instance.pk:
@@ -154,7 +234,7 @@ def property_update(request, property_id):
                         existing_photos_count += 1
 
             # --- Videos ---
-            existing_videos_count = Video.objects.filter(property=prop, deleted_at__isnull=True).count()
+            existing_videos_count = Video.objects.filter(property=prop).count()
             for form in video_formset:
                 if form.cleaned_data:
                     if form.cleaned_data.get('DELETE') and form.instance.pk:
@@ -175,11 +255,11 @@ def property_update(request, property_id):
     else:
         property_form = PropertyForm(instance=prop)
         photo_formset = PhotoFormSet(
-            queryset=Photo.objects.filter(property=prop, deleted_at__isnull=True),
+            queryset=Photo.objects.filter(property=prop),
             prefix='photos'
         )
         video_formset = VideoFormSet(
-            queryset=Video.objects.filter(property=prop, deleted_at__isnull=True),
+            queryset=Video.objects.filter(property=prop),
             prefix='videos'
         )
 
@@ -187,6 +267,7 @@ def property_update(request, property_id):
         'property_form': property_form,
         'photo_formset': photo_formset,
         'video_formset': video_formset,
+        'video_upload_url': reverse('video_upload_start', args=[prop.pk]),
         'action': _('Update')
     })
 
@@ -197,9 +278,121 @@ def property_delete(request, property_id):
         messages.error(request, _('Only approved owners can delete properties.'))
         return redirect('login')
 
-    property = get_object_or_404(Property, id=property_id, owner=request.user, deleted_at__isnull=True)
+    property = get_object_or_404(Property, id=property_id, owner=request.user)
     if request.method == 'POST':
         property.soft_delete()
         messages.success(request, _('Property deleted successfully.'))
         return redirect('owner_dashboard')
-    return render(request, 'property/property_confirm_delete.html', {'property': property})
\ No newline at end of file
+    return render(request, 'property/property_confirm_delete.html', {'property': property})
+
+
+# --- Envoi de vidéos par morceaux ------------------------------------------
+
+VIDEO_UPLOAD_MAX_SIZE = getattr(settings, 'VIDEO_UPLOAD_MAX_SIZE', 500 * 1024 * 1024)
+VIDEO_UPLOAD_CHUNK_SIZE = getattr(settings, 'VIDEO_UPLOAD_CHUNK_SIZE', 5 * 1024 * 1024)
+
+
+def _upload_state(upload, status=200, error=None):
+    data = {
+        'upload_id': str(upload.pk),
+        'url': reverse('video_upload_chunk', args=[upload.pk]),
+        'offset': upload.received,
+        'size': upload.total_size,
+        'chunk_size': VIDEO_UPLOAD_CHUNK_SIZE,
+        'complete': upload.is_complete(),
+        'video_id': str(upload.video_id) if upload.video_id else None,
+    }
+    if error:
+        data['error'] = str(error)
+    return JsonResponse(data, status=status)
+
+
+@login_required
+@require_POST
+def video_upload_start(request, property_id):
+    """
+    Ouvre un envoi reprenable : ``{"filename", "size", "content_type"}`` en
+    JSON. Les morceaux sont ensuite envoyés en PUT sur l'URL renvoyée.
+    """
+    if request.user.role != 'owner' or not request.user.is_approved:
+        return JsonResponse({'error': str(_('Only approved owners can update properties.'))}, status=403)
+    prop = get_object_or_404(Property, id=property_id, owner=request.user)
+    try:
+        payload = json.loads(request.body)
+        filename = str(payload['filename'])[:255]
+        size = int(payload['size'])
+        content_type = str(payload['content_type'])
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': str(_('Invalid upload request.'))}, status=400)
+
+    if content_type not in VIDEO_CONTENT_TYPES:
+        return JsonResponse({'error': str(_("Format de vidéo non valide. Utilisez MP4, WEBM ou OGG."))}, status=400)
+    if not 0 < size <= VIDEO_UPLOAD_MAX_SIZE:
+        return JsonResponse({'error': str(_("La vidéo ne doit pas dépasser {size} Mo.").format(size=VIDEO_UPLOAD_MAX_SIZE // (1024 * 1024)))}, status=400)
+    if Video.objects.filter(property=prop).count() >= MAX_VIDEOS_PER_PROPERTY:
+        return JsonResponse({'error': str(_("Maximum 2 videos allowed per property."))}, status=400)
+
+    upload = VideoUpload.objects.create(
+        property=prop, owner=request.user, filename=filename, content_type=content_type, total_size=size,
+    )
+    return _upload_state(upload, status=201)
+
+
+@login_required
+@require_http_methods(['GET', 'PUT'])
+def video_upload_chunk(request, upload_id):
+    """
+    GET : position à laquelle reprendre. PUT : corps brut du morceau, avec
+    l'en-tête ``Upload-Offset`` ; une position différente de celle du
+    serveur renvoie 409 et la position attendue. Le dernier morceau renvoie
+    202 : la ``Video`` est créée par la tâche ``assemble_video_upload``, puis
+    ``video_id`` apparaît dans l'état.
+    """
+    if request.method == 'GET':
+        upload = get_object_or_404(VideoUpload, id=upload_id, owner=request.user)
+        upload.received = upload.received if upload.is_complete() else upload.current_offset()
+        return _upload_state(upload)
+
+    try:
+        offset = int(request.headers['Upload-Offset'])
+        length = int(request.headers.get('Content-Length') or 0)
+    except (KeyError, ValueError):
+        return JsonResponse({'error': str(_('Invalid upload request.'))}, status=400)
+    if not 0 < length <= VIDEO_UPLOAD_CHUNK_SIZE:
+        return JsonResponse({'error': str(_('Invalid chunk size.'))}, status=413)
+
+    upload = get_object_or_404(VideoUpload, id=upload_id, owner=request.user)
+    if upload.is_complete():
+        return _upload_state(upload)
+    upload.received = upload.current_offset()
+    if offset != upload.received:
+        return _upload_state(upload, status=409)
+    if offset + length > upload.total_size:
+        return _upload_state(upload, status=400, error=_('Chunk exceeds the declared size.'))
+
+    # Le corps est lu hors transaction ; le verrou ne sert qu'à valider la position et l'avancer
+    path, written = upload.receive(request, length)
+    try:
+        with transaction.atomic():
+            upload = get_object_or_404(VideoUpload.objects.select_for_update(), id=upload_id, owner=request.user)
+            if upload.is_complete():
+                return _upload_state(upload)
+            upload.received = upload.current_offset()
+            if offset != upload.received or not written:
+                return _upload_state(upload, status=409)
+            upload.accept(path, written)
+            if not upload.is_complete():
+                upload.save(update_fields=['received', 'updated_at'])
+                return _upload_state(upload)
+
+            if Video.objects.filter(property_id=upload.property_id).count() >= MAX_VIDEOS_PER_PROPERTY:
+                upload.discard()
+                upload.soft_delete()
+                return _upload_state(upload, status=409, error=_("Maximum 2 videos allowed per property."))
+            upload.save(update_fields=['received', 'updated_at'])
+            # Dernier morceau : la copie vers le stockage se fait dans la file media
+            transaction.on_commit(lambda: enqueue(assemble_video_upload, upload.pk))
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    return _upload_state(upload, status=202)
@@ -0,0 +1,130 @@
+"""
+Limitation de débit par fenêtre glissante, stockée dans le cache.
+
+Chaque règle (``RATE_LIMITS``) compte les POST par adresse IP ou par email.
+La fenêtre glissante est estimée à partir de deux compteurs fixes
+(fenêtre courante et précédente, pondérée par le temps restant) : un
+``incr`` atomique puis une lecture par règle. Une tentative refusée par une
+règle n'est comptée pour aucune : ``decr`` de son compteur et de ceux des
+règles déjà passées. Le refus (429) est décidé avant la vue, donc avant
+toute requête SQL et tout calcul de hash. ``settings.RATE_LIMITS`` est lu à
+chaque requête.
+"""
+import hashlib
+import math
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+
+KEY_PREFIX = 'apploc:rl'
+UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# (clé, débit) par vue ; débit « nombre/durée », ex. « 5/15m »
+DEFAULT_RATE_LIMITS = {
+    'login': [('ip', '20/5m'), ('email', '10/15m')],
+    'signup': [('ip', '10/h'), ('email', '5/h')],
+    'verify_email': [('ip', '30/15m'), ('email', '5/15m')],
+    'password_reset_request': [('ip', '10/h'), ('email', '5/h')],
+    'password_reset_verify': [('ip', '30/15m'), ('email', '5/15m')],
+}
+
+
+def parse_rate(rate):
+    count, period = rate.split('/')
+    number = period[:-1] or '1'
+    return int(count), int(number) * UNITS[period[-1]]
+
+
+def client_ip(request):
+    """
+    Adresse du client ; derrière ``RATELIMIT_PROXY_COUNT`` proxys de
+    confiance, l'entrée correspondante de ``X-Forwarded-For``.
+    """
+    proxies = getattr(settings, 'RATELIMIT_PROXY_COUNT', 0)
+    if proxies:
+        forwarded = [part.strip() for part in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if part.strip()]
+        if len(forwarded) >= proxies:
+            return forwarded[-proxies]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _undo(key):
+    try:
+        cache.decr(key)
+    except ValueError:
+        pass
+
+
+def _hit(scope, value, limit, window, now):
+    now = now if now is not None else time.time()
+    current = int(now // window)
+    elapsed = now - current * window
+    digest = hashlib.sha256(value.encode()).hexdigest()[:32]
+    current_key = f'{KEY_PREFIX}:{scope}:{digest}:{current}'
+    previous_key = f'{KEY_PREFIX}:{scope}:{digest}:{current - 1}'
+
+    # Compter d'abord : des requêtes concurrentes obtiennent chacune un rang distinct
+    try:
+        count = cache.incr(current_key)
+    except ValueError:
+        count = 1 if cache.add(current_key, 1, timeout=2 * window) else cache.incr(current_key)
+    # Tentatives acceptées avant celle-ci
+    estimate = cache.get(previous_key, 0) * (window - elapsed) / window + count - 1
+    if estimate >= limit:
+        _undo(current_key)
+        return max(1, math.ceil(window - elapsed)), current_key
+    return 0, current_key
+
+
+def hit(scope, value, limit, window, now=None):
+    """
+    Compte une tentative pour ``value`` ; renvoie 0 si elle est acceptée,
+    sinon le nombre de secondes avant de réessayer (la tentative refusée
+    n'est pas comptée).
+    """
+    return _hit(scope, value, limit, window, now)[0]
+
+
+def check(request, scope, email=None):
+    """
+    Applique les règles de ``scope`` ; renvoie 0 ou le délai d'attente de la
+    première règle dépassée, sans compter la tentative refusée.
+    """
+    counted = []
+    for key, rate in getattr(settings, 'RATE_LIMITS', DEFAULT_RATE_LIMITS).get(scope, ()):
+        value = client_ip(request) if key == 'ip' else (email or '').strip().lower()
+        if not value:
+            continue
+        limit, window = parse_rate(rate)
+        retry_after, counter = _hit(f'{scope}:{key}', value, limit, window, None)
+        if retry_after:
+            # Refus par l'email : le compteur IP ne doit pas en garder la trace
+            for counter in counted:
+                _undo(counter)
+            return retry_after
+        counted.append(counter)
+    return 0
+
+
+def ratelimit(scope):
+    """
+    Limite les POST de la vue selon ``settings.RATE_LIMITS[scope]``. L'email vient du
+    paramètre d'URL ``email`` ou du champ ``email`` du formulaire.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method == 'POST':
+                retry_after = check(request, scope, kwargs.get('email') or request.POST.get('email'))
+                if retry_after:
+                    # Gabarit autonome, rendu sans contexte de requête : ni session ni utilisateur chargés
+                    response = HttpResponse(render_to_string('429.html', {'retry_after': retry_after}), status=429)
+                    response['Retry-After'] = str(retry_after)
+                    return response
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
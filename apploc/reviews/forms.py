@@ -7,8 +7,9 @@ from ..models import ContactMessage, Property, Photo, Video, Review, Category
 class ReviewForm(forms.ModelForm):
     class Meta:
         model = Review
-        fields = ['message']
+        fields = ['rating', 'message']
         labels = {
+            'rating': _('Note'),
             'message': _('Commentaire'),
         }
         widgets = {
@@ -1,9 +1,10 @@
 
+from django.conf import settings
 from django.urls import path
 from . import views
 
 urlpatterns = [
-    path('reviews/all/', views.all_reviews, name='all_reviews'),
+    path('reviews/all/', views.aall_reviews if settings.ASYNC_VIEWS else views.all_reviews, name='all_reviews'),
     path('reviews/list/', views.review_list, name='review_list'),
     path('properties/<uuid:property_id>/review/create/', views.review_create, name='review_create'),
     path('reviews/<uuid:review_id>/update/', views.review_update, name='review_update'),
@@ -7,12 +7,34 @@ from apploc.tasks import send_contact_email
 from location import settings
 from ..models import Category, Property, Review, Photo, Video
 from ..reviews.forms import  ReviewForm
+from ..pagination import apaginate, paginate
+from ..cache import aget_or_build, get_or_build
+from ..conditional import conditional
 from django.utils.translation import activate
 
+# Total en cache (groupe reviews) : pas de COUNT(*) sur toute la table à chaque page
+def _total_reviews():
+    return get_or_build('review_total', Review.objects.count, groups=('reviews',))
+
+async def _atotal_reviews():
+    return await aget_or_build('review_total', Review.objects.acount, groups=('reviews',))
+
+@conditional('reviews', 'properties')
 def all_reviews(request):
-    reviews = Review.objects.select_related('tenant', 'property').filter(deleted_at__isnull=True).order_by('-date_posted')
+    reviews = Review.objects.select_related('tenant', 'property', 'property__category')
+    return render(request, 'reviews/all_reviews.html', {
+        'reviews': paginate(request, reviews, ordering=('-date_posted', '-id')),
+        'total_reviews': _total_reviews(),
+        'is_authenticated': request.user.is_authenticated
+    })
+
+@conditional('reviews', 'properties')
+async def aall_reviews(request):
+    request.user = await request.auser()
+    reviews = Review.objects.select_related('tenant', 'property', 'property__category')
     return render(request, 'reviews/all_reviews.html', {
-        'reviews': reviews,
+        'reviews': await apaginate(request, reviews, ordering=('-date_posted', '-id')),
+        'total_reviews': await _atotal_reviews(),
         'is_authenticated': request.user.is_authenticated
     })
     
@@ -22,8 +44,9 @@ def review_list(request):
         messages.error(request, _('Only tenants can manage reviews.'))
         return redirect('login')
 
-    reviews = Review.objects.filter(tenant=request.user, deleted_at__isnull=True)
-    return render(request, 'reviews/review_list.html', {'reviews': reviews})
+    reviews = list(Review.objects.select_related('property__category').filter(tenant=request.user))
+    average_rating = round(sum(review.rating for review in reviews) / len(reviews)) if reviews else 0
+    return render(request, 'reviews/review_list.html', {'reviews': reviews, 'average_rating': average_rating})
 
 @login_required
 def review_create(request, property_id):
@@ -31,7 +54,7 @@ def review_create(request, property_id):
         messages.error(request, _('Only tenants can create reviews.'))
         return redirect('login')
 
-    property = get_object_or_404(Property, id=property_id, deleted_at__isnull=True)
+    property = get_object_or_404(Property, id=property_id)
     if request.method == 'POST':
         form = ReviewForm(request.POST)
         if form.is_valid():
@@ -51,7 +74,7 @@ def review_update(request, review_id):
         messages.error(request, _('Only tenants can update reviews.'))
         return redirect('login')
 
-    review = get_object_or_404(Review, id=review_id, tenant=request.user, deleted_at__isnull=True)
+    review = get_object_or_404(Review, id=review_id, tenant=request.user)
     if request.method == 'POST':
         form = ReviewForm(request.POST, instance=review)
         if form.is_valid():
@@ -68,7 +91,7 @@ def review_delete(request, review_id):
         messages.error(request, _('Only tenants can delete reviews.'))
         return redirect('login')
 
-    review = get_object_or_404(Review, id=review_id, tenant=request.user, deleted_at__isnull=True)
+    review = get_object_or_404(Review, id=review_id, tenant=request.user)
     if request.method == 'POST':
         review.soft_delete()
         messages.success(request, _('Review deleted successfully.'))
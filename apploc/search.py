@@ -0,0 +1,222 @@
+"""
+Moteur de recherche plein texte des propriétés.
+
+Indexe ``location``, ``category.name`` et ``description`` :
+
+* PostgreSQL : colonne ``Property.search_vector`` (tsvector pondéré) avec un
+  index GIN, configuration ``french_unaccent`` insensible aux accents et
+  repli trigramme (``pg_trgm``) sur ``location`` pour les fautes de frappe.
+* SQLite (DEBUG) : table virtuelle FTS5 ``apploc_property_fts`` tenue à jour
+  à côté de la table ``apploc_property``.
+
+Les objets de base de données sont créés par ``install()`` au
+``post_migrate`` et l'index est mis à jour à chaque sauvegarde de propriété.
+"""
+import re
+import unicodedata
+
+from django.db import connection as default_connection
+from django.db.models import F, FloatField, Func, Q, Value
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'apploc_property_fts'
+TS_CONFIG = 'french_unaccent'
+
+# Poids des champs dans le classement (location > catégorie > description)
+WEIGHTS = (('location', 'A', 10.0), ('category', 'B', 5.0), ('description', 'C', 1.0))
+
+
+def normalize(text):
+    """
+    Minuscules et suppression des accents ("Yaoundé" -> "yaounde").
+    """
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(c for c in text if not unicodedata.combining(c)).lower().strip()
+
+
+def tokenize(text):
+    return re.findall(r'\w+', normalize(text))
+
+
+def _is_postgres(connection):
+    return connection.vendor == 'postgresql'
+
+
+def _is_sqlite(connection):
+    return connection.vendor == 'sqlite'
+
+
+def _document(prop):
+    category = prop.category.name if prop.category_id and prop.category else ''
+    return {
+        'location': prop.location or '',
+        'category': category,
+        'description': prop.description or '',
+    }
+
+
+# --- Installation --------------------------------------------------------
+
+def install(connection=default_connection):
+    """
+    Crée les objets de recherche propres au moteur (idempotent).
+    """
+    with connection.cursor() as cursor:
+        if _is_postgres(connection):
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS unaccent')
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            cursor.execute(
+                "SELECT 1 FROM pg_ts_config WHERE cfgname = %s", [TS_CONFIG]
+            )
+            if cursor.fetchone() is None:
+                cursor.execute(f'CREATE TEXT SEARCH CONFIGURATION {TS_CONFIG} (COPY = french)')
+                cursor.execute(
+                    f'ALTER TEXT SEARCH CONFIGURATION {TS_CONFIG} '
+                    'ALTER MAPPING FOR hword, hword_part, word WITH unaccent, french_stem'
+                )
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS apploc_property_search_gin '
+                'ON apploc_property USING gin (search_vector)'
+            )
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS apploc_property_location_trgm '
+                'ON apploc_property USING gin (location gin_trgm_ops)'
+            )
+        elif _is_sqlite(connection):
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5('
+                'property_id UNINDEXED, location, category, description, '
+                "tokenize = 'unicode61 remove_diacritics 2')"
+            )
+
+
+# --- Mise à jour incrémentale -------------------------------------------
+
+def index_property(prop, connection=default_connection):
+    """
+    Met à jour l'entrée d'index d'une propriété ; une propriété supprimée
+    (soft delete) est retirée de l'index.
+    """
+    if prop.deleted_at is not None:
+        return unindex_properties([prop.pk], connection)
+
+    doc = _document(prop)
+    if _is_postgres(connection):
+        from django.contrib.postgres.search import SearchVector
+        from .models import Property
+
+        vector = None
+        for field, weight, _boost in WEIGHTS:
+            part = SearchVector(Value(doc[field]), weight=weight, config=TS_CONFIG)
+            vector = part if vector is None else vector + part
+        Property.all_objects.filter(pk=prop.pk).update(search_vector=vector)
+    elif _is_sqlite(connection):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE property_id = %s', [prop.pk.hex])
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (property_id, location, category, description) '
+                'VALUES (%s, %s, %s, %s)',
+                [prop.pk.hex, doc['location'], doc['category'], doc['description']],
+            )
+
+
+def unindex_properties(pks, connection=default_connection):
+    pks = list(pks)
+    if not pks:
+        return
+    if _is_postgres(connection):
+        from .models import Property
+
+        Property.all_objects.filter(pk__in=pks).update(search_vector=None)
+    elif _is_sqlite(connection):
+        placeholders = ', '.join(['%s'] * len(pks))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} WHERE property_id IN ({placeholders})',
+                [pk.hex for pk in pks],
+            )
+
+
+def rebuild(queryset=None, connection=default_connection, batch_size=500):
+    """
+    Réindexe toutes les propriétés actives ; renvoie le nombre indexé.
+    """
+    from .models import Property
+
+    install(connection)
+    if queryset is None:
+        queryset = Property.objects.all()
+    if _is_sqlite(connection):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+    count = 0
+    for prop in queryset.select_related('category').iterator(chunk_size=batch_size):
+        index_property(prop, connection)
+        count += 1
+    return count
+
+
+# --- Requêtes ------------------------------------------------------------
+
+def _fts5_query(terms):
+    # Chaque terme est cité (pas d'injection de syntaxe FTS5) et préfixé
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+class Fts5Rank(Func):
+    """
+    Score ``-bm25`` de chaque propriété pour ``match``. Les résultats FTS5
+    sont calculés une seule fois par requête (CTE matérialisée, lue par un
+    index automatique sur ``property_id``) au lieu d'un MATCH par ligne ;
+    la colonne de l'identifiant est résolue par Django (alias, sous-requête).
+    """
+    output_field = FloatField()
+
+    def __init__(self, match, materialized=True):
+        weights = ', '.join(str(boost) for _field, _weight, boost in WEIGHTS)
+        self.match = match
+        # MATERIALIZED : SQLite 3.35+, sans quoi la CTE serait remise dans la sous-requête
+        self.template = (
+            f'(WITH fts_rank AS {"MATERIALIZED " if materialized else ""}('
+            f'SELECT property_id, -bm25({FTS_TABLE}, 0, {weights}) AS rank '
+            f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %%s) '
+            'SELECT rank FROM fts_rank WHERE property_id = %(expressions)s)'
+        )
+        super().__init__(F('pk'))
+
+    def as_sql(self, compiler, connection, **extra_context):
+        sql, params = super().as_sql(compiler, connection, **extra_context)
+        return sql, (self.match, *params)
+
+
+def search_properties(queryset, text, connection=default_connection):
+    """
+    Filtre ``queryset`` sur ``text`` et l'annote avec ``search_rank``
+    (plus grand = plus pertinent). Ne trie pas : à l'appelant de choisir.
+    """
+    terms = tokenize(text)
+    if not terms:
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    if _is_postgres(connection):
+        from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+
+        query = SearchQuery(' '.join(terms), config=TS_CONFIG, search_type='websearch')
+        return queryset.annotate(
+            search_rank=SearchRank(F('search_vector'), query)
+            + TrigramWordSimilarity(Value(' '.join(terms)), 'location'),
+        ).filter(Q(search_vector=query) | Q(location__trigram_word_similar=' '.join(terms)))
+
+    if _is_sqlite(connection):
+        match = _fts5_query(terms)
+        return queryset.filter(
+            pk__in=RawSQL(f'SELECT property_id FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match])
+        ).annotate(
+            search_rank=Fts5Rank(match, materialized=connection.Database.sqlite_version_info >= (3, 35)),
+        )
+
+    # Autres moteurs : recherche par sous-chaîne, sans classement
+    condition = Q()
+    for term in terms:
+        condition &= Q(location__icontains=term) | Q(description__icontains=term) | Q(category__name__icontains=term)
+    return queryset.filter(condition).annotate(search_rank=Value(0.0, output_field=FloatField()))
@@ -1,19 +1,135 @@
-from django.db.models.signals import post_save
+from django.db import connections, transaction
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_save
 from django.dispatch import receiver
-from .models import PendingUser
-from .tasks import send_verification_email, send_reset_password_email
-from django.utils.translation import gettext_lazy as _
+from .models import Category, CustomUser, PendingUser, Photo, Property, Review, Video, post_soft_delete
+from .tasks import generate_photo_renditions, transcode_video
+from . import cache, geo, otp, search
+from .dispatch import enqueue
 
 @receiver(post_save, sender=PendingUser)
-def handle_pending_user_verification(sender, instance, created, **kwargs):
-    if created:
-        if instance.user_type == 'reset_password':
-            send_reset_password_email.delay(
-                instance.email,
-                str(_('Votre code de réinitialisation est : {code}\nCe code expire dans 10 minutes.').format(code=instance.verification_code))
-            )
+def handle_pending_user_verification(sender, instance, raw=False, **kwargs):
+    # Création et renvoi (nouveau code) : otp.send_code ignore un code déjà envoyé
+    if not raw:
+        otp.send_code(instance)
+
+@receiver(post_migrate)
+def install_search_backend(sender, using, **kwargs):
+    if sender.label == 'apploc':
+        search.install(connections[using])
+
+@receiver(pre_save, sender=Property)
+def geocode_property(sender, instance, raw=False, **kwargs):
+    # Gazetteer en mémoire : pas de réseau, quelques recherches dans un dict
+    if not raw:
+        instance.latitude, instance.longitude = geo.geocode(instance.location) or (None, None)
+
+@receiver(post_save, sender=Property)
+def index_property(sender, instance, raw=False, using=None, **kwargs):
+    if not raw:
+        search.index_property(instance, connections[using])
+
+@receiver(post_soft_delete, sender=Property)
+def unindex_deleted_properties(sender, pks, using, **kwargs):
+    search.unindex_properties(pks, connections[using])
+
+@receiver(post_save, sender=Category)
+def reindex_category_properties(sender, instance, created, raw=False, using=None, **kwargs):
+    # Le nom de catégorie fait partie du document indexé
+    if not created and not raw:
+        properties = instance.properties.select_related('category')
+        for prop in properties:
+            search.index_property(prop, connections[using])
+
+@receiver(post_save, sender=Photo)
+def refresh_cover_photo(sender, instance, raw=False, **kwargs):
+    if not raw:
+        Property.refresh_cover_photos([instance.property_id])
+
+@receiver(post_save, sender=Photo)
+def schedule_photo_renditions(sender, instance, raw=False, **kwargs):
+    if not raw and instance.deleted_at is None and instance.renditions_stale():
+        transaction.on_commit(lambda: enqueue(generate_photo_renditions, instance.pk))
+
+@receiver(post_save, sender=Video)
+def schedule_video_transcode(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        transaction.on_commit(lambda: enqueue(transcode_video, instance.pk))
+
+@receiver(post_delete, sender=Photo)
+def refresh_cover_photo_after_hard_delete(sender, instance, **kwargs):
+    # SET_NULL a vidé cover_photo même si la propriété a d'autres photos
+    Property.refresh_cover_photos([instance.property_id])
+
+@receiver(post_soft_delete, sender=Photo)
+def refresh_cover_photo_after_delete(sender, pks, using, **kwargs):
+    property_ids = Photo.all_objects.using(using).filter(pk__in=pks).values('property_id')
+    Property.refresh_cover_photos(property_ids)
+
+# Statistiques d'avis dénormalisées sur Property
+@receiver(post_save, sender=Review)
+def update_review_stats(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    changes = instance.saved_changes
+    if changes is None and not created:
+        # État précédent inconnu (instance non lue en base) : recalcul
+        Property.refresh_review_stats([instance.property_id])
+    elif created or changes & {'rating', 'property_id', 'deleted_at'}:
+        old_alive = not created and instance.loaded_value('deleted_at') is None
+        old_property = instance.loaded_value('property_id')
+        old_rating = instance.loaded_value('rating', 0) if old_alive else 0
+        alive = instance.deleted_at is None
+        rating = instance.rating if alive else 0
+        if created or old_property == instance.property_id:
+            Property.apply_review_delta(instance.property_id, int(alive) - int(old_alive), rating - old_rating)
         else:
-            send_verification_email.delay(
-                instance.email,
-                str(_('Votre code de vérification est : {code}\nCe code expire dans 10 minutes.').format(code=instance.verification_code))
-            )
\ No newline at end of file
+            Property.apply_review_delta(old_property, -int(old_alive), -old_rating)
+            Property.apply_review_delta(instance.property_id, int(alive), rating)
+    else:
+        return
+    cache.bump('properties')
+
+@receiver(post_soft_delete, sender=Review)
+def remove_deleted_review_stats(sender, pks, using, **kwargs):
+    # Suppression groupée (cascade d'une propriété, admin) : un seul UPDATE quel que soit le nombre de propriétés
+    Property.refresh_review_stats(Review.all_objects.using(using).filter(pk__in=pks).values('property_id'))
+    cache.bump('properties')
+
+@receiver(post_delete, sender=Review)
+def remove_review_stats(sender, instance, **kwargs):
+    if instance.deleted_at is None:
+        Property.apply_review_delta(instance.property_id, -1, -instance.rating)
+        cache.bump('properties')
+
+# Invalidation du cache applicatif (apploc.cache)
+@receiver(post_save, sender=Property)
+@receiver(post_save, sender=Photo)
+@receiver(post_save, sender=Video)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Property)
+@receiver(post_delete, sender=Photo)
+@receiver(post_delete, sender=Video)
+@receiver(post_soft_delete, sender=Property)
+@receiver(post_soft_delete, sender=Photo)
+@receiver(post_soft_delete, sender=Video)
+def invalidate_properties_cache(sender, **kwargs):
+    cache.bump('properties')
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+@receiver(post_soft_delete, sender=Review)
+def invalidate_reviews_cache(sender, **kwargs):
+    cache.bump('reviews')
+
+@receiver(post_save, sender=CustomUser)
+def invalidate_reviews_cache_on_email_change(sender, instance, created, update_fields=None, **kwargs):
+    # Les avis affichent l'email du locataire ; last_login seul ne compte pas
+    if created:
+        return
+    if update_fields is not None:
+        changed = 'email' in update_fields
+    else:
+        changes = getattr(instance, 'saved_changes', None)
+        changed = changes is None or 'email' in changes
+    if changed:
+        cache.bump('reviews')
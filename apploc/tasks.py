@@ -1,43 +1,40 @@
 from celery import shared_task
-from django.core.mail import send_mail
 from django.conf import settings
-from django.core.mail import EmailMultiAlternatives
+from django.core.mail import EmailMessage, EmailMultiAlternatives
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
+from . import mail
 
-@shared_task
-def send_verification_email(email, message):
+# Un destinataire par message : une nouvelle tentative ne renvoie à personne d'autre
+MAIL_TASK_OPTIONS = {
+    'bind': True,
+    'autoretry_for': (mail.MailDeferred,),
+    'retry_backoff': int(mail.MAIL_BACKOFF_BASE),
+    'retry_backoff_max': mail.MAIL_BACKOFF_MAX,
+    'max_retries': mail.MAIL_MAX_ATTEMPTS - 1,
+}
+
+@shared_task(**MAIL_TASK_OPTIONS)
+def send_verification_email(self, email, message):
     """
     Envoie un email de vérification avec le message complet déjà généré.
     """
     subject = 'Vérification de votre compte'
-    send_mail(
-        subject,
-        message,
-        settings.DEFAULT_FROM_EMAIL,
-        [email],
-        fail_silently=False,
-    )
+    mail.send(EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL, [email]), task=self)
 
-@shared_task
-def send_reset_password_email(email, message):
+@shared_task(**MAIL_TASK_OPTIONS)
+def send_reset_password_email(self, email, message):
     """
     Envoie un email de réinitialisation avec le message complet déjà généré.
     """
     subject = 'Code de réinitialisation du mot de passe'
-    send_mail(
-        subject,
-        message,
-        settings.DEFAULT_FROM_EMAIL,
-        [email],
-        fail_silently=False,
-    )
+    mail.send(EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL, [email]), task=self)
 import logging
 
 logger = logging.getLogger(__name__)
 
-@shared_task
-def send_contact_email(name, email, subject, message):
+@shared_task(**MAIL_TASK_OPTIONS)
+def send_contact_email(self, name, email, subject, message):
     try:
         context = {
             'name': name,
@@ -57,8 +54,241 @@ def send_contact_email(name, email, subject, message):
         )
         
         email_message.attach_alternative(html_content, "text/html")
-        email_message.send()
-        logger.info(f"Email sent to {settings.CONTACT_EMAIL} from {email}")
+        mail.send(email_message, task=self)
+        logger.info(f"Email queued to {settings.CONTACT_EMAIL} from {email}")
     except Exception as e:
         logger.error(f"Failed to send email: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+
+# --- Photos : déclinaisons responsives ----------------------------------
+
+import os
+from io import BytesIO
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, features
+
+PHOTO_RENDITION_WIDTHS = getattr(settings, 'PHOTO_RENDITION_WIDTHS', (320, 640, 1024, 1600))
+PHOTO_RENDITION_QUALITY = {'webp': 80, 'avif': 60}
+
+
+def photo_rendition_formats():
+    return [fmt for fmt in ('avif', 'webp') if features.check(fmt)]
+
+
+@shared_task
+def generate_photo_renditions(photo_id):
+    """
+    Génère les déclinaisons WebP/AVIF d'une photo, sans métadonnées EXIF,
+    à côté de l'original, et les enregistre dans ``Photo.renditions``.
+    """
+    from .models import Photo
+    from .cache import bump
+
+    photo = Photo.all_objects.filter(pk=photo_id).first()
+    if photo is None or not photo.image:
+        return
+    storage = photo.image.storage
+    source = photo.image.name
+
+    try:
+        with storage.open(source, 'rb') as fh:
+            with Image.open(fh) as original:
+                # Appliquer l'orientation EXIF avant de la perdre
+                image = ImageOps.exif_transpose(original)
+                image.load()
+    except (OSError, Image.UnidentifiedImageError) as e:
+        logger.error(f"Cannot read photo {photo_id} ({source}): {str(e)}")
+        return
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+    base = os.path.splitext(source)[0]
+    renditions = {'source': source}
+    for fmt in photo_rendition_formats():
+        entries = {}
+        for width in PHOTO_RENDITION_WIDTHS:
+            width = min(width, image.width)
+            if str(width) in entries:
+                break  # pas d'agrandissement au-delà de l'original
+            height = max(1, round(image.height * width / image.width))
+            resized = image if width == image.width else image.resize((width, height), Image.Resampling.LANCZOS)
+            buffer = BytesIO()
+            # Pas d'argument exif= : la déclinaison est enregistrée sans métadonnées
+            resized.save(buffer, format=fmt.upper(), quality=PHOTO_RENDITION_QUALITY[fmt])
+            entries[str(width)] = storage.save(f'{base}_w{width}.{fmt}', ContentFile(buffer.getvalue()))
+        renditions[fmt] = entries
+
+    # Supprimer les déclinaisons d'une image précédente
+    for fmt, entries in photo.renditions.items():
+        if fmt != 'source':
+            for name in entries.values():
+                storage.delete(name)
+
+    Photo.all_objects.filter(pk=photo_id).update(renditions=renditions)
+    bump('properties')
+    logger.info(f"Renditions generated for photo {photo_id}: {sum(len(v) for k, v in renditions.items() if k != 'source')}")
+
+# --- Vidéos : transcodage web et vignette ---------------------------------
+
+import json
+import shutil
+import subprocess
+import tempfile
+from django.core.files import File
+
+FFMPEG_BINARY = getattr(settings, 'FFMPEG_BINARY', 'ffmpeg')
+FFPROBE_BINARY = getattr(settings, 'FFPROBE_BINARY', 'ffprobe')
+VIDEO_TRANSCODE_TIMEOUT = getattr(settings, 'VIDEO_TRANSCODE_TIMEOUT', 30 * 60)  # secondes
+VIDEO_MAX_HEIGHT = getattr(settings, 'VIDEO_MAX_HEIGHT', 720)
+
+
+def _run(args, timeout):
+    return subprocess.run(args, check=True, capture_output=True, timeout=timeout)
+
+
+def probe_video(ffprobe, path):
+    """
+    Renvoie la durée (secondes) du fichier, ou lève ``ValueError`` s'il ne
+    contient pas de flux vidéo.
+    """
+    output = _run([
+        ffprobe, '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', path,
+    ], timeout=60).stdout
+    info = json.loads(output)
+    if not any(stream.get('codec_type') == 'video' for stream in info.get('streams', [])):
+        raise ValueError('no video stream')
+    return float(info.get('format', {}).get('duration') or 0)
+
+
+@shared_task
+def transcode_video(video_id):
+    """
+    Produit un MP4 H.264/AAC « faststart » (lecture progressive) et une
+    vignette JPEG avec le ffmpeg local ; sans ffmpeg, la vidéo est laissée
+    telle quelle et marquée ``skipped``.
+    """
+    from .models import Video
+    from .cache import bump
+
+    video = Video.all_objects.filter(pk=video_id).first()
+    if video is None or not video.video_file:
+        return
+    videos = Video.all_objects.filter(pk=video_id)
+    ffmpeg, ffprobe = shutil.which(FFMPEG_BINARY), shutil.which(FFPROBE_BINARY)
+    if not ffmpeg or not ffprobe:
+        logger.warning(f"ffmpeg not available, video {video_id} served as uploaded")
+        videos.update(processing_status=Video.ProcessingStatus.SKIPPED)
+        return
+
+    videos.update(processing_status=Video.ProcessingStatus.PROCESSING)
+    storage = video.video_file.storage
+    source = video.video_file.name
+    scale = f"scale=-2:'min({VIDEO_MAX_HEIGHT},ih)'"
+
+    with tempfile.TemporaryDirectory(prefix='apploc_video_') as workdir:
+        local = os.path.join(workdir, 'source' + os.path.splitext(source)[1])
+        with storage.open(source, 'rb') as src, open(local, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        output = os.path.join(workdir, 'web.mp4')
+        poster = os.path.join(workdir, 'poster.jpg')
+        try:
+            duration = probe_video(ffprobe, local)
+            _run([
+                ffmpeg, '-v', 'error', '-y', '-i', local,
+                '-map', '0:v:0', '-map', '0:a:0?',
+                '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-pix_fmt', 'yuv420p', '-vf', scale,
+                '-c:a', 'aac', '-b:a', '128k',
+                '-movflags', '+faststart', output,
+            ], timeout=VIDEO_TRANSCODE_TIMEOUT)
+            _run([
+                ffmpeg, '-v', 'error', '-y', '-ss', f'{min(1.0, duration / 2):.2f}', '-i', local,
+                '-frames:v', '1', '-vf', scale, '-q:v', '3', poster,
+            ], timeout=120)
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, ValueError) as e:
+            stderr = getattr(e, 'stderr', b'') or b''
+            logger.error(f"Failed to transcode video {video_id}: {str(e)} {stderr.decode(errors='replace')[-500:]}")
+            videos.update(processing_status=Video.ProcessingStatus.FAILED)
+            return
+
+        base = os.path.splitext(source)[0]
+        with open(output, 'rb') as fh:
+            video_name = storage.save(f'{base}_web.mp4', File(fh))
+        with open(poster, 'rb') as fh:
+            poster_name = storage.save(f'property_videos/posters/{os.path.basename(base)}.jpg', File(fh))
+
+    previous_poster = video.poster.name
+    videos.update(
+        video_file=video_name, poster=poster_name, duration=duration,
+        processing_status=Video.ProcessingStatus.READY,
+    )
+    storage.delete(source)
+    if previous_poster:
+        storage.delete(previous_poster)
+    bump('properties')
+    logger.info(f"Video {video_id} transcoded ({duration:.1f}s)")
+
+@shared_task
+def assemble_video_upload(upload_id):
+    """
+    Réunit les morceaux d'un envoi complet en une ``Video``. La copie vers
+    le stockage se fait hors transaction ; seul le rattachement final
+    verrouille l'envoi.
+    """
+    from django.db import transaction
+    from django.utils.text import get_valid_filename
+    from .models import Video, VideoUpload
+    from .property.forms import MAX_VIDEOS_PER_PROPERTY
+
+    upload = VideoUpload.objects.filter(pk=upload_id, video__isnull=True).first()
+    if upload is None:
+        return
+    offset = upload.current_offset()
+    if offset < upload.total_size:
+        # Morceaux purgés du disque : le client reprendra à cette position
+        logger.warning(f"Video upload {upload_id} incomplete on disk ({offset}/{upload.total_size})")
+        VideoUpload.objects.filter(pk=upload_id).update(received=offset)
+        return
+
+    video = Video(property_id=upload.property_id)
+    with tempfile.TemporaryDirectory(prefix='apploc_upload_') as workdir:
+        local = os.path.join(workdir, 'video')
+        with open(local, 'wb') as fh:
+            upload.assemble(fh)
+        with open(local, 'rb') as fh:
+            video.video_file.save(get_valid_filename(upload.filename) or 'video', File(fh), save=False)
+
+    with transaction.atomic():
+        locked = VideoUpload.objects.select_for_update().filter(pk=upload_id, video__isnull=True).first()
+        existing_videos_count = Video.objects.filter(property_id=upload.property_id).count()
+        if locked is None or existing_videos_count >= MAX_VIDEOS_PER_PROPERTY:
+            # Tâche relivrée, envoi supprimé ou limite atteinte entre-temps
+            video.video_file.delete(save=False)
+            if locked is not None:
+                locked.soft_delete()
+        else:
+            video.order = existing_videos_count
+            video.save()
+            locked.video = video
+            locked.save(update_fields=['video', 'updated_at'])
+    upload.discard()
+    logger.info(f"Video upload {upload_id} assembled")
+
+# --- Maintenance -----------------------------------------------------------
+
+import time
+
+PENDING_USER_PURGE_BATCH_SIZE = getattr(settings, 'PENDING_USER_PURGE_BATCH_SIZE', 1000)
+
+
+@shared_task
+def purge_expired_pending_users(batch_size=PENDING_USER_PURGE_BATCH_SIZE):
+    """
+    Supprime les inscriptions en attente expirées (planifiée par Celery beat).
+    """
+    from .models import PendingUser
+
+    start = time.perf_counter()
+    deleted = PendingUser.purge_expired(batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+    logger.info(f"Purged {deleted} expired pending user(s) in {elapsed:.2f}s ({deleted / elapsed if elapsed else 0:.0f} rows/s)")
+    return deleted
@@ -1,3 +1,1459 @@
-from django.test import TestCase
+"""
+Budgets de requêtes et benchmark des vues.
 
-# Create your tests here.
+Le volume de données est piloté par ``BENCH_SCALE`` (1.0 = 50k propriétés,
+250k photos, 100k avis ; petit par défaut pour la CI), le nombre de passes
+par ``BENCH_ITERATIONS`` ; les mesures ne sont écrites en JSON que si
+``BENCH_OUTPUT`` est défini.
+
+    BENCH_SCALE=1 BENCH_OUTPUT=bench_output.json python manage.py test apploc.tests.ViewBudgetTests
+"""
+import json
+import os
+import random
+import re
+import smtplib
+import statistics
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO
+from importlib import import_module
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync
+from PIL import Image
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.messages.middleware import MessageMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.middleware.csrf import CsrfViewMiddleware
+from django.core import mail as django_mail
+from django.core.cache import cache as django_cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail import EmailMessage
+from django.core.mail.backends.locmem import EmailBackend as LocmemBackend
+from django.db import connection
+from django.template.backends.django import Template
+from django.test import AsyncRequestFactory, Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from django.utils import timezone, translation
+
+from location.celery import app as celery_app
+
+from . import cache, dispatch, facets, geo, mail, ratelimit, search
+from . import views as app_views
+from .property import views as property_views
+from .reviews import views as review_views
+from .mail import MailDispatcher
+from .models import Category, CustomUser, PendingUser, Photo, Property, Review, Video, VideoUpload, allocate_username
+from .tasks import photo_rendition_formats, send_contact_email, send_verification_email, transcode_video
+
+BENCH_SCALE = float(os.environ.get('BENCH_SCALE', '0.004'))
+BENCH_ITERATIONS = int(os.environ.get('BENCH_ITERATIONS', '5'))
+BENCH_OUTPUT = os.environ.get('BENCH_OUTPUT')  # fichier JSON des mesures, écrit seulement si défini
+
+VOLUMES = {'properties': 50_000, 'photos_per_property': 5, 'reviews': 100_000, 'owners': 500, 'tenants': 2_000}
+BATCH_SIZE = 2_000
+
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+TEST_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+# --- Données -------------------------------------------------------------
+
+def seed(scale=BENCH_SCALE, rng=None):
+    """
+    Remplit la base en masse avec ``bulk_create`` (sans signaux), puis
+    recalcule les colonnes dénormalisées et l'index de recherche.
+    """
+    rng = rng or random.Random(42)
+    now = timezone.now()
+    password = make_password('password')
+    n_owners = max(2, int(VOLUMES['owners'] * scale))
+    n_tenants = max(2, int(VOLUMES['tenants'] * scale))
+    n_properties = max(20, int(VOLUMES['properties'] * scale))
+    n_reviews = max(20, int(VOLUMES['reviews'] * scale))
+
+    users = [
+        CustomUser(username=f'owner{i}', email=f'owner{i}@example.com', password=password, role='owner', is_approved=True)
+        for i in range(n_owners)
+    ] + [
+        CustomUser(username=f'tenant{i}', email=f'tenant{i}@example.com', password=password, role='tenant', is_approved=True)
+        for i in range(n_tenants)
+    ]
+    CustomUser.objects.bulk_create(users, batch_size=BATCH_SIZE)
+    owners, tenants = users[:n_owners], users[n_owners:]
+
+    categories = Category.objects.bulk_create([
+        Category(name=name) for name in ('Appartement', 'Studio', 'Villa', 'Chambre', 'Duplex')
+    ])
+    towns = ['Yaoundé', 'Douala', 'Bafoussam', 'Garoua', 'Kribi', 'Limbé', 'Buéa', 'Bamenda']
+    properties = [
+        Property(
+            owner=rng.choice(owners),
+            category=rng.choice(categories),
+            location=f'{rng.choice(towns)} quartier {i % 300}',
+            price_per_month=Decimal(rng.randrange(30_000, 900_000, 5_000)),
+            description=f'Logement {i} meublé, proche des commodités, eau et électricité.',
+            contact_phone='699000000',
+            is_available=rng.random() < 0.8,
+            created_at=now - timedelta(minutes=i),
+        )
+        for i in range(n_properties)
+    ]
+    Property.objects.bulk_create(properties, batch_size=BATCH_SIZE)
+
+    photos = (
+        Photo(property=prop, image=f'property_photos/{prop.pk}_{order}.png', order=order)
+        for prop in properties for order in range(VOLUMES['photos_per_property'])
+    )
+    _bulk_create_iter(Photo, photos)
+    reviews = (
+        Review(
+            property=rng.choice(properties),
+            tenant=rng.choice(tenants),
+            rating=rng.randint(1, 5),
+            message=f'Avis {i} : très bon séjour, propriétaire réactif.',
+            date_posted=now - timedelta(minutes=i),
+        )
+        for i in range(n_reviews)
+    )
+    _bulk_create_iter(Review, reviews)
+
+    Property.refresh_cover_photos(Property.all_objects.values('pk'))
+    Property.refresh_review_stats(Property.all_objects.values('pk'))
+    geo.geocode_properties(Property.all_objects.all())
+    search.rebuild()
+    PendingUser.objects.bulk_create([PendingUser(
+        username='pending', email='pending@example.com', phone='699000000', password='password',
+        verification_code='1234', expires_at=now + timedelta(minutes=10),
+    )])
+    admin = CustomUser.objects.create_superuser('admin', 'admin@example.com', 'password')
+    return {'owner': owners[0], 'tenant': tenants[0], 'admin': admin, 'property': properties[0]}
+
+
+def _bulk_create_iter(model, objects):
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) >= BATCH_SIZE:
+            model.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_create(batch)
+
+
+# --- Mesures -------------------------------------------------------------
+
+class RequestProfile:
+    """
+    Compte les requêtes SQL et le temps passé en base et en rendu de
+    template pendant un appel au client de test.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+
+    def _execute(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - start
+
+    def profile(self, func, *args, **kwargs):
+        original_render = Template.render
+
+        def timed_render(template, *render_args, **render_kwargs):
+            start = time.perf_counter()
+            try:
+                return original_render(template, *render_args, **render_kwargs)
+            finally:
+                self.render_time += time.perf_counter() - start
+
+        with connection.execute_wrapper(self._execute), mock.patch.object(Template, 'render', timed_render):
+            start = time.perf_counter()
+            response = func(*args, **kwargs)
+            self.total_time = time.perf_counter() - start
+        return response
+
+
+def eager_tasks(testcase, eager):
+    """
+    Exécute (ou non) les tâches Celery en ligne le temps du test. Avec
+    ``namespace='CELERY'``, la clé effective est ``CELERY_TASK_ALWAYS_EAGER`` :
+    ``task_always_eager`` la lit mais ne la remplace pas.
+    """
+    previous = celery_app.conf.CELERY_TASK_ALWAYS_EAGER
+    celery_app.conf.CELERY_TASK_ALWAYS_EAGER = eager
+    testcase.addCleanup(setattr, celery_app.conf, 'CELERY_TASK_ALWAYS_EAGER', previous)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+# --- Budgets -------------------------------------------------------------
+
+# (nom d'URL, rôle connecté, budget de requêtes à cache chaud, budget à cache
+# froid). Les sessions et l'utilisateur connecté comptent chacun pour une
+# requête ; à froid, la session est relue en base et les fragments en cache
+# (accueil, détail, facettes) sont reconstruits.
+VIEW_BUDGETS = [
+    ('home', None, 0, 2),
+    ('about', None, 0, 0),
+    ('contact', None, 0, 0),
+    ('set_language', None, 0, 0),
+    ('perf_stats', 'admin', 2, 2),
+    ('all_properties', None, 1, 3),
+    ('property_detail', None, 0, 4),
+    ('property_create', 'owner', 3, 3),
+    ('property_update', 'owner', 6, 6),
+    ('property_delete', 'owner', 4, 4),
+    ('video_upload_start', 'owner', 2, 2),
+    ('video_upload_chunk', 'owner', 3, 3),
+    ('all_reviews', None, 1, 2),
+    ('review_list', 'tenant', 2, 3),
+    ('review_create', 'tenant', 5, 5),
+    ('review_update', 'tenant', 6, 6),
+    ('review_delete', 'tenant', 3, 3),
+    ('signup', None, 0, 0),
+    ('verify_email', None, 1, 1),
+    ('login', None, 0, 0),
+    ('logout', 'tenant', 4, 4),
+    ('password_reset_request', None, 0, 0),
+    ('password_reset_verify', None, 1, 1),
+    ('owner_dashboard', 'owner', 4, 4),
+    ('tenant_dashboard', 'tenant', 4, 4),
+    ('dashboard_redirect', 'tenant', 2, 2),
+    ('api_properties', None, 1, 1),
+    ('api_property_photos', None, 1, 1),
+    ('api_reviews', None, 1, 1),
+]
+
+URLCONFS = ('apploc.urls', 'apploc.property.urls', 'apploc.reviews.urls', 'apploc.authentication.urls', 'apploc.api.urls')
+
+
+def url_names():
+    names = set()
+    for urlconf in URLCONFS:
+        for pattern in import_module(urlconf).urlpatterns:
+            if isinstance(pattern, URLPattern) and pattern.name:
+                names.add(pattern.name)
+    return names
+
+
+@override_settings(STORAGES=TEST_STORAGES, CACHES=TEST_CACHES, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ViewBudgetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        start = time.perf_counter()
+        cls.fixtures_data = seed()
+        cls.seed_time = time.perf_counter() - start
+        owner, tenant = cls.fixtures_data['owner'], cls.fixtures_data['tenant']
+        cls.fixtures_data['owner_property'] = Property.objects.filter(owner=owner).first()
+        cls.fixtures_data['tenant_review'] = Review.objects.filter(tenant=tenant).first() or Review.objects.create(
+            property=cls.fixtures_data['property'], tenant=tenant, message='Avis de test pour le benchmark.'
+        )
+        cls.fixtures_data['video_upload'] = VideoUpload.objects.create(
+            property=cls.fixtures_data['owner_property'], owner=owner,
+            filename='visite.mp4', content_type='video/mp4', total_size=1024,
+        )
+
+    def url_for(self, name):
+        data = self.fixtures_data
+        kwargs = {
+            'property_detail': {'property_id': data['property'].pk},
+            'api_property_photos': {'property_id': data['property'].pk},
+            'property_update': {'property_id': data['owner_property'].pk},
+            'property_delete': {'property_id': data['owner_property'].pk},
+            'video_upload_start': {'property_id': data['owner_property'].pk},
+            'video_upload_chunk': {'upload_id': data['video_upload'].pk},
+            'review_create': {'property_id': data['property'].pk},
+            'review_update': {'review_id': data['tenant_review'].pk},
+            'review_delete': {'review_id': data['tenant_review'].pk},
+            'verify_email': {'email': 'pending@example.com'},
+            'password_reset_verify': {'email': 'pending@example.com'},
+        }.get(name, {})
+        with translation.override('en'):
+            return reverse(name, kwargs=kwargs)
+
+    def client_for(self, role):
+        client = Client()
+        if role:
+            client.force_login(self.fixtures_data[role])
+        return client
+
+    def test_every_view_has_a_budget(self):
+        self.assertEqual(url_names(), {name for name, _role, _budget, _cold in VIEW_BUDGETS})
+
+    def test_views_within_query_budget(self):
+        results = {}
+        for name, role, budget, cold_budget in VIEW_BUDGETS:
+            with self.subTest(view=name):
+                client = self.client_for(role)
+                url = self.url_for(name)
+                # Cache froid : les constructeurs de fragments tournent (N+1 compris)
+                django_cache.clear()
+                cold = RequestProfile()
+                cold.profile(client.get, url)
+                if role:
+                    client.force_login(self.fixtures_data[role])
+                client.get(url)  # échauffement (caches, traductions)
+                profiles = []
+                for _ in range(BENCH_ITERATIONS):
+                    profile = RequestProfile()
+                    response = profile.profile(client.get, url)
+                    profiles.append(profile)
+                    if role:  # logout et consorts invalident la session
+                        client.force_login(self.fixtures_data[role])
+                self.assertLess(response.status_code, 500)
+                latencies = [p.total_time * 1000 for p in profiles]
+                results[name] = {
+                    'url': url,
+                    'status': response.status_code,
+                    'queries': profiles[-1].queries,
+                    'budget': budget,
+                    'cold_queries': cold.queries,
+                    'cold_budget': cold_budget,
+                    'db_ms': statistics.mean(p.db_time * 1000 for p in profiles),
+                    'render_ms': statistics.mean(p.render_time * 1000 for p in profiles),
+                    'p50_ms': percentile(latencies, 50),
+                    'p95_ms': percentile(latencies, 95),
+                }
+                self.assertLessEqual(
+                    profiles[-1].queries, budget,
+                    f'{name} : {profiles[-1].queries} requêtes pour un budget de {budget}',
+                )
+                self.assertLessEqual(
+                    cold.queries, cold_budget,
+                    f'{name} : {cold.queries} requêtes à froid pour un budget de {cold_budget}',
+                )
+        if BENCH_OUTPUT:
+            self.write_results(results)
+
+    def write_results(self, results):
+        payload = {
+            'timestamp': timezone.now().isoformat(),
+            'vendor': connection.vendor,
+            'scale': BENCH_SCALE,
+            'iterations': BENCH_ITERATIONS,
+            'seed_s': self.seed_time,
+            'rows': {
+                'properties': Property.all_objects.count(),
+                'photos': Photo.all_objects.count(),
+                'reviews': Review.all_objects.count(),
+            },
+            'views': results,
+        }
+        with open(BENCH_OUTPUT, 'w') as fh:
+            json.dump(payload, fh, indent=2)
+
+
+@override_settings(STORAGES=TEST_STORAGES, CACHES=TEST_CACHES)
+class PerformanceMiddlewareTests(TestCase):
+    def test_server_timing_and_histogram(self):
+        from .middleware import histogram
+
+        histogram.clear()
+        response = self.client.get('/en/rev/properties/all/')
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('total;dur=', response['Server-Timing'])
+        self.assertEqual(histogram.snapshot()['all_properties']['count'], 1)
+
+
+@override_settings(STORAGES=TEST_STORAGES, CACHES=TEST_CACHES)
+class HomeCacheTests(TestCase):
+    def test_home_fragments_invalidated_by_signals(self):
+        owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'password', role='owner')
+        self.client.get('/en/')
+        with self.captureOnCommitCallbacks(execute=True):
+            prop = Property.objects.create(
+                owner=owner, location='Kribi plage', price_per_month=100_000,
+                description='Villa face à la mer', contact_phone='699000000',
+            )
+        response = self.client.get('/en/')
+        self.assertContains(response, 'Villa face à la mer')
+        with self.assertNumQueries(0):
+            self.client.get('/en/')
+        self.assertContains(response, '<section class="mb-16">', html=False)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            prop.soft_delete()
+        self.assertNotContains(self.client.get('/en/'), 'Villa face à la mer')
+
+    def test_home_lists_every_available_property(self):
+        django_cache.clear()
+        owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'password', role='owner')
+        Property.objects.bulk_create([
+            Property(
+                owner=owner, location=f'Limbé {i}', price_per_month=100_000,
+                description=f'Maison numéro {i}', contact_phone='699000000', is_available=i != 0,
+            )
+            for i in range(12)
+        ])
+        response = self.client.get('/en/')
+        for i in range(1, 12):
+            self.assertContains(response, f'Maison numéro {i}')
+        self.assertNotContains(response, 'Maison numéro 0')
+
+    def test_reviews_fragment_varies_by_session_user_type(self):
+        django_cache.clear()
+        tenant = CustomUser.objects.create_user('tenant', 'tenant@example.com', 'password', role='tenant')
+        owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'password', role='owner')
+        self.client.force_login(tenant)
+        session = self.client.session
+        session['user_type'] = 'tenant'
+        session.save()
+        self.assertContains(self.client.get('/en/'), 'Add a Review')
+
+        other = Client()
+        other.force_login(owner)
+        response = other.get('/en/')
+        self.assertContains(response, 'Sign Up as Tenant')
+        self.assertNotContains(response, 'Add a Review')
+
+    def test_lost_generation_counter_never_revalidates_old_entries(self):
+        django_cache.clear()
+        self.assertEqual(cache.get_or_build('fragment', lambda: 'v1', groups=('g',)), 'v1')
+        # Éviction du compteur seul (cull LocMem, flush partiel) : l'ancienne entrée reste
+        django_cache.delete(cache._generation_key('g'))
+        self.assertEqual(cache.get_or_build('fragment', lambda: 'v2', groups=('g',)), 'v2')
+        with self.captureOnCommitCallbacks(execute=True):
+            cache.bump('g')
+        self.assertEqual(cache.get_or_build('fragment', lambda: 'v3', groups=('g',)), 'v3')
+
+
+@override_settings(STORAGES=TEST_STORAGES, CACHES=TEST_CACHES)
+class PhotoRenditionTests(TestCase):
+    def setUp(self):
+        owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'password', role='owner')
+        self.property = Property.objects.create(
+            owner=owner, location='Yaoundé Bastos', price_per_month=200_000,
+            description='Villa avec jardin', contact_phone='699000000',
+        )
+        eager_tasks(self, True)
+
+    def jpeg(self, name, size, orientation=None):
+        image = Image.new('RGB', size, 'orange')
+        exif = image.getexif()
+        if orientation:
+            exif[0x0112] = orientation
+        exif[0x010F] = 'Appareil'  # Make
+        buffer = BytesIO()
+        image.save(buffer, format='JPEG', exif=exif)
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+    def create_photo(self, upload):
+        with self.captureOnCommitCallbacks(execute=True):
+            photo = Photo.objects.create(property=self.property, image=upload)
+        photo.refresh_from_db()
+        return photo
+
+    def test_widths_capped_at_original_and_metadata_stripped(self):
+        # 400x800 pivotée de 90° par EXIF : affichée en 800x400
+        photo = self.create_photo(self.jpeg('salon.jpg', (400, 800), orientation=6))
+        formats = photo_rendition_formats()
+        self.assertIn('webp', formats)
+        self.assertEqual(photo.renditions['source'], photo.image.name)
+        for fmt in formats:
+            self.assertEqual(list(photo.renditions[fmt]), ['320', '640', '800'])
+            with photo.image.storage.open(photo.renditions[fmt]['320']) as fh, Image.open(fh) as rendition:
+                self.assertEqual(rendition.format, fmt.upper())
+                self.assertEqual(rendition.size, (320, 160))
+                self.assertFalse(dict(rendition.getexif()))
+
+    def test_srcset_sorted_by_width_and_hidden_while_stale(self):
+        photo = self.create_photo(self.jpeg('chambre.jpg', (1200, 600)))
+        storage = photo.image.storage
+        widths = [int(entry.rsplit(' ', 1)[1][:-1]) for entry in photo.webp_srcset().split(', ')]
+        self.assertEqual(widths, [320, 640, 1024, 1200])
+        self.assertIn(storage.url(photo.renditions['webp']['320']), photo.webp_srcset())
+        if 'avif' in photo_rendition_formats():
+            self.assertTrue(photo.avif_srcset())
+
+        old = photo.renditions['webp']['320']
+        photo.image = self.jpeg('cuisine.jpg', (500, 250))
+        self.assertEqual(photo.webp_srcset(), '')  # pas de déclinaisons de l'ancienne image
+        with self.captureOnCommitCallbacks(execute=True):
+            photo.save()
+        photo.refresh_from_db()
+        self.assertEqual(list(photo.renditions['webp']), ['320', '500'])
+        self.assertFalse(storage.exists(old))
+
+
+@override_settings(STORAGES=TEST_STORAGES, CACHES=TEST_CACHES)
+class VideoUploadTests(TestCase):
+    def setUp(self):
+        self.owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'password', role='owner', is_approved=True)
+        self.property = Property.objects.create(
+            owner=self.owner, location='Douala Bonapriso', price_per_month=150_000,
+            description='Appartement meublé', contact_phone='699000000',
+        )
+        self.client.force_login(self.owner)
+        self.payload = os.urandom(25_000)
+        eager_tasks(self, True)
+
+    def start(self):
+        with translation.override('en'):
+            url = reverse('video_upload_start', args=[self.property.pk])
+        response = self.client.post(url, json.dumps({
+            'filename': 'visite.mp4', 'size': len(self.payload), 'content_type': 'video/mp4',
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def put(self, url, offset, data):
+        return self.client.put(url, data, content_type='application/octet-stream', headers={'Upload-Offset': str(offset)})
+
+    def test_resumable_chunked_upload(self):
+        state = self.start()
+        url = state['url']
+        self.assertEqual(self.put(url, 0, self.payload[:10_000]).json()['offset'], 10_000)
+
+        # Position obsolète : le serveur indique où reprendre
+        response = self.put(url, 0, self.payload[:10_000])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], 10_000)
+        self.assertEqual(self.client.get(url).json()['offset'], 10_000)
+
+        # Le dernier morceau est accepté tout de suite ; l'assemblage passe par la file media
+        with mock.patch('apploc.tasks.shutil.which', return_value=None), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.put(url, 10_000, self.payload[10_000:])
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(response.json()['complete'])
+
+        video = Video.objects.get(property=self.property)
+        self.assertEqual(video.video_file.read(), self.payload)
+        self.assertEqual(video.processing_status, Video.ProcessingStatus.SKIPPED)
+        self.assertEqual(self.client.get(url).json()['video_id'], str(video.pk))
+        self.assertEqual(os.listdir(VideoUpload.objects.get().upload_dir()), [])
+
+    def test_chunk_is_received_outside_the_transaction(self):
+        url = self.start()['url']
+        depth = len(connection.atomic_blocks)
+        receive = VideoUpload.receive
+        calls = []
+
+        def racing_receive(instance, stream, length):
+            calls.append(len(connection.atomic_blocks))
+            if len(calls) == 1:
+                # Le même morceau arrive par une autre requête pendant la lecture du corps
+                self.assertEqual(self.put(url, 0, self.payload[:10_000]).status_code, 200)
+            return receive(instance, stream, length)
+
+        with mock.patch.object(VideoUpload, 'receive', racing_receive):
+            response = self.put(url, 0, self.payload[:10_000])
+        self.assertEqual(calls, [depth, depth])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], 10_000)
+        self.assertEqual(os.listdir(VideoUpload.objects.get().upload_dir()), ['000000000000.part'])
+
+    def test_rejects_oversized_chunk(self):
+        state = self.start()
+        response = self.put(state['url'], 0, self.payload + b'x')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(VideoUpload.objects.get().received, 0)
+
+
+# --- Emails ----------------------------------------------------------------
+
+
+class FlakyBackend(LocmemBackend):
+    """
+    Backend locmem qui compte les connexions et refuse certains
+    destinataires : 4xx une fois pour ``flaky@``, 5xx toujours pour ``bounce@``.
+    """
+    opened = 0
+    refused = set()
+
+    def open(self):
+        FlakyBackend.opened += 1
+        return True
+
+    def send_messages(self, messages):
+        for message in messages:
+            recipient = message.recipients()[0]
+            if recipient.startswith('bounce@'):
+                raise smtplib.SMTPRecipientsRefused({recipient: (550, b'No such user')})
+            if recipient.startswith('flaky@') and recipient not in FlakyBackend.refused:
+                FlakyBackend.refused.add(recipient)
+                raise smtplib.SMTPRecipientsRefused({recipient: (451, b'Try again later')})
+        return super().send_messages(messages)
+
+
+class MailDispatcherTests(TestCase):
+    def setUp(self):
+        FlakyBackend.opened = 0
+        FlakyBackend.refused = set()
+        self.now = 0.0
+        self.dispatcher = MailDispatcher(
+            backend='apploc.tests.FlakyBackend', batch_size=3, backoff_base=2.0, clock=lambda: self.now,
+        )
+
+    def message(self, *to):
+        return EmailMessage('Code', 'Votre code est 1234', 'noreply@example.com', list(to))
+
+    def test_batches_share_one_connection(self):
+        for i in range(5):
+            self.dispatcher.send(self.message(f'user{i}@example.com'), background=False)
+        self.assertEqual(self.dispatcher.flush(), 5)
+        self.assertEqual(len(django_mail.outbox), 5)
+        self.assertEqual(FlakyBackend.opened, 1)
+
+    def test_per_recipient_retry_with_backoff(self):
+        self.dispatcher.send(self.message('ok@example.com', 'flaky@example.com', 'bounce@example.com'), background=False)
+        self.assertEqual(self.dispatcher.flush(), 1)
+        self.assertEqual([m.to for m in django_mail.outbox], [['ok@example.com']])
+        self.assertEqual([r for r, _s, _e in self.dispatcher.dead_letters], ['bounce@example.com'])
+
+        # 4xx : nouvelle tentative après le délai, pour ce seul destinataire
+        self.assertEqual(self.dispatcher.pending(), 1)
+        self.now = 1.0
+        self.assertEqual(self.dispatcher.flush(), 0)
+        self.now = 2.0
+        self.assertEqual(self.dispatcher.flush(), 1)
+        self.assertEqual(django_mail.outbox[-1].to, ['flaky@example.com'])
+        self.assertEqual(self.dispatcher.pending(), 0)
+
+    def test_refused_recipient_keeps_connection(self):
+        for to in ('bounce@example.com', 'flaky@example.com', 'ok@example.com'):
+            self.dispatcher.send(self.message(to), background=False)
+        self.assertEqual(self.dispatcher.flush(), 1)
+        self.assertEqual(FlakyBackend.opened, 1)
+
+    def test_deliver_sends_before_returning(self):
+        with mock.patch.object(self.dispatcher, '_ensure_thread'):
+            deferred = self.dispatcher.deliver(self.message('ok@example.com', 'flaky@example.com', 'bounce@example.com'))
+        self.assertEqual(deferred, ['flaky@example.com'])
+        self.assertEqual([m.to for m in django_mail.outbox], [['ok@example.com']])
+        self.assertEqual([r for r, _s, _e in self.dispatcher.dead_letters], ['bounce@example.com'])
+        self.assertEqual(self.dispatcher.pending(), 0)
+        self.assertEqual(FlakyBackend.opened, 1)
+
+    def test_worker_task_defers_for_celery_retry(self):
+        task = mock.Mock()
+        task.request.is_eager = False
+        with mock.patch('apploc.mail.dispatcher', self.dispatcher), \
+                mock.patch.object(self.dispatcher, '_ensure_thread'):
+            with self.assertRaises(mail.MailDeferred):
+                mail.send(self.message('flaky@example.com'), task=task)
+            # La nouvelle tentative de Celery renvoie le message
+            mail.send(self.message('flaky@example.com'), task=task)
+        self.assertEqual([m.to for m in django_mail.outbox], [['flaky@example.com']])
+        self.assertEqual(self.dispatcher.pending(), 0)
+
+
+class DispatchTests(TestCase):
+    def setUp(self):
+        eager_tasks(self, False)
+        self.addCleanup(setattr, dispatch, '_broker_down_until', 0.0)
+
+    def test_routes(self):
+        self.assertEqual(dispatch.queue_for(send_verification_email), 'otp')
+        self.assertEqual(dispatch.queue_for(send_contact_email), 'mail')
+        self.assertEqual(dispatch.queue_for(transcode_video), 'media')
+
+    def test_falls_back_to_local_pool_without_broker(self):
+        from kombu.exceptions import OperationalError
+
+        with mock.patch.object(send_verification_email, 'apply_async', side_effect=OperationalError('down')) as apply_async, \
+                mock.patch('apploc.mail.dispatcher.send') as send:
+            dispatch.enqueue(send_verification_email, 'a@example.com', 'Code 1234').result(timeout=5)
+            dispatch.enqueue(send_verification_email, 'b@example.com', 'Code 5678').result(timeout=5)
+        # Le broker n'est plus sollicité une fois déclaré injoignable
+        self.assertEqual(apply_async.call_count, 1)
+        self.assertEqual([c.args[0].to for c in send.call_args_list], [['a@example.com'], ['b@example.com']])
+
+
+@override_settings(CACHES=TEST_CACHES, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class OtpDispatchTests(TestCase):
+    def signup(self):
+        with translation.override('en'):
+            url = reverse('signup')
+        return self.client.post(url, {
+            'email': 'nouveau@example.com', 'user_type': 'tenant', 'phone': '699000000', 'location': 'Douala',
+            'password1': 'Un-mot-de-passe-solide', 'password2': 'Un-mot-de-passe-solide',
+        })
+
+    def test_one_email_per_code(self):
+        with mock.patch('apploc.otp.enqueue') as enqueue, self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.signup().status_code, 302)
+        pending = PendingUser.objects.get(email='nouveau@example.com')
+        self.assertEqual(enqueue.call_count, 1)
+        self.assertIn(pending.verification_code, enqueue.call_args.args[2])
+
+        # Sauvegarde sans nouveau code : pas de second envoi
+        with mock.patch('apploc.otp.enqueue') as enqueue, self.captureOnCommitCallbacks(execute=True):
+            pending.save()
+        enqueue.assert_not_called()
+
+    def test_resend_uses_the_new_code(self):
+        with mock.patch('apploc.otp.enqueue'), self.captureOnCommitCallbacks(execute=True):
+            self.signup()
+        PendingUser.objects.update(updated_at=timezone.now() - timedelta(minutes=5))
+        with mock.patch('apploc.otp.enqueue') as enqueue, self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.signup().status_code, 302)
+        pending = PendingUser.objects.get(email='nouveau@example.com')
+        self.assertEqual(enqueue.call_count, 1)
+        self.assertIn(pending.verification_code, enqueue.call_args.args[2])
+
+
+
+class PendingUserPurgeTests(TestCase):
+    def test_purges_expired_rows_in_batches(self):
+        now = timezone.now()
+        PendingUser.objects.bulk_create([
+            PendingUser(
+                username=f'pending{i}', email=f'pending{i}@example.com', phone='699000000', password='x',
+                verification_code='1234', expires_at=now + timedelta(minutes=-30 + i * 5),
+            )
+            for i in range(10)
+        ])
+        # 6 expirées (-30 à -5 min), supprimées en 3 lots de 2 + un lot vide
+        with self.assertNumQueries(7):
+            self.assertEqual(PendingUser.purge_expired(batch_size=2, now=now), 6)
+        self.assertEqual(PendingUser.objects.count(), 4)
+        self.assertFalse(PendingUser.objects.filter(expires_at__lt=now).exists())
+
+
+
+@override_settings(CACHES=TEST_CACHES, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class UsernameAllocationTests(TestCase):
+    def test_allocates_first_free_suffix_in_one_query(self):
+        for username in ('contact', 'contact1', 'contact3', 'contacts', 'contactez'):
+            CustomUser.objects.create_user(username, f'{username}@example.com', 'password')
+        PendingUser.objects.bulk_create([PendingUser(
+            username='contact2', email='contact2@example.com', phone='699000000', password='x',
+            verification_code='1234', expires_at=timezone.now(),
+        )])
+        with self.assertNumQueries(1):
+            self.assertEqual(allocate_username('contact'), 'contact4')
+        self.assertEqual(allocate_username('info'), 'info')
+
+    def test_email_change_tracked_without_extra_query(self):
+        CustomUser.objects.create_user('contact', 'contact@example.com', 'password')
+        user = CustomUser.objects.create_user('', 'contact.pro@example.com', 'password')
+        self.assertEqual(user.username, 'contactpro')
+        user = CustomUser.objects.get(pk=user.pk)
+
+        user.phone = '699000000'
+        with self.assertNumQueries(1):  # UPDATE seul
+            user.save()
+        self.assertEqual(user.saved_changes, {'phone'})
+
+        user.email = 'Contact@Example.org'
+        with self.assertNumQueries(2):  # allocation du username + UPDATE
+            user.save()
+        self.assertEqual(user.username, 'contact1')
+        self.assertEqual(user.email, 'contact@example.org')
+
+
+@override_settings(
+    CACHES=TEST_CACHES, PASSWORD_PBKDF2_ITERATIONS=1000,
+    PASSWORD_HASHERS=['apploc.authentication.hashers.TunablePBKDF2PasswordHasher', 'django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class EmailLoginTests(TestCase):
+    def login(self):
+        with translation.override('en'):
+            url = reverse('login')
+        return self.client.post(url, {'email': 'Tenant@Example.com', 'password': 'password'})
+
+    def test_single_user_lookup_and_hash_upgrade(self):
+        with override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher']):
+            user = CustomUser.objects.create_user('tenant', 'tenant@example.com', 'password', is_approved=True)
+        self.assertTrue(user.password.startswith('md5$'))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertRedirects(self.login(), reverse('tenant_dashboard'), fetch_redirect_response=False)
+        user_selects = [q for q in queries if q['sql'].startswith('SELECT') and 'apploc_customuser' in q['sql']]
+        self.assertEqual(len(user_selects), 1)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$1000$'))
+
+        # Coût modifié : le hash est réécrit à la connexion suivante
+        self.client.logout()
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=2000):
+            self.login()
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$2000$'))
+
+
+
+@override_settings(CACHES=TEST_CACHES, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class SoftDeleteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'password', role='owner')
+        cls.tenant = CustomUser.objects.create_user('tenant', 'tenant@example.com', 'password')
+
+    def create(self, count):
+        properties = Property.objects.bulk_create([
+            Property(
+                owner=self.owner, location='Douala', price_per_month=Decimal('50000'),
+                description=f'Bien {i}', contact_phone='699000000',
+            )
+            for i in range(count)
+        ])
+        # bulk_create : ni rendus de photos ni transcodage
+        Photo.objects.bulk_create([Photo(property=prop, image=f'{prop.pk}_{i}.png', order=i) for prop in properties for i in range(2)])
+        Video.objects.bulk_create([Video(property=prop, video_file=f'{prop.pk}.mp4') for prop in properties])
+        Review.objects.bulk_create([Review(property=prop, tenant=self.tenant, message='Bien') for prop in properties])
+        Property.refresh_review_stats([prop.pk for prop in properties])
+        return properties
+
+    def test_bulk_soft_delete_cascades_to_children(self):
+        doomed, kept = self.create(2)
+        earlier = timezone.now() - timedelta(days=1)
+        old_photo = Photo.objects.filter(property=doomed).first()
+        Photo.objects.filter(pk=old_photo.pk).soft_delete(earlier)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(Property.objects.filter(pk=doomed.pk).soft_delete(), 1)
+        deleted_at = Property.all_objects.get(pk=doomed.pk).deleted_at
+        self.assertIsNotNone(deleted_at)
+        for model in (Photo, Video, Review):
+            self.assertFalse(model.objects.filter(property=doomed).exists())
+            self.assertEqual(model.objects.filter(property=kept).count(), model.all_objects.filter(property=kept).count())
+        self.assertEqual(
+            set(Video.all_objects.filter(property=doomed).values_list('deleted_at', flat=True))
+            | set(Review.all_objects.filter(property=doomed).values_list('deleted_at', flat=True)),
+            {deleted_at},
+        )
+        # Un enfant déjà supprimé garde sa date de suppression
+        self.assertEqual(Photo.all_objects.get(pk=old_photo.pk).deleted_at, earlier)
+        self.assertEqual(Photo.all_objects.filter(property=doomed, deleted_at=deleted_at).count(), 1)
+
+    def test_cover_photo_follows_hard_and_soft_deletes(self):
+        prop = self.create(1)[0]
+        Property.refresh_cover_photos([prop.pk])
+        first, second = Photo.objects.filter(property=prop).order_by('order')
+
+        def cover():
+            return Property.all_objects.values_list('cover_photo', flat=True).get(pk=prop.pk)
+
+        self.assertEqual(cover(), first.pk)
+        Photo.all_objects.filter(pk=first.pk).delete()  # suppression définitive (admin)
+        self.assertEqual(cover(), second.pk)
+        second.soft_delete()
+        self.assertIsNone(cover())
+
+    def test_query_count_does_not_grow_with_rows(self):
+        def queries(count):
+            properties = self.create(count)
+            with CaptureQueriesContext(connection) as captured:
+                Property.objects.filter(pk__in=[prop.pk for prop in properties]).soft_delete()
+            return len(captured)
+
+        self.assertEqual(queries(1), queries(5))
+
+
+@override_settings(CACHES=TEST_CACHES, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ReviewStatsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'password', role='owner')
+        cls.tenant = CustomUser.objects.create_user('tenant', 'tenant@example.com', 'password')
+        category = Category.objects.create(name='Studio')
+        cls.first, cls.second = Property.objects.bulk_create([
+            Property(
+                owner=owner, category=category, location='Douala', price_per_month=Decimal('50000'),
+                description=f'Bien {i}', contact_phone='699000000',
+            )
+            for i in range(2)
+        ])
+
+    def stats(self, prop):
+        prop.refresh_from_db(fields=['review_count', 'rating_sum', 'rating_avg'])
+        return prop.review_count, prop.rating_sum, prop.rating_avg
+
+    def test_stats_follow_review_changes(self):
+        review = Review.objects.create(property=self.first, tenant=self.tenant, rating=4, message='Bien')
+        Review.objects.create(property=self.first, tenant=self.tenant, rating=2, message='Moyen')
+        self.assertEqual(self.stats(self.first), (2, 6, 3.0))
+
+        review = Review.objects.get(pk=review.pk)
+        review.rating = 5
+        review.message = 'Très bien'
+        with self.assertNumQueries(1):  # note non sauvegardée : ni recalcul ni delta
+            review.save(update_fields=['message'])
+        self.assertEqual(self.stats(self.first), (2, 6, 3.0))
+        with self.assertNumQueries(2):  # UPDATE de l'avis + delta F() sur la propriété
+            review.save()
+        self.assertEqual(self.stats(self.first), (2, 7, 3.5))
+
+        review.property = self.second
+        review.save()
+        self.assertEqual(self.stats(self.first), (1, 2, 2.0))
+        self.assertEqual(self.stats(self.second), (1, 5, 5.0))
+
+        review.soft_delete()
+        review.save()  # déjà supprimé : pas de double décompte
+        self.assertEqual(self.stats(self.second), (0, 0, 0.0))
+
+        Review.objects.filter(property=self.first).delete()
+        self.assertEqual(self.stats(self.first), (0, 0, 0.0))
+
+        Review.objects.create(property=self.first, tenant=self.tenant, rating=3, message='Correct')
+        Review.all_objects.update(rating=1)  # mise à jour en masse : recalcul explicite
+        Property.refresh_review_stats([self.first.pk, self.second.pk])
+        self.assertEqual(self.stats(self.first), (1, 1, 1.0))
+
+    def test_review_total_cached_until_change(self):
+        django_cache.clear()
+        with translation.override('en'):
+            url = reverse('all_reviews')
+        self.client.get(url)
+        with self.assertNumQueries(1):  # la page d'avis seule, sans COUNT(*)
+            response = self.client.get(url)
+        self.assertEqual(response.context['total_reviews'], Review.objects.count())
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(property=self.first, tenant=self.tenant, rating=4, message='Encore')
+        self.assertEqual(self.client.get(url).context['total_reviews'], Review.objects.count())
+
+    def test_sort_and_filter_by_rating(self):
+        Review.objects.create(property=self.first, tenant=self.tenant, rating=2, message='Moyen')
+        Review.objects.create(property=self.second, tenant=self.tenant, rating=5, message='Parfait')
+        with translation.override('en'):
+            url = reverse('all_properties')
+        response = self.client.get(url, {'sort': 'rating'})
+        self.assertEqual([p.pk for p in response.context['properties']], [self.second.pk, self.first.pk])
+        response = self.client.get(url, {'min_rating': '4'})
+        self.assertEqual([p.pk for p in response.context['properties']], [self.second.pk])
+
+
+@override_settings(CACHES=TEST_CACHES, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'password', role='owner')
+        villa = Category.objects.create(name='Villa')
+        cls.in_location, cls.in_category, cls.in_description, cls.unrelated = Property.objects.bulk_create([
+            Property(owner=owner, location='Bastos, Yaoundé', description='Duplex lumineux', **cls.defaults()),
+            Property(owner=owner, category=villa, location='Odza', description='Jardin arboré', **cls.defaults()),
+            Property(owner=owner, location='Mvog-Mbi', description='Studio à deux pas de Bastos', **cls.defaults()),
+            Property(owner=owner, location='Kribi', description='Bord de mer', **cls.defaults()),
+        ])
+        # Corpus assez grand pour que le terme recherché ait un IDF positif (bm25)
+        Property.objects.bulk_create([
+            Property(owner=owner, location=f'Douala {i}', description='Appartement', **cls.defaults()) for i in range(6)
+        ])
+        search.rebuild()
+
+    @staticmethod
+    def defaults():
+        return {'price_per_month': Decimal(100000), 'contact_phone': '699000000'}
+
+    def search(self, text, queryset=None):
+        results = search.search_properties(Property.objects.all() if queryset is None else queryset, text)
+        return list(results.order_by('-search_rank').values_list('pk', flat=True))
+
+    def test_location_ranks_above_description(self):
+        self.assertEqual(self.search('bastos'), [self.in_location.pk, self.in_description.pk])
+        self.assertEqual(self.search('villa'), [self.in_category.pk])
+
+    def test_rank_resolves_aliased_tables(self):
+        # Dans une sous-requête, la table des propriétés est renommée (U0) : le score suit l'alias
+        ranks = sorted(search.search_properties(Property.objects.all(), 'bastos').values_list('search_rank', flat=True))
+        ranked = search.search_properties(Property.objects.all(), 'bastos').filter(search_rank__gt=sum(ranks) / 2)
+        photos = Photo.objects.bulk_create([Photo(property=prop, image=f'{prop.pk}.png') for prop in (self.in_location, self.in_description)])
+        self.assertEqual(list(Photo.objects.filter(property__in=ranked.values('pk'))), [photos[0]])
+
+    @skipUnless(connection.vendor == 'sqlite', 'branche FTS5')
+    def test_fts_results_materialized_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.search('bastos')
+        self.assertEqual(len(queries), 1)
+        self.assertIn('MATERIALIZED', queries[0]['sql'])
+
+    def test_accents_case_and_prefixes(self):
+        self.assertEqual(self.search('YAOUNDE'), [self.in_location.pk])
+        self.assertEqual(self.search('yaound'), [self.in_location.pk])
+        self.assertEqual(self.search('arbore'), [self.in_category.pk])
+        self.assertEqual(self.search('Arboré jardin'), [self.in_category.pk])
+        self.assertEqual(self.search('bastos kribi'), [])
+
+    def test_index_follows_saves_category_renames_and_soft_deletes(self):
+        prop = Property.objects.get(pk=self.unrelated.pk)
+        prop.location = 'Limbé'
+        prop.save()
+        self.assertEqual(self.search('limbe'), [prop.pk])
+        self.assertEqual(self.search('kribi'), [])
+
+        category = Category.objects.get(name='Villa')
+        category.name = 'Manoir'
+        category.save()
+        self.assertEqual(self.search('manoir'), [self.in_category.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Property.objects.filter(pk=self.in_location.pk).soft_delete()
+        # Même sans le filtre du manager, l'entrée d'index a disparu
+        self.assertEqual(self.search('bastos', Property.all_objects.all()), [self.in_description.pk])
+
+    def test_postgres_query_uses_unaccented_terms_and_trigram_fallback(self):
+        from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+
+        queryset = search.search_properties(Property.objects.all(), 'Yaoundé  BASTOS', connection=mock.Mock(vendor='postgresql'))
+        rank = queryset.query.annotations['search_rank']
+        self.assertIsInstance(rank.lhs, SearchRank)
+        self.assertIsInstance(rank.rhs, TrigramWordSimilarity)
+        where = str(queryset.query.where)
+        self.assertIn('SearchVectorExact', where)
+        self.assertIn("TrigramWordSimilar(Col(apploc_property, apploc.Property.location), 'yaounde bastos')", where)
+        query = rank.lhs.source_expressions[1]
+        self.assertIsInstance(query, SearchQuery)
+        self.assertEqual((query.config.config.value, query.function), (search.TS_CONFIG, 'websearch_to_tsquery'))
+
+    def test_postgres_index_weights_fields(self):
+        with mock.patch.object(Property.all_objects, 'filter') as filter_:
+            search.index_property(self.in_category, connection=mock.Mock(vendor='postgresql'))
+        vector = filter_.return_value.update.call_args.kwargs['search_vector']
+        parts = []
+        while hasattr(vector, 'rhs'):
+            parts.insert(0, vector.rhs)
+            vector = vector.lhs
+        parts.insert(0, vector)
+        self.assertEqual(
+            [(part.source_expressions[0].value, part.weight.value) for part in parts],
+            [('Odza', 'A'), ('Villa', 'B'), ('Jardin arboré', 'C')],
+        )
+
+    @skipUnless(connection.vendor == 'postgresql', 'pg_trgm')
+    def test_postgres_typo_matches_by_trigram(self):
+        self.assertEqual(self.search('Yaunde'), [self.in_location.pk])
+
+
+@override_settings(CACHES=TEST_CACHES, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class FacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'password', role='owner')
+        studio, villa = Category.objects.bulk_create([Category(name='Studio'), Category(name='Villa')])
+        Property.objects.bulk_create([
+            Property(
+                owner=owner, category=category, location='Yaoundé', price_per_month=Decimal(price),
+                description='Bien', contact_phone='699000000',
+            )
+            for category, price in ((studio, 50000), (studio, 150000), (villa, 150000), (villa, 600000))
+        ])
+        search.rebuild()
+
+    def setUp(self):
+        django_cache.clear()
+
+    def test_counts_in_one_cached_query(self):
+        filters = facets.normalize_filters({'location': ' YAOUNDE ', 'property_type': 'Studio', 'price_range': '100k_200k'})
+        with self.assertNumQueries(2):  # catégories + agrégat
+            counts = facets.facet_counts(filters)
+        self.assertEqual(counts['total'], 1)
+        # Chaque facette ignore son propre filtre mais applique les autres
+        self.assertEqual([(c['name'], c['count']) for c in counts['categories']], [('Studio', 1), ('Villa', 1)])
+        self.assertEqual([b['count'] for b in counts['price_ranges']], [1, 1, 0, 0])
+
+        same = facets.normalize_filters({'location': 'yaoundé', 'property_type': 'studio', 'price_range': '100k_200k'})
+        with self.assertNumQueries(0):
+            self.assertEqual(facets.facet_counts(same), counts)
+        # Autres filtres : catégories déjà en cache, une seule requête
+        with self.assertNumQueries(1):
+            facets.facet_counts(facets.normalize_filters({'price_range': 'over_500k'}))
+
+        Property.objects.filter(price_per_month=50000).update(price_per_month=Decimal('120000'))
+        with self.captureOnCommitCallbacks(execute=True):
+            cache.bump('properties')
+        self.assertEqual(facets.facet_counts(filters)['total'], 2)
+
+    def test_client_filters_are_bounded(self):
+        filters = facets.normalize_filters({'location': ' '.join(f'mot{i}' for i in range(100)), 'property_type': 'x' * 500})
+        self.assertEqual(len(filters['location'].split()), facets.MAX_LOCATION_TERMS)
+        self.assertEqual(len(filters['property_type']), facets.MAX_PROPERTY_TYPE_LENGTH)
+        with mock.patch.object(django_cache, 'set', wraps=django_cache.set) as cache_set:
+            facets.facet_counts(filters)
+        timeouts = {call.args[0].split(':')[1]: call.kwargs['timeout'] for call in cache_set.call_args_list}
+        self.assertEqual(timeouts['property_facets'], facets.FACETS_CACHE_TIMEOUT)
+
+    def test_search_page_shows_counts(self):
+        with translation.override('en'):
+            url = reverse('all_properties')
+        self.client.get(url, {'price_range': 'over_500k'})
+        with self.assertNumQueries(1):  # la page seule : comptes et catégories en cache
+            response = self.client.get(url, {'price_range': 'over_500k'})
+        self.assertEqual(response.context['facets']['total'], 1)
+        self.assertContains(response, 'Villa (1)')
+        self.assertContains(response, '1 property found')
+
+
+@override_settings(CACHES=TEST_CACHES)
+class GeoTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'password', role='owner')
+        category = Category.objects.create(name='Studio')
+        cls.properties = {
+            location: Property.objects.create(
+                owner=owner, category=category, location=location, price_per_month=Decimal('50000'),
+                description='Bien', contact_phone='699000000',
+            )
+            for location in ('Yaoundé centre', 'Bastos, Yaoundé', 'Mvog-Mbi', 'Akwa, Douala', 'Village inconnu')
+        }
+
+    def setUp(self):
+        django_cache.clear()
+
+    def test_offline_geocoding(self):
+        yaounde = geo.geocode('Yaoundé')
+        self.assertEqual(geo.geocode('appartement à YAOUNDE quartier 12'), yaounde)
+        # Le nom le plus long, puis le premier : le quartier plutôt que la ville
+        self.assertEqual(geo.geocode('Bastos, Yaoundé'), geo.geocode('bastos'))
+        self.assertEqual(geo.geocode('Mvog Mbi'), geo.geocode('Mvog-Mbi'))
+        self.assertIsNone(geo.geocode('Village inconnu'))
+
+        prop = self.properties['Village inconnu']
+        self.assertIsNone(prop.latitude)
+        prop.location = 'Akwa'
+        prop.save()
+        self.assertEqual((prop.latitude, prop.longitude), geo.geocode('Akwa'))
+
+    def test_geonames_gazetteer(self):
+        rows = [
+            ['1', 'Kribi', 'Kribi', '', '2.9404', '9.9101'] + [''] * 8 + ['70000'],
+            ['2', 'Kribi', 'Kribi', 'Kribi Village', '3.5', '10.5'] + [''] * 8 + ['300'],
+        ]
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', encoding='utf-8') as fh:
+            fh.write(''.join('\t'.join(row) + '\n' for row in rows))
+            fh.flush()
+            entries = geo.load_gazetteer(fh.name)
+        self.assertEqual(entries['kribi'], (2.9404, 9.9101))
+        self.assertEqual(entries['kribi village'], (3.5, 10.5))
+
+    def test_radius_search_ordered_by_distance(self):
+        latitude, longitude = geo.geocode('Yaoundé')
+        nearby = list(geo.within_radius(Property.objects.all(), latitude, longitude, 10).order_by('distance_km', 'id'))
+        self.assertEqual([p.location for p in nearby], ['Yaoundé centre', 'Mvog-Mbi', 'Bastos, Yaoundé'])
+        for prop in nearby:
+            self.assertAlmostEqual(prop.distance_km, geo.haversine_km(latitude, longitude, prop.latitude, prop.longitude), places=6)
+        self.assertEqual(geo.within_radius(Property.objects.all(), latitude, longitude, 3).count(), 2)
+        self.assertIsNone(geo.bounding_box(0, 179.99, 10)[2])
+
+    def test_all_properties_near_a_place(self):
+        with translation.override('en'):
+            url = reverse('all_properties')
+            response = self.client.get(url, {'near': 'Yaoundé', 'radius': '5', 'sort': 'distance'})
+        self.assertEqual([p.location for p in response.context['properties']], ['Yaoundé centre', 'Mvog-Mbi'])
+        self.assertEqual(response.context['facets']['total'], 2)
+        self.assertContains(response, '2.3 km away')
+
+        latitude, longitude = geo.geocode('Akwa')
+        response = self.client.get(url, {'lat': latitude, 'lng': longitude, 'radius': '2'})
+        self.assertEqual([p.location for p in response.context['properties']], ['Akwa, Douala'])
+
+
+@override_settings(STORAGES=TEST_STORAGES, CACHES=TEST_CACHES, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class PropertyDetailTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = CustomUser.objects.create_user('owner', 'owner@example.com', 'password', role='owner')
+        cls.tenant = CustomUser.objects.create_user('tenant', 'tenant@example.com', 'password')
+        cls.property = Property.objects.create(
+            owner=owner, category=Category.objects.create(name='Studio'), location='Douala',
+            price_per_month=Decimal('50000'), description='Bien', contact_phone='699000000',
+        )
+        with translation.override('en'):
+            cls.url = reverse('property_detail', kwargs={'property_id': cls.property.pk})
+
+    def setUp(self):
+        django_cache.clear()
+
+    def add_content(self, n):
+        Photo.objects.bulk_create([Photo(property=self.property, image=f'p{i}.png', order=i) for i in range(n)])
+        Review.objects.bulk_create([
+            Review(property=self.property, tenant=self.tenant, message=f'Avis {i}') for i in range(n)
+        ])
+
+    def test_fixed_queries_whatever_the_content(self):
+        self.client.force_login(self.tenant)
+        for n in (1, 5):
+            self.add_content(n)
+            # utilisateur (session en cache) + propriété (catégorie, propriétaire) + photos + vidéos + avis
+            with self.assertNumQueries(5):
+                self.client.get(self.url)
+
+    def test_anonymous_page_cached_until_change(self):
+        self.add_content(2)
+        Photo.objects.filter(order=1).update(deleted_at=timezone.now())
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url)
+        self.assertContains(response, 'p0.png')
+        self.assertNotContains(response, 'p1.png')
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(self.url), 'p0.png')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(property=self.property, tenant=self.tenant, message='Nouvel avis')
+        self.assertContains(self.client.get(self.url), 'Nouvel avis')
+
+        # Les visiteurs connectés ne reçoivent jamais la version anonyme
+        self.client.force_login(self.tenant)
+        self.assertContains(self.client.get(self.url), 'tenant@example.com')
+
+
+@override_settings(STORAGES=TEST_STORAGES, CACHES=TEST_CACHES, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.fixtures_data = seed(scale=0)
+
+    def request(self, url, user=None):
+        request = AsyncRequestFactory().get(url)
+        if user is not None:
+            self.client.force_login(user)
+            request.COOKIES[settings.SESSION_COOKIE_NAME] = self.client.session.session_key
+        for middleware in (SessionMiddleware, AuthenticationMiddleware, MessageMiddleware):
+            middleware(lambda request: None).process_request(request)
+        return request
+
+    def test_async_views_render_like_sync_views(self):
+        data = self.fixtures_data
+        cases = [
+            ('home', app_views.home, app_views.ahome, {}),
+            ('all_properties', property_views.all_properties, property_views.aall_properties, {}),
+            ('property_detail', property_views.property_detail, property_views.aproperty_detail, {'property_id': data['property'].pk}),
+            ('all_reviews', review_views.all_reviews, review_views.aall_reviews, {}),
+        ]
+        # Jetons CSRF et curseurs signés : horodatés, donc différents d'un rendu à l'autre
+        volatile = re.compile(rb'name="csrfmiddlewaretoken" value="[^"]*"|cursor=[^"&]*')
+        for name, view, async_view, kwargs in cases:
+            for user in (None, data['tenant']):
+                with self.subTest(view=name, user=user), translation.override('en'):
+                    url = reverse(name, kwargs=kwargs)
+                    django_cache.clear()
+                    expected = view(self.request(url, user), **kwargs)
+                    django_cache.clear()
+                    # Une requête paresseuse pendant le rendu lèverait SynchronousOnlyOperation
+                    response = async_to_sync(async_view)(self.request(url, user), **kwargs)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(volatile.sub(b'', response.content), volatile.sub(b'', expected.content))
+
+    async def test_async_middleware_stack(self):
+        with translation.override('en'):
+            url = reverse('all_properties')
+        await django_cache.aclear()  # cache froid : la page interroge la base
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        queries = int(re.search(r'desc="(\d+) queries"', response['Server-Timing']).group(1))
+        self.assertGreater(queries, 0)
+
+
+@override_settings(STORAGES=TEST_STORAGES, CACHES=TEST_CACHES, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.fixtures_data = seed(scale=0)
+
+    def setUp(self):
+        django_cache.clear()
+        data = self.fixtures_data
+        with translation.override('en'):
+            self.urls = [
+                reverse('home'), reverse('all_properties'), reverse('all_reviews'),
+                reverse('property_detail', kwargs={'property_id': data['property'].pk}),
+            ]
+
+    def test_unchanged_page_is_not_modified_without_queries(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response['ETag'].startswith('W/'))
+                self.assertEqual(response['Cache-Control'], 'no-cache')
+                with self.assertNumQueries(0):
+                    not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(not_modified.status_code, 304)
+                self.assertEqual(not_modified['ETag'], response['ETag'])
+                since = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+                self.assertEqual(since.status_code, 304)
+
+    def test_change_invalidates_validators(self):
+        url = self.urls[-1]
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(property=self.fixtures_data['property'], tenant=self.fixtures_data['tenant'], message='Nouvel avis')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, 'Nouvel avis')
+
+    def test_cache_loss_never_revalidates_old_etag(self):
+        url = self.urls[1]
+        etag = self.client.get(url)['ETag']
+        django_cache.clear()  # flush / éviction : les générations repartent d'une autre valeur
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_csrf_cookie_kept_in_sync_with_cached_forms(self):
+        url = self.urls[0]
+        etag = self.client.get(url)['ETag']
+        not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertIn(settings.CSRF_COOKIE_NAME, not_modified.cookies)
+        # Sans le cookie, le jeton de la page en cache ne serait plus valable : page complète
+        other = Client()
+        self.assertEqual(other.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_api_responses_do_not_set_csrf_cookie(self):
+        url = reverse('api_properties')
+        response = self.client.get(url)
+        self.assertNotIn(settings.CSRF_COOKIE_NAME, response.cookies)
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+        # Pas de secret CSRF dans l'ETag : un autre client anonyme revalide la même version
+        self.assertEqual(Client().get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_authenticated_pages_are_private(self):
+        url = self.urls[-1]
+        anonymous = self.client.get(url)
+        self.client.force_login(self.fixtures_data['tenant'])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=anonymous['ETag'])
+        # Jamais la version anonyme en cache ; pas de Last-Modified, qui ne couvre pas le compte
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Last-Modified', response)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_pending_message_bypasses_not_modified(self):
+        url = self.urls[0]
+        etag = self.client.get(url)['ETag']
+        self.client.cookies['messages'] = 'pending'
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_async_view_not_modified(self):
+        def request(headers=None):
+            request = AsyncRequestFactory().get(self.urls[1], headers=headers)
+            for middleware in (SessionMiddleware, AuthenticationMiddleware, MessageMiddleware):
+                middleware(lambda request: None).process_request(request)
+            return request
+
+        view = async_to_sync(property_views.aall_properties)
+        with translation.override('en'):
+            first = request()
+            etag = view(first)['ETag']
+            second = request(headers={'If-None-Match': etag})
+            # Le client renvoie le cookie CSRF reçu avec la première page
+            second.COOKIES[settings.CSRF_COOKIE_NAME] = first.META['CSRF_COOKIE']
+            CsrfViewMiddleware(lambda request: None).process_request(second)
+            self.assertEqual(view(second).status_code, 304)
+
+
+@override_settings(STORAGES=TEST_STORAGES, CACHES=TEST_CACHES)
+class ApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.fixtures_data = seed(scale=0)
+
+    def setUp(self):
+        django_cache.clear()
+
+    def test_cursor_pagination_covers_every_property_once(self):
+        url, ids = reverse('api_properties') + '?limit=7', []
+        while url:
+            with self.assertNumQueries(1):
+                payload = self.client.get(url).json()
+            self.assertLessEqual(len(payload['results']), 7)
+            ids += [row['id'] for row in payload['results']]
+            url = payload['next']
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(set(ids), {str(pk) for pk in Property.objects.values_list('pk', flat=True)})
+
+    def test_sparse_fieldset_reads_only_requested_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('api_properties'), {'fields': 'id,location', 'limit': 3})
+        self.assertEqual([set(row) for row in response.json()['results']], [{'id', 'location'}] * 3)
+        self.assertNotIn('description', queries[0]['sql'])
+        self.assertEqual(self.client.get(reverse('api_properties'), {'fields': 'id,owner'}).status_code, 400)
+
+    def test_filters_match_html_search(self):
+        params = {'price_range': '200k_500k', 'property_type': 'villa', 'format': 'ndjson'}
+        response = self.client.get(reverse('api_properties'), params)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        expected = facets.filter_properties(Property.objects.all(), facets.normalize_filters(params))
+        self.assertEqual([row['id'] for row in rows], [str(pk) for pk in expected.order_by('-created_at', '-id').values_list('pk', flat=True)])
+        self.assertTrue(rows)
+        self.assertTrue(all(row['category'] == 'Villa' for row in rows))
+
+    def test_reviews_and_photos(self):
+        prop = self.fixtures_data['property']
+        payload = self.client.get(reverse('api_reviews'), {'property': prop.pk, 'fields': 'property,rating'}).json()
+        self.assertEqual(len(payload['results']), min(20, prop.reviews.count()))
+        self.assertTrue(all(row['property'] == str(prop.pk) for row in payload['results']))
+        self.assertEqual(self.client.get(reverse('api_reviews'), {'property': 'x'}).status_code, 400)
+
+        photos = self.client.get(reverse('api_property_photos', kwargs={'property_id': prop.pk})).json()['results']
+        self.assertEqual([photo['order'] for photo in photos], sorted(photo['order'] for photo in photos))
+        self.assertTrue(photos[0]['image'].endswith('.png'))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RateLimitTests(TestCase):
+    def test_sliding_window(self):
+        for t in (0, 10, 20):
+            self.assertEqual(ratelimit.hit('test', 'a@example.com', 3, 60, now=1000 * 60 + t), 0)
+        self.assertGreater(ratelimit.hit('test', 'a@example.com', 3, 60, now=1000 * 60 + 30), 0)
+        # Fenêtre suivante : les 3 tentatives précédentes pèsent encore au prorata
+        self.assertEqual(ratelimit.hit('test', 'a@example.com', 3, 60, now=1001 * 60 + 5), 0)  # 2.75
+        self.assertGreater(ratelimit.hit('test', 'a@example.com', 3, 60, now=1001 * 60 + 10), 0)  # 2.5 + 1
+        self.assertEqual(ratelimit.hit('test', 'a@example.com', 3, 60, now=1001 * 60 + 45), 0)  # 0.75 + 1
+
+    def test_concurrent_hits_never_exceed_the_limit(self):
+        results = []
+
+        def attempt():
+            results.append(ratelimit.hit('test', 'b@example.com', 5, 60, now=2000 * 60))
+
+        threads = [threading.Thread(target=attempt) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(0), 5)
+
+    @override_settings(RATE_LIMITS={'login': [('ip', '3/h'), ('email', '1/h')]})
+    def test_rejected_attempt_not_counted_by_earlier_rules(self):
+        request = RequestFactory().post('/', REMOTE_ADDR='10.0.0.3')
+        self.assertEqual(ratelimit.check(request, 'login', 'a@example.com'), 0)
+        # Refusées par la règle email : l'IP n'en garde pas la trace
+        for _ in range(3):
+            self.assertGreater(ratelimit.check(request, 'login', 'a@example.com'), 0)
+        self.assertEqual(ratelimit.check(request, 'login', 'b@example.com'), 0)
+        self.assertEqual(ratelimit.check(request, 'login', 'c@example.com'), 0)
+        self.assertGreater(ratelimit.check(request, 'login', 'd@example.com'), 0)
+
+    @override_settings(RATELIMIT_PROXY_COUNT=1)
+    def test_client_ip_behind_one_proxy(self):
+        request = RequestFactory().post('/', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='203.0.113.7, 198.51.100.2')
+        self.assertEqual(ratelimit.client_ip(request), '198.51.100.2')
+
+    def test_otp_guesses_rejected_before_any_query(self):
+        with translation.override('en'):
+            url = reverse('verify_email', kwargs={'email': 'victim@example.com'})
+        for i in range(5):
+            self.assertNotEqual(self.client.post(url, {'code': f'{1000 + i}'}).status_code, 429)
+        with self.assertNumQueries(0):
+            response = self.client.post(url, {'code': '1005'}, REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
@@ -1,9 +1,11 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 urlpatterns = [
-    path('', views.home, name='home'),
+    path('', views.ahome if settings.ASYNC_VIEWS else views.home, name='home'),
     path('about/', views.about, name='about'),
     path('contact/', views.contact, name='contact'),
     path('set-language/', views.set_language, name='set_language'),
+    path('perf/', views.perf_stats, name='perf_stats'),
 ]
\ No newline at end of file
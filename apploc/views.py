@@ -2,20 +2,69 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.utils.translation import gettext_lazy as _
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
 from django.forms import modelformset_factory
+from apploc.dispatch import enqueue
 from apploc.tasks import send_contact_email
 from location import settings
 from .forms import ContactForm
 from .models import Category, CustomUser, Property, Review, Photo, Video
-from django.utils.translation import activate
+from django.utils.translation import activate, get_language
+from django.template.loader import render_to_string
+from .cache import aget_or_build, get_or_build
+from .conditional import conditional
 from .models import CustomUser
+from .middleware import histogram
 
+def _featured_properties():
+    # Toutes les propriétés disponibles, comme avant la mise en cache du fragment
+    return Property.objects.select_related('category', 'cover_photo').filter(is_available=True).order_by('-created_at')
+
+def _latest_reviews():
+    return Review.objects.select_related('tenant').order_by('-date_posted', '-id')[:3]
+
+def _home_vary(request, user_type):
+    # Fragments mis en cache par langue, état de connexion et type d'utilisateur
+    # en session (lien de home_reviews), invalidés par apploc.signals
+    return (get_language(), request.user.is_authenticated, user_type)
+
+@conditional('properties', 'reviews')
 def home(request):
-    properties = Property.objects.filter(is_available=True, deleted_at__isnull=True)
-    reviews = Review.objects.select_related('tenant', 'property').filter(deleted_at__isnull=True).order_by('-date_posted')[:3]
+    vary = _home_vary(request, request.session.get('user_type'))
+
+    def build_properties():
+        return render_to_string('partials/home_properties.html', {'properties': _featured_properties()}, request)
+
+    def build_reviews():
+        return render_to_string('partials/home_reviews.html', {'reviews': _latest_reviews()}, request)
+
+    return render(request, 'home.html', {
+        'properties_html': get_or_build('home_properties', build_properties, groups=('properties',), vary=vary),
+        'reviews_html': get_or_build('home_reviews', build_reviews, groups=('reviews',), vary=vary),
+        'is_authenticated': request.user.is_authenticated
+    })
+
+@conditional('properties', 'reviews')
+async def ahome(request):
+    """
+    Version async de ``home`` (``settings.ASYNC_VIEWS``) : les données sont
+    lues avant le rendu, qui ne doit déclencher aucune requête.
+    """
+    request.user = await request.auser()
+    vary = _home_vary(request, await request.session.aget('user_type'))
+
+    async def build_properties():
+        properties = [prop async for prop in _featured_properties()]
+        return render_to_string('partials/home_properties.html', {'properties': properties}, request)
+
+    async def build_reviews():
+        reviews = [review async for review in _latest_reviews()]
+        return render_to_string('partials/home_reviews.html', {'reviews': reviews}, request)
+
     return render(request, 'home.html', {
-        'properties': properties,
-        'reviews': reviews,
+        'properties_html': await aget_or_build('home_properties', build_properties, groups=('properties',), vary=vary),
+        'reviews_html': await aget_or_build('home_reviews', build_reviews, groups=('reviews',), vary=vary),
         'is_authenticated': request.user.is_authenticated
     })
 
@@ -30,7 +79,8 @@ def contact(request):
         if form.is_valid():
             form.save()
             data = form.cleaned_data
-            send_contact_email.delay(
+            enqueue(
+                send_contact_email,
                 name=data['name'],
                 email=data['email'],
                 subject=data['subject'],
@@ -58,3 +108,8 @@ def set_language(request):
         return redirect(next_url)
     return redirect('/')
 
+@staff_member_required
+def perf_stats(request):
+    if request.method == 'POST' and request.POST.get('reset'):
+        histogram.clear()
+    return JsonResponse({'size': histogram.size, 'views': histogram.snapshot()})
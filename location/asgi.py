@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'location.settings')
+# Sous ASGI, les vues publiques en lecture sont servies par leur version async
+os.environ.setdefault('ASYNC_VIEWS', 'True')
 
 application = get_asgi_application()
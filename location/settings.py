@@ -12,9 +12,14 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from decouple import config
 from pathlib import Path
+import logging
 import os
 from django.urls import reverse_lazy 
 import dj_database_url
+import socket
+import tempfile
+from urllib.parse import urlparse
+from kombu import Queue
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -39,6 +44,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'apploc',
     'cloudinary',
     'cloudinary_storage',
@@ -48,8 +54,9 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    'apploc.middleware.PerformanceMiddleware',  # en premier : mesure toute la pile
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',  
+    'apploc.middleware.WhiteNoiseMiddleware',  # variante async de whitenoise.middleware.WhiteNoiseMiddleware
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',  # ← pour i18n
     'django.middleware.common.CommonMiddleware',
@@ -61,6 +68,24 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'location.urls'
 
+# Instrumentation (apploc.middleware)
+PERF_HISTOGRAM_SIZE = config('PERF_HISTOGRAM_SIZE', default=500, cast=int)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'apploc.perf': {
+            'handlers': ['console'],
+            'level': config('PERF_LOG_LEVEL', default='WARNING' if DEBUG else 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -78,6 +103,13 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'location.wsgi.application'
+ASGI_APPLICATION = 'location.asgi.application'
+
+# Versions async des vues publiques en lecture (home, all_properties,
+# property_detail, all_reviews) ; activé par défaut par location/asgi.py. Le
+# process web du procfile lit la même variable : gunicorn + workers uvicorn
+# (ASGI) si elle est vraie, gunicorn WSGI sinon
+ASYNC_VIEWS = config('ASYNC_VIEWS', default=False, cast=bool)
 
 
 
@@ -94,7 +126,8 @@ else:
     DATABASES = {
         'default': dj_database_url.config(
             default=config('DATABASE_URL'),
-            conn_max_age=600,
+            # Sous ASGI, chaque requête a sa propre connexion : pas de connexions persistantes
+            conn_max_age=0 if ASYNC_VIEWS else 600,
             ssl_require=True  # Activer SSL pour PostgreSQL sur Render
         )
     }
@@ -102,6 +135,28 @@ else:
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
+# Connexion par email en une requête ; ModelBackend pour l'admin (username)
+AUTHENTICATION_BACKENDS = [
+    'apploc.authentication.backends.EmailBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+# Profil de hash des mots de passe : le premier hasher sert aux nouveaux
+# hashs, les autres ne font que vérifier ; les anciens hashs sont réécrits à
+# la connexion. PASSWORD_HASHER_PROFILE=scrypt pour changer d'algorithme.
+PASSWORD_PBKDF2_ITERATIONS = config('PASSWORD_PBKDF2_ITERATIONS', default=1_000_000, cast=int)
+PASSWORD_SCRYPT_WORK_FACTOR = config('PASSWORD_SCRYPT_WORK_FACTOR', default=2 ** 14, cast=int)
+PASSWORD_HASHER_PROFILES = {
+    'pbkdf2': 'apploc.authentication.hashers.TunablePBKDF2PasswordHasher',
+    'scrypt': 'apploc.authentication.hashers.TunableScryptPasswordHasher',
+}
+PASSWORD_HASHER_PROFILE = config('PASSWORD_HASHER_PROFILE', default='pbkdf2')
+PASSWORD_HASHERS = [PASSWORD_HASHER_PROFILES[PASSWORD_HASHER_PROFILE]] + [
+    hasher for profile, hasher in PASSWORD_HASHER_PROFILES.items() if profile != PASSWORD_HASHER_PROFILE
+] + [
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+]
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -168,6 +223,11 @@ else:
 if not DEBUG:
     DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
 
+# Morceaux des envois vidéo reprenables : un volume partagé (disque monté sur
+# toutes les instances web et le worker media) dès qu'il y a plus d'une
+# machine ; vide, le répertoire temporaire local (instance unique)
+VIDEO_UPLOAD_TEMP_DIR = config('VIDEO_UPLOAD_TEMP_DIR', default='') or None
+
 
 LANGUAGES = [
     ('en', 'English'),
@@ -192,10 +252,110 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 
-#production
-CELERY_TASK_ALWAYS_EAGER = True
+# Exécution réelle par les workers ; CELERY_TASK_ALWAYS_EAGER=True pour tout exécuter dans la requête
+CELERY_TASK_ALWAYS_EAGER = config('CELERY_TASK_ALWAYS_EAGER', default=False, cast=bool)
 CELERY_TASK_EAGER_PROPAGATES = True
 
+# Files : otp (codes de vérification, latence critique), mail, media (photos, vidéos).
+# Un worker par file (voir procfile), avec sa propre concurrence et son prefetch.
+CELERY_TASK_QUEUES = (
+    Queue('otp', routing_key='otp'),
+    Queue('mail', routing_key='mail'),
+    Queue('media', routing_key='media'),
+)
+CELERY_TASK_DEFAULT_QUEUE = 'mail'
+CELERY_TASK_ROUTES = {
+    'apploc.tasks.send_verification_email': {'queue': 'otp'},
+    'apploc.tasks.send_reset_password_email': {'queue': 'otp'},
+    'apploc.tasks.send_contact_email': {'queue': 'mail'},
+    'apploc.tasks.generate_photo_renditions': {'queue': 'media'},
+    'apploc.tasks.transcode_video': {'queue': 'media'},
+    'apploc.tasks.assemble_video_upload': {'queue': 'media'},
+    'apploc.tasks.purge_expired_pending_users': {'queue': 'mail'},
+}
+CELERY_TASK_ACKS_LATE = True  # une tâche interrompue est relivrée
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1  # pas de tâches longues réservées derrière une autre
+CELERY_BROKER_CONNECTION_TIMEOUT = 1.0
+CELERY_BROKER_TRANSPORT_OPTIONS = {'socket_connect_timeout': 1.0, 'socket_timeout': 2.0}
+
+# Tâches périodiques (procfile : beat)
+CELERY_BEAT_SCHEDULE = {
+    'purge-expired-pending-users': {
+        'task': 'apploc.tasks.purge_expired_pending_users',
+        'schedule': config('PENDING_USER_PURGE_INTERVAL', default=15 * 60, cast=int),
+    },
+}
+
+# Repli sans broker : pool de threads local par file (apploc.dispatch)
+TASK_BROKER_RETRY_AFTER = config('TASK_BROKER_RETRY_AFTER', default=30, cast=int)
+TASK_LOCAL_WORKERS = {'otp': 4, 'mail': 2, 'media': 1}
+
+# Cache partagé (Redis). Compteurs de génération, limitation de débit, OTP et
+# sessions en dépendent entre instances : en production, REDIS_CACHE_URL est
+# requis et une panne de Redis remonte en erreur au lieu d'un repli silencieux.
+REDIS_CACHE_URL = config('REDIS_CACHE_URL', default='')
+
+
+def redis_available(url, timeout=0.2):
+    parsed = urlparse(url)
+    try:
+        with socket.create_connection((parsed.hostname or 'localhost', parsed.port or 6379), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+CACHE_KEY_PREFIX = config('CACHE_KEY_PREFIX', default='location')
+CACHE_VERSION = config('CACHE_VERSION', default=1, cast=int)  # incrémenter pour invalider tout le cache
+
+if DEBUG:
+    # Développement : Redis local s'il répond (base 1 ; Celery utilise la base 0), sinon cache fichier
+    candidate = REDIS_CACHE_URL or urlparse(CELERY_BROKER_URL)._replace(path='/1').geturl()
+    REDIS_CACHE_URL = candidate if redis_available(candidate) else ''
+elif not REDIS_CACHE_URL:
+    logging.getLogger('location.settings').error(
+        "REDIS_CACHE_URL is not set: using a per-instance file cache, "
+        "cache invalidation, rate limits, OTP deduplication and sessions are not shared between instances"
+    )
+
+if REDIS_CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_CACHE_URL,
+            'KEY_PREFIX': CACHE_KEY_PREFIX,
+            'VERSION': CACHE_VERSION,
+            'TIMEOUT': config('CACHE_TIMEOUT', default=300, cast=int),
+            'OPTIONS': {
+                'max_connections': config('REDIS_MAX_CONNECTIONS', default=20, cast=int),
+                'socket_timeout': config('REDIS_SOCKET_TIMEOUT', default=0.5, cast=float),
+                'socket_connect_timeout': config('REDIS_CONNECT_TIMEOUT', default=0.5, cast=float),
+                'retry_on_timeout': True,
+                'health_check_interval': 30,
+            },
+        }
+    }
+else:
+    # Tests, DEBUG sans Redis, ou REDIS_CACHE_URL absent (erreur ci-dessus) : cache fichier local
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(tempfile.gettempdir(), 'location_cache'),
+            'KEY_PREFIX': CACHE_KEY_PREFIX,
+            'VERSION': CACHE_VERSION,
+        }
+    }
+
+# Limitation de débit (apploc.ratelimit) : nombre de proxys devant l'application
+# dont on accepte l'en-tête X-Forwarded-For (0 = REMOTE_ADDR). En production sur
+# Render (variable RENDER posée par la plateforme), le répartiteur de charge est
+# le seul proxy : 1. Avec 0 derrière un proxy, tous les clients partagent
+# l'adresse du proxy et donc le même compteur.
+RATELIMIT_PROXY_COUNT = config('RATELIMIT_PROXY_COUNT', default=1 if config('RENDER', default=False, cast=bool) else 0, cast=int)
+
+# Sessions lues depuis le cache, écrites en base (survivent à un vidage du cache)
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
 
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
@@ -5,7 +5,12 @@ from django.conf.urls.static import static
 from django.conf.urls.i18n import i18n_patterns
 
 
-urlpatterns = i18n_patterns(
+# API du client mobile : hors préfixe de langue
+urlpatterns = [
+    path('api/', include('apploc.api.urls')),
+]
+
+urlpatterns += i18n_patterns(
     path('admin/', admin.site.urls),
     path('auth/', include('apploc.authentication.urls')),
     path('pro/', include('apploc.reviews.urls')),